@@ -50,18 +50,19 @@ def inport_value_hack(outport):
         return 2
 
 
-class BackendChannel(asynchat.async_chat):
+class BackendChannel(asynchat.async_chat, FramedChannel):
     """Sends messages to the server and receives responses.
     """
     def __init__(self, host, port, of_client):
         self.of_client = of_client
-        self.received_data = []
         asynchat.async_chat.__init__(self)
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
         self.connect((host, port))
         self.ac_in_buffer_size = 4096 * 3
         self.ac_out_buffer_size = 4096 * 3
-        self.set_terminator(TERM_CHAR)
+        self.init_framing()
+        # offer the framings we speak; JSON is used until the backend answers
+        self.push(self.frame(['hello', FRAMINGS]))
         self.start_time = 0
         self.interval = 0
         self.total_interval = 0
@@ -94,10 +95,24 @@ class BackendChannel(asynchat.async_chat):
     def found_terminator(self):
         """The end of a command or message has been seen."""
         with self.of_client.channel_lock:
-            msg = deserialize(self.received_data)
+            if self.read_frame_header():
+                return
+            msg = self.read_message()
+
+        if msg is None or len(msg) == 0:
+            print "ERROR: empty message"
+            return
+
+        # The backend's answer to our hello is the last message it sends in
+        # the old framing. Tell it ours switches too, then switch.
+        if msg[0] == 'hello':
+            with self.of_client.channel_lock:
+                self.set_in_framing(msg[1])
+                self.push(self.frame(['framing', msg[1]]))
+                self.out_framing = msg[1]
 
         # Set up time for starting rule installs.
-        if msg[0] == 'reset_install_time':
+        elif msg[0] == 'reset_install_time':
             self.start_time = time.time()
             # TODO(): need logging levels in of client also!
             # print "[path_queries] Last rule interval:", self.interval,
@@ -130,6 +145,18 @@ class BackendChannel(asynchat.async_chat):
             pred = self.dict2OF(msg[1])
             priority = int(msg[2])
             self.of_client.delete_flow(pred,priority)
+        elif msg[0] == 'install_batch':
+            switch = msg[1]
+            to_delete = [(self.dict2OF(pred),int(priority))
+                         for (pred,priority) in msg[2]]
+            to_install = [(self.dict2OF(pred),int(priority),
+                           map(self.dict2OF,actions),int(cookie),bool(notify))
+                          for (pred,priority,actions,cookie,notify) in msg[3]]
+            to_modify = [(self.dict2OF(pred),int(priority),
+                          map(self.dict2OF,actions),int(cookie),bool(notify))
+                         for (pred,priority,actions,cookie,notify) in msg[4]]
+            self.of_client.install_batch(switch,to_delete,to_install,to_modify)
+            self.interval = time.time() - self.start_time
         elif msg[0] == 'clear':
             switch = int(msg[1])
             self.of_client.clear(switch)
@@ -260,10 +287,9 @@ class POXClient(revent.EventMixin):
 
 
     def send_to_pyretic(self,msg):
-        serialized_msg = serialize(msg)
         try:
             with self.channel_lock:
-                self.backend_channel.push(serialized_msg)
+                self.backend_channel.push(self.backend_channel.frame(msg))
         except IndexError as e:
             print "ERROR PUSHING MESSAGE %s" % msg
             pass
@@ -372,7 +398,7 @@ class POXClient(revent.EventMixin):
                 of_actions.append(of.ofp_action_output(port=outport))
         return of_actions
 
-    def flow_mod_action(self,pred,priority,action_list,cookie,command,notify):
+    def build_flow_mod(self,pred,priority,action_list,cookie,command,notify):
         switch = pred['switch']
         if 'inport' in pred:        
             inport = pred['inport']
@@ -402,6 +428,11 @@ class POXClient(revent.EventMixin):
                                   flags=flags,
                                   cookie=cookie,
                                   actions=of_actions)
+        return msg
+
+    def flow_mod_action(self,pred,priority,action_list,cookie,command,notify):
+        switch = pred['switch']
+        msg = self.build_flow_mod(pred,priority,action_list,cookie,command,notify)
         try:
             self.switches[switch]['connection'].send(msg)
         except RuntimeError, e:
@@ -415,16 +446,20 @@ class POXClient(revent.EventMixin):
     def modify_flow(self,pred,priority,action_list,cookie,notify):
         self.flow_mod_action(pred,priority,action_list,cookie,of.OFPFC_MODIFY_STRICT,notify)
 
-    def delete_flow(self,pred,priority):
+    def build_delete_flow_mod(self,pred,priority):
         switch = pred['switch']
         if 'inport' in pred:        
             inport = pred['inport']
         else:
             inport = None
         match = self.build_of_match(switch,inport,pred)
-        msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT,
-                              priority=priority,
-                              match=match)
+        return of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT,
+                               priority=priority,
+                               match=match)
+
+    def delete_flow(self,pred,priority):
+        switch = pred['switch']
+        msg = self.build_delete_flow_mod(pred,priority)
         try:
             self.switches[switch]['connection'].send(msg)
         except RuntimeError, e:
@@ -432,6 +467,26 @@ class POXClient(revent.EventMixin):
         except KeyError, e:
             print "WARNING:delete_flow: No connection to switch %d available" % switch
 
+    def install_batch(self,switch,to_delete,to_install,to_modify):
+        """Apply a batch of rule updates to a switch, packing the flow_mods
+        and a closing barrier into a single write to its connection."""
+        msgs = [self.build_delete_flow_mod(pred,priority)
+                for (pred,priority) in to_delete]
+        msgs += [self.build_flow_mod(pred,priority,actions,cookie,
+                                     of.OFPFC_ADD,notify)
+                 for (pred,priority,actions,cookie,notify) in to_install]
+        msgs += [self.build_flow_mod(pred,priority,actions,cookie,
+                                     of.OFPFC_MODIFY_STRICT,notify)
+                 for (pred,priority,actions,cookie,notify) in to_modify]
+        msgs.append(of.ofp_barrier_request())
+        try:
+            self.switches[switch]['connection'].send(
+                ''.join(msg.pack() for msg in msgs))
+        except RuntimeError, e:
+            print "WARNING:install_batch: %s to switch %d" % (str(e),switch)
+        except KeyError, e:
+            print "WARNING:install_batch: No connection to switch %d available" % switch
+
     def barrier(self,switch):
         b = of.ofp_barrier_request()
         self.switches[switch]['connection'].send(b) 
@@ -0,0 +1,743 @@
+
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+# author: Joshua Reich (jreich@cs.princeton.edu)                               #
+# author: Christopher Monsanto (chris@monsan.to)                               #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# OpenFlow 1.3 client, used for multi-table (--multitable) installs. Speaks    #
+# the same backend protocol as the POX client, and runs under ryu:             #
+#   python -m of_client.ryu13_client                                           #
+################################################################################
+
+import pyretic.vendor
+
+import socket
+import struct
+import sys
+import threading
+import time
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import DEAD_DISPATCHER, set_ev_cls
+from ryu.lib import hub
+from ryu.lib.packet import packet as packetlib, ethernet, lldp
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser, ether
+
+from pyretic.backend.comm import *
+
+# The runtime numbers the reserved ports as OpenFlow 1.0 does, at the top of
+# the 16-bit range; OpenFlow 1.3 puts them at the top of the 32-bit range.
+OF10_OFPP_MAX = 0xff00
+OF10_OFPP_IN_PORT = 0xfff8
+OF10_OFPP_NONE = 0xffff
+OF13_RESERVED = 0xffff0000
+
+METADATA_MASK = 0xffffffffffffffff
+
+
+def of13_port(port):
+    if OF10_OFPP_MAX <= port <= OF10_OFPP_NONE:
+        return port | OF13_RESERVED
+    return port
+
+def of10_port(port):
+    if port >= OF13_RESERVED | OF10_OFPP_MAX:
+        return port & OF10_OFPP_NONE
+    return port
+
+def mac_str(val):
+    if len(val) == 6:
+        return ':'.join('%02x' % ord(c) for c in val)
+    return val
+
+def mac_raw(val):
+    return ''.join(chr(int(b, 16)) for b in val.split(':'))
+
+def ip_str(val):
+    """An address or (address, mask) as ryu's OFPMatch takes them."""
+    if len(val) == 4:
+        return socket.inet_ntoa(val)
+    if '/' in val:
+        (addr, prefixlen) = val.split('/')
+        mask = (0xffffffff << (32 - int(prefixlen))) & 0xffffffff
+        return (addr, socket.inet_ntoa(struct.pack('!I', mask)))
+    return val
+
+def ip_raw(val):
+    if isinstance(val, tuple):
+        val = val[0]
+    return socket.inet_aton(val)
+
+def transport_fields(protocol):
+    """The OXM fields standing for srcport and dstport under an IP
+    protocol."""
+    if protocol == 17:
+        return ('udp_src', 'udp_dst')
+    elif protocol == 1:
+        return ('icmpv4_type', 'icmpv4_code')
+    return ('tcp_src', 'tcp_dst')
+
+
+class BackendChannel(asynchat.async_chat, FramedChannel):
+    """Sends messages to the server and receives responses.
+    """
+    def __init__(self, host, port, of_client):
+        self.of_client = of_client
+        asynchat.async_chat.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect((host, port))
+        self.ac_in_buffer_size = 4096 * 3
+        self.ac_out_buffer_size = 4096 * 3
+        self.init_framing()
+        # offer the framings we speak; JSON is used until the backend answers
+        self.push(self.frame(['hello', FRAMINGS]))
+        return
+
+    def handle_connect(self):
+        print "Connected to pyretic frontend."
+
+    def collect_incoming_data(self, data):
+        """Read an incoming message from the client and put it into our outgoing queue."""
+        with self.of_client.channel_lock:
+            self.received_data.append(data)
+
+    def dict2OF(self,d):
+        def convert(h,val):
+            if h in ['srcmac','dstmac']:
+                return mac_str(val)
+            elif h in ['srcip','dstip']:
+                return ip_str(val)
+            elif h in ['vlan_id','vlan_pcp'] and val == 'None':
+                return None
+            else:
+                return val
+        return { h : convert(h,val) for (h, val) in d.items()}
+
+    def found_terminator(self):
+        """The end of a command or message has been seen."""
+        with self.of_client.channel_lock:
+            if self.read_frame_header():
+                return
+            msg = self.read_message()
+
+        if msg is None or len(msg) == 0:
+            print "ERROR: empty message"
+            return
+
+        # The backend's answer to our hello is the last message it sends in
+        # the old framing. Tell it ours switches too, then switch.
+        if msg[0] == 'hello':
+            with self.of_client.channel_lock:
+                self.set_in_framing(msg[1])
+                self.push(self.frame(['framing', msg[1]]))
+                self.out_framing = msg[1]
+        elif msg[0] == 'reset_install_time':
+            pass
+        elif msg[0] == 'inject_discovery_packet':
+            switch = msg[1]
+            port = msg[2]
+            self.of_client.inject_discovery_packet(switch,port)
+        elif msg[0] == 'packet':
+            self.of_client.send_to_switch(msg[1])
+        elif msg[0] == 'install' or msg[0] == 'modify':
+            pred = self.dict2OF(msg[1])
+            priority = int(msg[2])
+            actions = map(self.dict2OF,msg[3])
+            cookie = int(msg[4])
+            notify = bool(msg[5])
+            if msg[0] == 'install':
+                self.of_client.install_flow(pred,priority,actions,cookie,notify)
+            else:
+                self.of_client.modify_flow(pred,priority,actions,cookie,notify)
+        elif msg[0] == 'delete':
+            pred = self.dict2OF(msg[1])
+            priority = int(msg[2])
+            self.of_client.delete_flow(pred,priority)
+        elif msg[0] == 'install_batch':
+            switch = msg[1]
+            to_delete = [(self.dict2OF(pred),int(priority))
+                         for (pred,priority) in msg[2]]
+            to_install = [(self.dict2OF(pred),int(priority),
+                           map(self.dict2OF,actions),int(cookie),bool(notify))
+                          for (pred,priority,actions,cookie,notify) in msg[3]]
+            to_modify = [(self.dict2OF(pred),int(priority),
+                          map(self.dict2OF,actions),int(cookie),bool(notify))
+                         for (pred,priority,actions,cookie,notify) in msg[4]]
+            self.of_client.install_batch(switch,to_delete,to_install,to_modify)
+        elif msg[0] == 'clear':
+            switch = int(msg[1])
+            self.of_client.clear(switch)
+        elif msg[0] == 'barrier':
+            switch = msg[1]
+            self.of_client.barrier(switch)
+        elif msg[0] == 'flow_stats_request':
+            switch = msg[1]
+            self.of_client.flow_stats_request(switch)
+        else:
+            print "ERROR: Unknown msg from frontend %s" % msg
+
+
+class Ryu13Client(app_manager.RyuApp):
+    """
+    OpenFlow 1.3 client. Rule matches may carry the 'table' the rule goes in,
+    and actions a 'goto_table' to pass the packet on to. Forwarding to the
+    next table writes the output into the action set and the outport into
+    the metadata, which an 'outport' match in a later table is matched
+    against.
+    """
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(Ryu13Client, self).__init__(*args, **kwargs)
+        self.switches = {}
+        self.channel_lock = threading.Lock()
+        self.backend_channel = BackendChannel('127.0.0.1', BACKEND_PORT, self)
+        self.backend_loop = hub.spawn(asyncore.loop)
+
+    def send_to_pyretic(self,msg):
+        try:
+            with self.channel_lock:
+                self.backend_channel.push(self.backend_channel.frame(msg))
+        except IndexError as e:
+            print "ERROR PUSHING MESSAGE %s" % msg
+
+    def send_msg(self, switch, msg, caller):
+        try:
+            self.switches[switch]['datapath'].send_msg(msg)
+        except KeyError, e:
+            print ("WARNING:%s: No connection to switch %d available" %
+                   (caller, switch))
+
+    ### PACKETS
+
+    def send_to_switch(self,packet):
+        switch = packet['switch']
+        try:
+            dp = self.switches[switch]['datapath']
+        except KeyError:
+            print ("ERROR:send_to_switch: No connection to switch %d available"
+                   % switch)
+            return
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        outport = packet['outport']
+        inport = packet.get('inport', -1)
+        if inport == -1 or inport == outport:
+            inport = ofproto.OFPP_CONTROLLER
+        msg = parser.OFPPacketOut(datapath=dp,
+                                  buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=of13_port(inport),
+                                  actions=[parser.OFPActionOutput(
+                                      of13_port(outport))],
+                                  data=packet['raw'])
+        dp.send_msg(msg)
+
+    def create_discovery_packet(self, dpid, port_no, hw_addr):
+        eth = ethernet.ethernet(dst=lldp.LLDP_MAC_NEAREST_BRIDGE,
+                                src=hw_addr,
+                                ethertype=ether.ETH_TYPE_LLDP)
+        tlvs = [lldp.ChassisID(subtype=lldp.ChassisID.SUB_LOCALLY_ASSIGNED,
+                               chassis_id='dpid:%x' % dpid),
+                lldp.PortID(subtype=lldp.PortID.SUB_PORT_COMPONENT,
+                            port_id=str(port_no)),
+                lldp.TTL(ttl=120),
+                lldp.End()]
+        pkt = packetlib.Packet()
+        pkt.add_protocol(eth)
+        pkt.add_protocol(lldp.lldp(tlvs))
+        pkt.serialize()
+        return pkt.data
+
+    def inject_discovery_packet(self, switch, port):
+        try:
+            hw_addr = self.switches[switch]['ports'][port]
+        except KeyError:
+            return
+        self.send_to_switch({'switch' : switch,
+                             'outport' : port,
+                             'raw' : str(self.create_discovery_packet(
+                                 switch, port, hw_addr))})
+
+    def handle_lldp(self, dpid, inport, lldph):
+        try:
+            chassis_id = lldph.tlvs[0].chassis_id
+            originatorDPID = int(chassis_id[len('dpid:'):], 16)
+            originatorPort = int(lldph.tlvs[1].port_id)
+        except (IndexError, AttributeError, ValueError):
+            return
+        if not originatorDPID in self.switches:
+            return
+        if (dpid, inport) == (originatorDPID, originatorPort):
+            return
+        self.send_to_pyretic(['link', originatorDPID, originatorPort,
+                              dpid, inport])
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def packet_in_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        inport = msg.match['in_port']
+        pkt = packetlib.Packet(msg.data)
+        eth = pkt.get_protocol(ethernet.ethernet)
+        if eth.ethertype == ether.ETH_TYPE_LLDP:
+            self.handle_lldp(dpid, inport, pkt.get_protocol(lldp.lldp))
+            return
+        elif eth.ethertype == ether.ETH_TYPE_IPV6:  # IGNORE IPV6
+            return
+        received = {'switch' : dpid, 'inport' : inport, 'raw' : msg.data,
+                    'table' : msg.table_id}
+        # the outport chosen by the forwarding table
+        metadata = msg.match.get('metadata')
+        if not metadata is None:
+            received['outport'] = metadata
+        self.send_to_pyretic(['packet', received])
+
+    ### RULES
+
+    def build_of_match(self, parser, pred):
+        fields = {}
+        if 'inport' in pred:
+            fields['in_port'] = pred['inport']
+        if 'outport' in pred:
+            fields['metadata'] = pred['outport']
+        if 'ethtype' in pred:
+            fields['eth_type'] = pred['ethtype']
+        if 'srcmac' in pred:
+            fields['eth_src'] = pred['srcmac']
+        if 'dstmac' in pred:
+            fields['eth_dst'] = pred['dstmac']
+        if 'vlan_id' in pred:
+            vlan_id = pred['vlan_id']
+            if vlan_id is None or vlan_id == OF10_OFPP_NONE:
+                fields['vlan_vid'] = ofproto_v1_3.OFPVID_NONE
+            else:
+                fields['vlan_vid'] = vlan_id | ofproto_v1_3.OFPVID_PRESENT
+        if 'vlan_pcp' in pred and not pred['vlan_pcp'] is None:
+            fields['vlan_pcp'] = pred['vlan_pcp']
+        if 'protocol' in pred:
+            fields['ip_proto'] = pred['protocol']
+        if 'srcip' in pred:
+            fields['ipv4_src'] = pred['srcip']
+        if 'dstip' in pred:
+            fields['ipv4_dst'] = pred['dstip']
+        if 'tos' in pred:
+            fields['ip_dscp'] = pred['tos'] >> 2
+        (src, dst) = transport_fields(pred.get('protocol'))
+        if 'srcport' in pred:
+            fields[src] = pred['srcport']
+        if 'dstport' in pred:
+            fields[dst] = pred['dstport']
+        return parser.OFPMatch(**fields)
+
+    def build_instructions(self, ofproto, parser, pred, action_list):
+        """
+        Header modifications and outputs go in an apply-actions instruction.
+        An action passing the packet on to another table writes its output
+        (if any) to the action set, for the last table of the pipeline to
+        apply, and the outport to the metadata. A rule of a later table that
+        outputs, sends to the controller or drops clears the action set.
+        """
+        inport = pred.get('inport')
+        protocol = pred.get('protocol')
+        tagged = not pred.get('vlan_id') in [None, OF10_OFPP_NONE]
+        apply_actions = []
+        write_actions = []
+        metadata = None
+        goto = None
+        for actions in action_list:
+            actions = dict(actions)
+            outport = actions.pop('outport', None)
+            next_table = actions.pop('goto_table', None)
+            (src, dst) = transport_fields(actions.get('protocol', protocol))
+            if 'srcmac' in actions:
+                apply_actions.append(parser.OFPActionSetField(
+                    eth_src=actions['srcmac']))
+            if 'dstmac' in actions:
+                apply_actions.append(parser.OFPActionSetField(
+                    eth_dst=actions['dstmac']))
+            if 'srcip' in actions:
+                apply_actions.append(parser.OFPActionSetField(
+                    ipv4_src=actions['srcip']))
+            if 'dstip' in actions:
+                apply_actions.append(parser.OFPActionSetField(
+                    ipv4_dst=actions['dstip']))
+            if 'srcport' in actions:
+                apply_actions.append(parser.OFPActionSetField(
+                    **{src : actions['srcport']}))
+            if 'dstport' in actions:
+                apply_actions.append(parser.OFPActionSetField(
+                    **{dst : actions['dstport']}))
+            if 'tos' in actions:
+                apply_actions.append(parser.OFPActionSetField(
+                    ip_dscp=actions['tos'] >> 2))
+            if 'vlan_id' in actions:
+                if actions['vlan_id'] is None:
+                    if tagged:
+                        apply_actions.append(parser.OFPActionPopVlan())
+                    tagged = False
+                else:
+                    if not tagged:
+                        apply_actions.append(parser.OFPActionPushVlan(
+                            ether.ETH_TYPE_8021Q))
+                    tagged = True
+                    apply_actions.append(parser.OFPActionSetField(
+                        vlan_vid=(actions['vlan_id'] |
+                                  ofproto.OFPVID_PRESENT)))
+            if 'vlan_pcp' in actions and not actions['vlan_pcp'] is None:
+                if actions.get('vlan_id', 0) is None:
+                    raise RuntimeError("vlan_id and vlan_pcp must be set together!")
+                apply_actions.append(parser.OFPActionSetField(
+                    vlan_pcp=actions['vlan_pcp']))
+            if not next_table is None:
+                goto = next_table
+            if outport is None:
+                continue
+            if (not inport is None) and (outport == inport):
+                outport = OF10_OFPP_IN_PORT
+            port = of13_port(outport)
+            if next_table is None:
+                max_len = (ofproto.OFPCML_NO_BUFFER
+                           if port == ofproto.OFPP_CONTROLLER
+                           else ofproto.OFPCML_MAX)
+                apply_actions.append(parser.OFPActionOutput(port, max_len))
+            else:
+                write_actions.append(parser.OFPActionOutput(port))
+                metadata = inport if outport == OF10_OFPP_IN_PORT else outport
+
+        instructions = []
+        if apply_actions:
+            instructions.append(parser.OFPInstructionActions(
+                ofproto.OFPIT_APPLY_ACTIONS, apply_actions))
+        passes = [a for a in action_list if not 'outport' in a]
+        if pred.get('table', 0) > 0 and goto is None and not passes:
+            instructions.append(parser.OFPInstructionActions(
+                ofproto.OFPIT_CLEAR_ACTIONS, []))
+        if write_actions:
+            instructions.append(parser.OFPInstructionActions(
+                ofproto.OFPIT_WRITE_ACTIONS, write_actions))
+        if not metadata is None:
+            instructions.append(parser.OFPInstructionWriteMetadata(
+                metadata, METADATA_MASK))
+        if not goto is None:
+            instructions.append(parser.OFPInstructionGotoTable(goto))
+        return instructions
+
+    def build_flow_mod(self,dp,pred,priority,action_list,cookie,command,notify):
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        flags = 0
+        if notify:
+            flags = ofproto.OFPFF_SEND_FLOW_REM
+        return parser.OFPFlowMod(datapath=dp,
+                                 cookie=cookie,
+                                 table_id=pred.get('table', 0),
+                                 command=command,
+                                 priority=priority,
+                                 buffer_id=ofproto.OFP_NO_BUFFER,
+                                 out_port=ofproto.OFPP_ANY,
+                                 out_group=ofproto.OFPG_ANY,
+                                 flags=flags,
+                                 match=self.build_of_match(parser, pred),
+                                 instructions=self.build_instructions(
+                                     ofproto, parser, pred, action_list))
+
+    def build_delete_flow_mod(self,dp,pred,priority):
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        return parser.OFPFlowMod(datapath=dp,
+                                 table_id=pred.get('table', 0),
+                                 command=ofproto.OFPFC_DELETE_STRICT,
+                                 priority=priority,
+                                 out_port=ofproto.OFPP_ANY,
+                                 out_group=ofproto.OFPG_ANY,
+                                 match=self.build_of_match(parser, pred))
+
+    def flow_mod_action(self,pred,priority,action_list,cookie,command,notify):
+        switch = pred['switch']
+        try:
+            dp = self.switches[switch]['datapath']
+        except KeyError:
+            print "WARNING:install_flow: No connection to switch %d available" % switch
+            return
+        dp.send_msg(self.build_flow_mod(dp,pred,priority,action_list,cookie,
+                                        command,notify))
+
+    def install_flow(self,pred,priority,action_list,cookie,notify):
+        self.flow_mod_action(pred,priority,action_list,cookie,
+                             ofproto_v1_3.OFPFC_ADD,notify)
+
+    def modify_flow(self,pred,priority,action_list,cookie,notify):
+        self.flow_mod_action(pred,priority,action_list,cookie,
+                             ofproto_v1_3.OFPFC_MODIFY_STRICT,notify)
+
+    def delete_flow(self,pred,priority):
+        switch = pred['switch']
+        try:
+            dp = self.switches[switch]['datapath']
+        except KeyError:
+            print "WARNING:delete_flow: No connection to switch %d available" % switch
+            return
+        dp.send_msg(self.build_delete_flow_mod(dp,pred,priority))
+
+    def install_batch(self,switch,to_delete,to_install,to_modify):
+        """Apply a batch of rule updates to a switch, closed by a barrier."""
+        try:
+            dp = self.switches[switch]['datapath']
+        except KeyError:
+            print "WARNING:install_batch: No connection to switch %d available" % switch
+            return
+        msgs = [self.build_delete_flow_mod(dp,pred,priority)
+                for (pred,priority) in to_delete]
+        msgs += [self.build_flow_mod(dp,pred,priority,actions,cookie,
+                                     ofproto_v1_3.OFPFC_ADD,notify)
+                 for (pred,priority,actions,cookie,notify) in to_install]
+        msgs += [self.build_flow_mod(dp,pred,priority,actions,cookie,
+                                     ofproto_v1_3.OFPFC_MODIFY_STRICT,notify)
+                 for (pred,priority,actions,cookie,notify) in to_modify]
+        msgs.append(dp.ofproto_parser.OFPBarrierRequest(dp))
+        for msg in msgs:
+            dp.send_msg(msg)
+
+    def barrier(self,switch):
+        try:
+            dp = self.switches[switch]['datapath']
+        except KeyError:
+            return
+        dp.send_msg(dp.ofproto_parser.OFPBarrierRequest(dp))
+
+    def clear(self,switch=None):
+        if switch is None:
+            for switch in self.switches.keys():
+                self.clear(switch)
+            return
+        try:
+            dp = self.switches[switch]['datapath']
+        except KeyError:
+            return
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        dp.send_msg(parser.OFPFlowMod(datapath=dp,
+                                      table_id=ofproto.OFPTT_ALL,
+                                      command=ofproto.OFPFC_DELETE,
+                                      out_port=ofproto.OFPP_ANY,
+                                      out_group=ofproto.OFPG_ANY,
+                                      match=parser.OFPMatch()))
+
+    ### STATS
+
+    def flow_stats_request(self,switch):
+        try:
+            dp = self.switches[switch]['datapath']
+        except KeyError:
+            print ( ("ERROR:flow_stats_request: No connection to switch %d" +
+                     " available") % switch )
+            return
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        dp.send_msg(parser.OFPFlowStatsRequest(dp, 0, ofproto.OFPTT_ALL,
+                                               ofproto.OFPP_ANY,
+                                               ofproto.OFPG_ANY, 0, 0,
+                                               parser.OFPMatch()))
+
+    def of_match_to_dict(self, m, table_id):
+        h = {'table' : table_id}
+        for (field, val) in m._fields2:
+            if isinstance(val, tuple):
+                val = val[0]
+            if field == 'in_port':
+                h['inport'] = val
+            elif field == 'metadata':
+                h['outport'] = val
+            elif field == 'eth_src':
+                h['srcmac'] = mac_raw(val)
+            elif field == 'eth_dst':
+                h['dstmac'] = mac_raw(val)
+            elif field == 'eth_type':
+                h['ethtype'] = val
+            elif field == 'vlan_vid':
+                if val & ofproto_v1_3.OFPVID_PRESENT:
+                    h['vlan_id'] = val & ~ofproto_v1_3.OFPVID_PRESENT
+                else:
+                    h['vlan_id'] = OF10_OFPP_NONE
+            elif field == 'vlan_pcp':
+                h['vlan_pcp'] = val
+            elif field == 'ipv4_src':
+                h['srcip'] = ip_raw(val)
+            elif field == 'ipv4_dst':
+                h['dstip'] = ip_raw(val)
+            elif field == 'ip_proto':
+                h['protocol'] = val
+            elif field == 'ip_dscp':
+                h['tos'] = val << 2
+            elif field in ['tcp_src', 'udp_src', 'icmpv4_type']:
+                h['srcport'] = val
+            elif field in ['tcp_dst', 'udp_dst', 'icmpv4_code']:
+                h['dstport'] = val
+        return h
+
+    def of_instructions_to_dicts(self, instructions):
+        action_dicts = []
+        for inst in instructions:
+            for a in getattr(inst, 'actions', []):
+                d = {}
+                if a.cls_action_type == ofproto_v1_3.OFPAT_OUTPUT:
+                    d['output'] = of10_port(a.port)
+                elif a.cls_action_type == ofproto_v1_3.OFPAT_POP_VLAN:
+                    d['strip_vlan_id'] = 0
+                elif a.cls_action_type == ofproto_v1_3.OFPAT_SET_FIELD:
+                    d.update(self.of_match_to_dict(
+                        ofproto_v1_3_parser.OFPMatch(**{a.key : a.value}),
+                        None))
+                    del d['table']
+                action_dicts.append(d)
+        return action_dicts
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        def handle_ofp_flow_stat(flow_stat):
+            flow_stat_dict = {}
+            flow_stat_dict['table_id'] = flow_stat.table_id
+            flow_stat_dict['duration_sec'] = flow_stat.duration_sec
+            flow_stat_dict['duration_nsec'] = flow_stat.duration_nsec
+            flow_stat_dict['priority'] = flow_stat.priority
+            flow_stat_dict['idle_timeout'] = flow_stat.idle_timeout
+            flow_stat_dict['hard_timeout'] = flow_stat.hard_timeout
+            flow_stat_dict['cookie'] = flow_stat.cookie
+            flow_stat_dict['packet_count'] = flow_stat.packet_count
+            flow_stat_dict['byte_count'] = flow_stat.byte_count
+            flow_stat_dict['match'] = self.of_match_to_dict(flow_stat.match,
+                                                            flow_stat.table_id)
+            flow_stat_dict['actions'] = self.of_instructions_to_dicts(
+                flow_stat.instructions)
+            return flow_stat_dict
+        flow_stats = [handle_ofp_flow_stat(s) for s in ev.msg.body]
+        self.send_to_pyretic(['flow_stats_reply',dpid,flow_stats])
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        msg = ev.msg
+        ofproto = msg.datapath.ofproto
+        flow_stat_dict = {}
+        flow_stat_dict['match'] = self.of_match_to_dict(msg.match,
+                                                        msg.table_id)
+        flow_stat_dict['cookie'] = msg.cookie
+        flow_stat_dict['priority'] = msg.priority
+        flow_stat_dict['timeout'] = msg.reason in [ofproto.OFPRR_IDLE_TIMEOUT,
+                                                   ofproto.OFPRR_HARD_TIMEOUT]
+        flow_stat_dict['hard_timeout'] = msg.hard_timeout
+        flow_stat_dict['idle_timeout'] = msg.idle_timeout
+        flow_stat_dict['deleted'] = msg.reason == ofproto.OFPRR_DELETE
+        flow_stat_dict['duration_sec'] = msg.duration_sec
+        flow_stat_dict['duration_nsec'] = msg.duration_nsec
+        flow_stat_dict['packet_count'] = msg.packet_count
+        flow_stat_dict['byte_count'] = msg.byte_count
+        self.send_to_pyretic(['flow_removed', msg.datapath.id, flow_stat_dict])
+
+    ### SWITCHES AND PORTS
+
+    def active_bits(self, prefix, bits):
+        return [name for name in dir(ofproto_v1_3)
+                if name.startswith(prefix) and
+                bits & getattr(ofproto_v1_3, name)]
+
+    def port_status(self, port):
+        CONF_UP = not port.config & ofproto_v1_3.OFPPC_PORT_DOWN
+        STAT_UP = not port.state & ofproto_v1_3.OFPPS_LINK_DOWN
+        PORT_TYPE = self.active_bits('OFPPF_', port.curr)
+        return (CONF_UP, STAT_UP, PORT_TYPE)
+
+    @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    def switch_features_handler(self, ev):
+        dp = ev.msg.datapath
+        ofproto = dp.ofproto
+        parser = dp.ofproto_parser
+        self.switches[dp.id] = {'datapath' : dp, 'ports' : {}}
+        # until the runtime installs its rules, send everything up
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                          ofproto.OFPCML_NO_BUFFER)]
+        dp.send_msg(parser.OFPFlowMod(
+            datapath=dp, priority=0, match=parser.OFPMatch(),
+            instructions=[parser.OFPInstructionActions(
+                ofproto.OFPIT_APPLY_ACTIONS, actions)]))
+        dp.send_msg(parser.OFPPortDescStatsRequest(dp, 0))
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def port_desc_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        self.send_to_pyretic(['switch','join',dpid,'BEGIN'])
+        for port in ev.msg.body:
+            if port.port_no <= ofproto_v1_3.OFPP_MAX:
+                self.switches[dpid]['ports'][port.port_no] = port.hw_addr
+                (CONF_UP, STAT_UP, PORT_TYPE) = self.port_status(port)
+                self.send_to_pyretic(['port','join',dpid, port.port_no,
+                                      CONF_UP, STAT_UP, PORT_TYPE])
+        self.send_to_pyretic(['switch','join',dpid,'END'])
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        dp = ev.datapath
+        if dp.id in self.switches:
+            del self.switches[dp.id]
+            self.send_to_pyretic(['switch','part',dp.id])
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        ofproto = msg.datapath.ofproto
+        port = msg.desc
+        if port.port_no > ofproto.OFPP_MAX:
+            return
+        (CONF_UP, STAT_UP, PORT_TYPE) = self.port_status(port)
+        if msg.reason == ofproto.OFPPR_ADD:
+            self.switches[dpid]['ports'][port.port_no] = port.hw_addr
+            self.send_to_pyretic(['port','join',dpid, port.port_no,
+                                  CONF_UP, STAT_UP, PORT_TYPE])
+        elif msg.reason == ofproto.OFPPR_DELETE:
+            try:
+                del self.switches[dpid]['ports'][port.port_no]
+            except KeyError:
+                pass  # SWITCH ALREADY DELETED
+            self.send_to_pyretic(['port','part',dpid,port.port_no])
+        elif msg.reason == ofproto.OFPPR_MODIFY:
+            if not CONF_UP:
+                self.send_to_pyretic(['port','part',dpid,port.port_no])
+            else:
+                self.send_to_pyretic(['port','join',dpid, port.port_no,
+                                      CONF_UP, STAT_UP, PORT_TYPE])
+        else:
+            raise RuntimeError("Unknown port status event")
+
+
+if __name__ == '__main__':
+    from ryu.cmd import manager
+    sys.argv = [sys.argv[0], 'of_client.ryu13_client']
+    manager.main()
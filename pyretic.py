@@ -87,6 +87,9 @@ def parseArgs():
     op.add_option( '--mode', '-m', type='choice',
                      choices=['interpreted','i','reactive0','r0','proactive0','p0','proactive1','p1'], 
                      help = '|'.join( ['interpreted/i','reactive0/r0','proactiveN/pN for N={0,1}'] )  )
+    op.add_option( '--compiled-eval', '-c', action="store_true",
+                   dest="compiled_eval",
+                   help = 'interpret packets against the compiled policy' )
     op.add_option( '--verbosity', '-v', type='choice',
                    choices=['low','normal','high','please-make-it-stop'],
                    default = 'low',
@@ -94,8 +97,12 @@ def parseArgs():
     op.add_option( '--enable_profile', '-p', action="store_true",
                    dest="enable_profile",
                    help = 'enable yappi multithreaded profiler' )
+    op.add_option( '--multitable', '-t', action="store_true",
+                   dest="multitable",
+                   help = 'install path queries as a pipeline of OpenFlow 1.3 tables (runs the ryu OF 1.3 client instead of POX)' )
 
-    op.set_defaults(frontend_only=False,mode='reactive0',enable_profile=False)
+    op.set_defaults(frontend_only=False,mode='reactive0',enable_profile=False,
+                    compiled_eval=False,multitable=False)
     options, args = op.parse_args()
 
     return (op, options, args, kwargs_to_pass)
@@ -175,8 +182,16 @@ def main():
     logger.addHandler(handler)
     logger.setLevel(log_level)
     
-    runtime = Runtime(Backend(),main,path_main,kwargs,options.mode,options.verbosity)
-    if not options.frontend_only:
+    runtime = Runtime(Backend(),main,path_main,kwargs,options.mode,options.verbosity,
+                      options.compiled_eval,options.multitable)
+    if not options.frontend_only and options.multitable:
+        python=sys.executable
+        of_client = subprocess.Popen([python,
+                                      '-m',
+                                      'of_client.ryu13_client' ],
+                                     stdout=sys.stdout,
+                                     stderr=subprocess.STDOUT)
+    elif not options.frontend_only:
         try:
             output = subprocess.check_output('echo $PYTHONPATH',shell=True).strip()
         except:
@@ -59,16 +59,15 @@ class BackendServer(asyncore.dispatcher):
         self.close()
 
 
-class BackendChannel(asynchat.async_chat):
+class BackendChannel(asynchat.async_chat, FramedChannel):
     """Handles echoing messages from a single backend.
     """
     def __init__(self, backend, sock):
         self.backend = backend
-        self.received_data = []
         asynchat.async_chat.__init__(self, sock)
         self.ac_in_buffer_size = 4096 * 3
         self.ac_out_buffer_size = 4096 * 3
-        self.set_terminator(TERM_CHAR)
+        self.init_framing()
         return
 
     def collect_incoming_data(self, data):
@@ -76,14 +75,37 @@ class BackendChannel(asynchat.async_chat):
         with self.backend.channel_lock:
             self.received_data.append(data)
 
+    def handle_write(self):
+        """Flush queued output. Runs on the asyncore thread, so it takes the
+        lock that senders hold while pushing."""
+        with self.backend.channel_lock:
+            asynchat.async_chat.handle_write(self)
+
     def found_terminator(self):
         """The end of a command or message has been seen."""
         with self.backend.channel_lock:
-            msg = deserialize(self.received_data)
+            if self.read_frame_header():
+                return
+            msg = self.read_message()
 
         # USE DESERIALIZED MSG
         if msg is None or len(msg) == 0:
             print "ERROR: empty message"
+        elif msg[0] == 'hello':
+            # The client offers framings; answer with the one we pick (in the
+            # current framing), then send everything after in the new one.
+            framing = FRAMING_JSON
+            for f in FRAMINGS:
+                if f in msg[1]:
+                    framing = f
+                    break
+            with self.backend.channel_lock:
+                self.push(self.frame(['hello', framing]))
+                self.out_framing = framing
+        elif msg[0] == 'framing':
+            # the last message the client sends in the old framing
+            with self.backend.channel_lock:
+                self.set_in_framing(msg[1])
         elif msg[0] == 'switch':
             if msg[1] == 'join':
                 if msg[3] == 'BEGIN':
@@ -119,7 +141,10 @@ class Backend(object):
 
     class asyncore_loop(threading.Thread):
         def run(self):
-            asyncore.loop()
+            # A short select timeout, so that the rest of a large message (e.g.
+            # an install batch) left queued when the socket buffer filled up is
+            # flushed promptly, instead of after the default 30s timeout.
+            asyncore.loop(timeout=0.05)
 
     def __init__(self):
         self.backend_channel = None
@@ -147,6 +172,28 @@ class Backend(object):
 
     def send_delete(self,pred,priority):
         self.send_to_OF_client(['delete',pred,priority])
+
+    def send_install_batch(self,switch,to_delete,to_install,to_modify):
+        """
+        Send a switch's rule updates as one message, which the OF client
+        applies (deletes, then installs, then modifies) followed by a single
+        barrier.
+
+        :param switch: the switch updated
+        :type switch: int
+        :param to_delete: (pred,priority) of rules to delete
+        :type to_delete: list tuple
+        :param to_install: (pred,priority,action_list,cookie,notify) of rules
+            to install
+        :type to_install: list tuple
+        :param to_modify: (pred,priority,action_list,cookie,notify) of rules
+            to modify
+        :type to_modify: list tuple
+        """
+        self.send_to_OF_client(['install_batch',switch,
+                                map(list,to_delete),
+                                map(list,to_install),
+                                map(list,to_modify)])
         
     def send_clear(self,switch):
         self.send_to_OF_client(['clear',switch])
@@ -161,7 +208,6 @@ class Backend(object):
         self.send_to_OF_client(['inject_discovery_packet',dpid,port])
 
     def send_to_OF_client(self,msg):
-        serialized_msg = serialize(msg)
         with self.channel_lock:
             if not self.backend_channel is None:
-                self.backend_channel.push(serialized_msg)
+                self.backend_channel.push(self.backend_channel.frame(msg))
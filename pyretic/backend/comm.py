@@ -32,10 +32,20 @@ import asyncore
 import socket
 
 import json
+import marshal
+import struct
 
 BACKEND_PORT=41414
 TERM_CHAR='\n'
 
+# Message framings. Channels start out with newline-delimited JSON; a client
+# offers FRAMINGS in a 'hello' message and switches once the backend accepts.
+FRAMING_JSON='json'
+FRAMING_BINARY='binary'
+FRAMINGS=[FRAMING_BINARY, FRAMING_JSON] # in order of preference
+FRAME_HEADER=struct.Struct('!I') # length prefix of binary frames
+BYTELIST_FIELDS=frozenset(['srcmac','dstmac','srcip','dstip','raw'])
+
 def serialize(msg):
     jsonable_msg = to_jsonable_format(msg)
     jsoned_msg = json.dumps(jsonable_msg)
@@ -55,20 +65,15 @@ def deserialize(serialized_msgs):
                      for l in item ]
         else:
             return item
-    serialized_msg = serialized_msgs.pop(0)
-    jsoned_msg = serialized_msg.rstrip(TERM_CHAR)
-    msg = None
-    while True:
-        try:
-            msg = json.loads(jsoned_msg)  
-            msg = json2python(msg)
-            break
-        except:
-            if len(serialized_msgs) == 0:
-                break
-            next_part = serialized_msgs.pop(0).rstrip(TERM_CHAR)
-            jsoned_msg += next_part
-    return msg
+    # Everything collected before the terminator is one message (json.dumps
+    # escapes newlines), so parse it once rather than retrying on growing
+    # prefixes, which is quadratic in the size of large (batched) messages.
+    jsoned_msg = ''.join(serialized_msgs).rstrip(TERM_CHAR)
+    del serialized_msgs[:]
+    try:
+        return json2python(json.loads(jsoned_msg))
+    except Exception:
+        return None
 
 
 def dict_to_ascii(d):
@@ -101,10 +106,93 @@ def ascii2bytelist(packet_dict):
 
 def to_jsonable_format(item):
     if isinstance(item, dict):
-        ascii_item = dict_to_ascii(item)
-        bytelist_item = ascii2bytelist(ascii_item)
-        return bytelist_item
+        # dict_to_ascii followed by ascii2bytelist, in one pass
+        jsonable = {}
+        for (h,v) in item.iteritems():
+            if not (isinstance(v,str) or isinstance(v,int)):
+                v = repr(v)
+            if h in BYTELIST_FIELDS:
+                v = [ord(c) for c in v]
+            jsonable[h] = v
+        return jsonable
     elif isinstance(item, list):
         return map(to_jsonable_format,item)
     else:
         return item
+
+
+def serialize_binary(msg):
+    """Frame a message as a length-prefixed marshal payload, in which packet
+    payloads and addresses stay raw strings."""
+    payload = marshal.dumps(to_binary_format(msg))
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def deserialize_binary(serialized_msgs):
+    payload = ''.join(serialized_msgs)
+    del serialized_msgs[:]
+    try:
+        return marshal.loads(payload)
+    except Exception:
+        return None
+
+def to_binary_format(item):
+    if isinstance(item, dict):
+        # as dict_to_ascii, which the JSON framing applies
+        binary = {}
+        for (h,v) in item.iteritems():
+            if not (isinstance(v,str) or isinstance(v,int)):
+                v = repr(v)
+            binary[h] = v
+        return binary
+    elif isinstance(item, list) or isinstance(item, tuple):
+        return map(to_binary_format,item)
+    else:
+        return item
+
+
+class FramedChannel(object):
+    """
+    Mixin for the async_chat channels between the backend and the OF client,
+    which reads and writes messages in the channel's current framing.
+    Incoming and outgoing framings switch separately, each right after the
+    last message the peer sends in the old framing.
+    """
+    def init_framing(self):
+        self.received_data = []
+        self.in_framing = FRAMING_JSON
+        self.out_framing = FRAMING_JSON
+        self.frame_length = None
+        self.set_terminator(TERM_CHAR)
+
+    def set_in_framing(self, framing):
+        self.in_framing = framing
+        if framing == FRAMING_BINARY:
+            self.set_terminator(FRAME_HEADER.size)
+        else:
+            self.set_terminator(TERM_CHAR)
+
+    def read_frame_header(self):
+        """
+        Called first from found_terminator. Returns True if what was received
+        is the header of a binary frame, whose payload is then read next.
+        """
+        if self.in_framing != FRAMING_BINARY or not self.frame_length is None:
+            return False
+        (self.frame_length,) = FRAME_HEADER.unpack(''.join(self.received_data))
+        del self.received_data[:]
+        self.set_terminator(self.frame_length)
+        return True
+
+    def read_message(self):
+        """Deserialize the message received, or return None if it is
+        malformed."""
+        if self.in_framing == FRAMING_JSON:
+            return deserialize(self.received_data)
+        self.frame_length = None
+        self.set_terminator(FRAME_HEADER.size)
+        return deserialize_binary(self.received_data)
+
+    def frame(self, msg):
+        if self.out_framing == FRAMING_BINARY:
+            return serialize_binary(msg)
+        return serialize(msg)
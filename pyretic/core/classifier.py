@@ -1,17 +1,44 @@
 
 from collections import deque
 import copy
+import itertools
 
 ###############################################################################
 # Classifiers
 # an intermediate representation for proactive compilation.
 
 
+# Whether rules record the rules they were derived from, for
+# get_rule_derivation_tree. Off by default: the parents of the rules of a
+# compiled classifier keep every intermediate rule of its compilation alive.
+_track_provenance = False
+
+def track_provenance(enabled=True):
+    """
+    Turn recording of rule derivations on or off, for rules created from then
+    on.
+
+    :param enabled: whether to record derivations
+    :type enabled: bool
+    """
+    global _track_provenance
+    _track_provenance = enabled
+
+def provenance_tracked():
+    """
+    Whether rules record their derivations.
+
+    :rtype: bool
+    """
+    return _track_provenance
+
+
 class Rule(object):
     """
     A rule contains a filter and the parallel composition of zero or more
     Pyretic actions.
     """
+    __slots__ = ['match', 'actions', 'parents', 'op']
 
     # Matches m should be of the match class.  Actions acts should be a set of
     # modify, identity, and/or Controller/CountBucket/FwdBucket policies.
@@ -20,7 +47,8 @@ class Rule(object):
     def __init__(self,m,acts,parents=[],op="policy"):
         self.match = m
         self.actions = acts
-        self.parents = parents
+        # None when provenance isn't tracked
+        self.parents = parents if _track_provenance else None
         """ op is the operator which combined the parents of this rule. Set of
         values it can take:
         - a class name of type CombinatorPolicy (in particular: "negate",
@@ -66,11 +94,13 @@ def get_rule_derivation_tree(r, pre_spaces='', only_leaves=False):
     """ Get the tree of rules deriving the current rule."""
     assert isinstance(r, Rule)
     op = r.op
+    if r.parents is None:
+        return pre_spaces + "[derivation not tracked]\n"
     assert op in ["policy", "parallel", "empty_parallel",
-                  "sequential", "negate"]
+                  "sequential", "negate", "first_match"]
     extra_ind = '    '
     output = ''
-    if op == "parallel" or op == "negate" or op == "sequential":
+    if op in ["parallel", "negate", "sequential", "first_match"]:
         if not only_leaves:
             output  = pre_spaces + str(r.match) + '\n'
             output += pre_spaces + '-> ' + str(r.actions) + '\n'
@@ -97,6 +127,236 @@ def get_rule_exact_match(classifier, mat):
     return None
 
 
+###############################################################################
+# Rule indexes
+# used to avoid scanning every rule pair when composing classifiers.
+
+IP_FIELDS = ('srcip', 'dstip')
+
+
+def _prefix(net):
+    """ (network address, prefix length, address width) of an IP prefix."""
+    return (net.value, net.prefixlen, net.max_prefixlen)
+
+
+def _match_map(m):
+    """
+    The field map of a rule's match, {} if the match is identity, or None if
+    the match is some other policy that can't be indexed.
+    """
+    from pyretic.core.language import identity, match
+    if isinstance(m, match):
+        return m.map
+    elif m == identity:
+        return {}
+    else:
+        return None
+
+
+class RuleIndex(object):
+    """
+    Index over the matches of a list of rules, answering which of the rules
+    have a match that may intersect a given match. Exact-match fields are
+    bucketed by value; srcip/dstip are kept in a per-prefix-length table
+    where containing prefixes are found by masking and contained prefixes by
+    a range search over the sorted network addresses.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.exact = {}      # field -> value -> [positions]
+        self.prefixes = {}   # field -> prefixlen -> network -> [positions]
+        self.networks = {}   # field -> prefixlen -> sorted networks
+        self.wildcard = {}   # field -> [positions not constraining field]
+        self.opaque = []     # positions of rules which can't be indexed
+        constrained = {}
+        for pos, r in enumerate(self.rules):
+            m = _match_map(r.match)
+            if m is None:
+                self.opaque.append(pos)
+                continue
+            for f, v in m.iteritems():
+                constrained.setdefault(f, set()).add(pos)
+                if f in IP_FIELDS:
+                    (net, plen, _) = _prefix(v)
+                    by_len = self.prefixes.setdefault(f, {})
+                    by_len.setdefault(plen, {}).setdefault(net, []).append(pos)
+                else:
+                    by_val = self.exact.setdefault(f, {})
+                    by_val.setdefault(v, []).append(pos)
+        for f, positions in constrained.iteritems():
+            self.wildcard[f] = [pos for pos in xrange(len(self.rules))
+                                if not pos in positions]
+        for f, by_len in self.prefixes.iteritems():
+            self.networks[f] = { plen : sorted(nets)
+                                 for plen, nets in by_len.iteritems() }
+
+    def _prefix_positions(self, f, v):
+        """ Positions of rules whose f prefix contains or is contained in v."""
+        import bisect
+        (net, plen, width) = _prefix(v)
+        positions = []
+        for other_len, nets in self.prefixes[f].iteritems():
+            if other_len <= plen:
+                mask = ((1 << other_len) - 1) << (width - other_len)
+                positions.extend(nets.get(net & mask, []))
+            else:
+                sorted_nets = self.networks[f][other_len]
+                lo = bisect.bisect_left(sorted_nets, net)
+                hi = bisect.bisect_left(sorted_nets,
+                                        net + (1 << (width - plen)))
+                for n in sorted_nets[lo:hi]:
+                    positions.extend(nets[n])
+        return positions
+
+    def candidates(self, m):
+        """
+        Rules, in their original order, which may intersect match m. Rules
+        that can't intersect m are never returned; some returned rules may
+        still not intersect m.
+        """
+        m = _match_map(m)
+        best = None
+        if m is not None:
+            for f, v in m.iteritems():
+                if not f in self.wildcard:
+                    continue    # no rule constrains f
+                if f in IP_FIELDS:
+                    positions = self._prefix_positions(f, v)
+                else:
+                    positions = self.exact[f].get(v, [])
+                if best is None or (len(positions) + len(self.wildcard[f]) <
+                                    len(best[0]) + len(best[1])):
+                    best = (positions, self.wildcard[f])
+        if best is None:
+            return self.rules
+        return [self.rules[pos]
+                for pos in sorted(best[0] + best[1] + self.opaque)]
+
+
+class ShadowIndex(object):
+    """
+    Index over the matches of a growing list of rules, answering whether some
+    rule in the list covers a given match. Rules are grouped by the fields
+    (and, for srcip/dstip, the prefix lengths) they constrain, so a covering
+    rule can be found with one hash lookup per group.
+    """
+
+    def __init__(self):
+        self.groups = {}    # (exact fields, ((ip field, prefixlen),...)) -> keys
+        self.opaque = []    # matches which can't be indexed
+
+    def add(self, m):
+        mm = _match_map(m)
+        if mm is None:
+            self.opaque.append(m)
+            return
+        exact = tuple(sorted(f for f in mm if not f in IP_FIELDS))
+        ips = tuple(sorted((f, _prefix(mm[f])[1])
+                           for f in IP_FIELDS if f in mm))
+        key = (tuple(mm[f] for f in exact),
+               tuple(_prefix(mm[f])[0] for (f, _) in ips))
+        self.groups.setdefault((exact, ips), set()).add(key)
+
+    def covers(self, m):
+        """ Whether some added match covers m."""
+        for o in self.opaque:
+            if o.covers(m):
+                return True
+        mm = _match_map(m)
+        if mm is None:
+            raise TypeError
+        for (exact, ips), keys in self.groups.iteritems():
+            try:
+                key_exact = tuple(mm[f] for f in exact)
+                key_ips = []
+                for (f, plen) in ips:
+                    (net, other_len, width) = _prefix(mm[f])
+                    if plen > other_len:
+                        raise KeyError(f)
+                    mask = ((1 << plen) - 1) << (width - plen)
+                    key_ips.append(net & mask)
+            except KeyError:
+                continue    # group constrains a field that m doesn't
+            if (key_exact, tuple(key_ips)) in keys:
+                return True
+        return False
+
+
+class MatchTree(object):
+    """
+    Decision tree over the exact-match fields of a list of rules, for finding
+    the first rule matching a packet. Each internal node branches on one
+    field's value; a branch holds, in their original order, the rules
+    requiring that value plus the rules not constraining the field. Leaves are
+    scanned in order with the rules' own matches. srcip/dstip prefixes are
+    only checked at the leaves.
+    """
+    LEAF_SIZE = 8
+    MAX_DEPTH = 4
+    MAX_GROWTH = 4  # bound on rules copied into branches, per rule branched
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.maps = [_match_map(r.match) for r in self.rules]
+        self.root = self._build(range(len(self.rules)), frozenset())
+
+    def _build(self, positions, used):
+        def leaf():
+            return [self.rules[pos] for pos in positions]
+
+        if len(positions) <= self.LEAF_SIZE or len(used) >= self.MAX_DEPTH:
+            return leaf()
+        # branch on the (not yet branched on) field constrained by the most
+        # rules
+        counts = {}
+        for pos in positions:
+            m = self.maps[pos]
+            if m is None:
+                continue
+            for f in m:
+                if not (f in IP_FIELDS or f in used):
+                    counts[f] = counts.get(f, 0) + 1
+        if not counts:
+            return leaf()
+        field = max(counts, key=lambda f: counts[f])
+        by_value = {}
+        default = []
+        for pos in positions:
+            m = self.maps[pos]
+            if m is None or not field in m:
+                default.append(pos)
+                for value_positions in by_value.itervalues():
+                    value_positions.append(pos)
+            else:
+                if not m[field] in by_value:
+                    by_value[m[field]] = list(default)
+                by_value[m[field]].append(pos)
+        sizes = map(len, by_value.values()) + [len(default)]
+        if (max(sizes) == len(positions) or
+            sum(sizes) > self.MAX_GROWTH * len(positions)):
+            return leaf()   # branching doesn't narrow down, or copies too much
+        used = used | {field}
+        branches = { v : self._build(value_positions, used)
+                     for v, value_positions in by_value.iteritems() }
+        return (field, branches, self._build(default, used))
+
+    def find(self, pkt):
+        """ The first rule whose match accepts pkt, or None."""
+        node = self.root
+        while isinstance(node, tuple):
+            (field, branches, default) = node
+            try:
+                value = pkt[field]
+            except KeyError:
+                value = None
+            node = branches.get(value, default)
+        for rule in node:
+            if rule.match.eval(pkt):
+                return rule
+        return None
+
+
 class Classifier(object):
     """
     A classifier contains a list of rules, where the order of the list implies
@@ -115,6 +375,7 @@ class Classifier(object):
             self.rules = new_rules
         else:
             raise TypeError
+        self.match_tree = None
 
     def __len__(self):
         return len(self.rules)
@@ -140,13 +401,26 @@ class Classifier(object):
         highest priority.  Return the set of packets resulting from applying
         the actions of the first rule that matches.
         """
-        for rule in self.rules:
-            pkts = rule.eval(in_pkt)
-            if pkts is not None:
-                return pkts
-        raise TypeError('Classifier is not total.')
+        rule = self.find_rule(in_pkt)
+        if rule is None:
+            raise TypeError('Classifier is not total.')
+        return rule.eval(in_pkt)
+
+    def find_rule(self, pkt):
+        """
+        The highest priority rule matching pkt, or None.
+
+        :param pkt: the packet to look up
+        :type pkt: Packet
+        :rtype: Rule
+        """
+        if (self.match_tree is None or
+            len(self.match_tree.rules) != len(self.rules)):
+            self.match_tree = MatchTree(self.rules)
+        return self.match_tree.find(pkt)
 
     def prepend(self, item):
+        self.match_tree = None
         if isinstance(item, Rule):
             self.rules.appendleft(item)
         elif isinstance(item, Classifier):
@@ -155,6 +429,7 @@ class Classifier(object):
             raise TypeError            
 
     def append(self, item):
+        self.match_tree = None
         if isinstance(item, Rule):
             self.rules.append(item)
         elif isinstance(item, Classifier):
@@ -163,6 +438,7 @@ class Classifier(object):
             raise TypeError
 
     def remove_last_rule(self):
+        self.match_tree = None
         self.rules.pop()
 
     def __copy__(self):
@@ -182,7 +458,7 @@ class Classifier(object):
                 r_new.actions = set()
             else:
                 raise TypeError  # TODO MAKE A CompileError TYPE
-            r_new.parents = [r]
+            r_new.parents = [r] if _track_provenance else None
             r_new.op = "negate"
             new_rules.append(r_new)
         c = Classifier(new_rules)
@@ -205,8 +481,10 @@ class Classifier(object):
         c3 = Classifier()
         assert(not (c1 is None and c2 is None))
         # then cross all pairs of rules in the first and second classifiers
+        # whose matches may intersect
+        c2_index = RuleIndex(c2.rules)
         for r1 in c1.rules:
-            for r2 in c2.rules:
+            for r2 in c2_index.candidates(r1.match):
                 crossed_r = _cross(r1,r2)
                 if crossed_r:
                     c3.append(crossed_r)
@@ -334,6 +612,57 @@ class Classifier(object):
         return c3
 
 
+    ### FIRST-MATCH COMPOSITION
+
+    def is_filter_classifier(self):
+        """
+        Whether every rule either drops packets or lets them through
+        unchanged, as the classifier of a predicate does.
+
+        :rtype: bool
+        """
+        from pyretic.core.language import identity
+        return all(len(r.actions) == 0 or r.actions == {identity}
+                   for r in self.rules)
+
+    def first_match(c1, c2, c3):
+        """
+        The classifier applying c2 to the packets the filter classifier c1
+        lets through and c3 to the others, i.e., if_(c1, c2, c3). Rather than
+        crossing (c1 >> c2) with (~c1 >> c3), the rules of c2 restricted to
+        each passing rule of c1 are laid out in c1's priority order, then c3:
+        only a drop rule of c1 above a passing one needs c3 restricted to it.
+        Rules shadowed in the concatenation are removed.
+
+        :param c2: the classifier for packets c1 lets through
+        :type c2: Classifier
+        :param c3: the classifier for the other packets
+        :type c3: Classifier
+        :rtype: Classifier
+        :raises TypeError: if c1 isn't a filter classifier
+        """
+        from pyretic.core.language import drop
+        def _restrict(r1, c):
+            rules = []
+            for r in c.rules:
+                m = r1.match.intersect(r.match)
+                if m != drop:
+                    rules.append(Rule(m, copy.copy(r.actions), [r1, r],
+                                      "first_match"))
+            return rules
+
+        if not c1.is_filter_classifier():
+            raise TypeError("first_match needs a filter classifier")
+        passing = [len(r.actions) > 0 for r in c1.rules]
+        last = len(passing) - passing[::-1].index(True) if any(passing) else 0
+        c4 = Classifier()
+        for r1 in itertools.islice(c1.rules, last):
+            c4.rules.extend(_restrict(r1, c2 if r1.actions else c3))
+        # past c1's last passing rule, packets all go to c3
+        c4.rules.extend(c3.rules)
+        return c4.optimize()
+
+
     ### SHADOW OPTIMIZATION
 
     def optimize(self):
@@ -353,10 +682,17 @@ class Classifier(object):
     def remove_shadowed_cover_single(self):
         # Eliminate every rule completely covered by some higher priority rule
         opt_c = Classifier()
+        kept = ShadowIndex()
         for r in self.rules:
-            if not reduce(lambda acc, new_r: acc or
-                          new_r.match.covers(r.match),
-                          opt_c.rules,
-                          False):
+            if _match_map(r.match) is None:
+                # not indexable; fall back to checking each kept rule
+                covered = reduce(lambda acc, new_r: acc or
+                                 new_r.match.covers(r.match),
+                                 opt_c.rules,
+                                 False)
+            else:
+                covered = kept.covers(r.match)
+            if not covered:
                 opt_c.rules.append(r)
+                kept.add(r.match)
         return opt_c
@@ -34,7 +34,8 @@ import functools
 import itertools
 import struct
 import time
-from ipaddr import IPv4Network
+import weakref
+from collections import OrderedDict
 from bitarray import bitarray
 import logging
 
@@ -47,6 +48,7 @@ from multiprocessing import Lock, Condition
 import copy
 
 NO_CACHE=False
+COMPILE_CACHE_SIZE=4096
 
 basic_headers = ["srcmac", "dstmac", "srcip", "dstip", "tos", "srcport", "dstport",
                  "ethtype", "protocol"]
@@ -56,6 +58,88 @@ location_headers = ["switch", "inport", "outport"]
 compilable_headers = native_headers + location_headers
 content_headers = [ "raw", "header_len", "payload_len"]
 
+################################################################################
+# Compilation Cache                                                            #
+################################################################################
+
+class PolicyKey(object):
+    """
+    Structural identity of a policy AST, used to share compiled classifiers
+    between equal sub-policies. Keys are hash-consed (see policy_key), so
+    equal keys are the same object and compare in constant time however deep
+    the policy.
+
+    :param parts: hashable description of the node, including child keys
+    :type parts: tuple
+    :param ref: object to keep alive while the key is in use (for keys built
+        from an object's id)
+    """
+    __slots__ = ['parts', 'ref', '__weakref__']
+
+    def __init__(self, parts, ref=None):
+        self.parts = parts
+        self.ref = ref
+
+    def __repr__(self):
+        return "PolicyKey%s" % repr(self.parts)
+
+
+_policy_keys = weakref.WeakValueDictionary()
+
+def policy_key(parts, ref=None):
+    """
+    Return the unique PolicyKey for parts.
+
+    :param parts: hashable description of the node, including child keys
+    :type parts: tuple
+    :rtype: PolicyKey
+    """
+    key = _policy_keys.get(parts)
+    if key is None:
+        key = _policy_keys[parts] = PolicyKey(parts, ref)
+    return key
+
+
+compile_cache = util.LRUCache(COMPILE_CACHE_SIZE)
+
+def cached_classifier(policy):
+    """
+    Return the classifier for policy, shared with every structurally equal
+    policy compiled recently.
+
+    :param policy: the policy to compile
+    :type policy: Policy
+    :rtype: Classifier
+    """
+    key = policy.structural_key()
+    classifier = compile_cache.get(key)
+    if classifier is None:
+        classifier = policy.generate_classifier()
+        compile_cache.put(key, classifier)
+    return classifier
+
+def compile_cache_stats():
+    """
+    Hit/miss counters and occupancy of the global compilation cache.
+
+    :rtype: dict
+    """
+    return compile_cache.stats()
+
+def clear_compile_cache():
+    compile_cache.clear()
+
+# Bumped whenever the virtual field registry changes; matches and modifies
+# retranslate their virtual fields when it moves
+virtual_fields_version = 0
+
+def virtual_fields_changed():
+    """Invalidate everything derived from the virtual field registry."""
+    global virtual_fields_version
+    virtual_fields_version += 1
+    clear_compile_cache()
+
+
 ################################################################################
 # Policy Language                                                              #
 ################################################################################
@@ -68,6 +152,9 @@ class Policy(object):
     - evaluating on a single packet.
     - compilation to a switch Classifier
     """
+    _classifier = None
+    _structural_key = None
+
     def eval(self, pkt):
         """
         evaluate this policy on a single packet
@@ -80,6 +167,7 @@ class Policy(object):
 
     def invalidate_classifier(self):
         self._classifier = None
+        self._structural_key = None
 
     def compile(self):
         """
@@ -89,8 +177,25 @@ class Policy(object):
         """
         if NO_CACHE: 
             self._classifier = self.generate_classifier()
+        elif self._classifier is None:
+            self._classifier = cached_classifier(self)
         return self._classifier
 
+    def structural_key(self):
+        """
+        Key under which this policy's classifier is shared in the compilation
+        cache. Policies compiling to the same classifier should have equal
+        keys; by default a policy is only equal to itself.
+
+        :rtype: PolicyKey
+        """
+        if self._structural_key is None:
+            self._structural_key = self.generate_structural_key()
+        return self._structural_key
+
+    def generate_structural_key(self):
+        return policy_key((id(self),), self)
+
     def __add__(self, pol):
         """
         The parallel composition operator.
@@ -323,7 +428,8 @@ class match(Filter):
             return map_dict
 
         self.map = util.frozendict(_get_processed_map(*args, **kwargs))
-        self._classifier = self.generate_classifier()
+        self._translated_map = None
+        self._translated_version = None
         super(match,self).__init__()
 
     def eval(self, pkt):
@@ -334,11 +440,56 @@ class match(Filter):
         :type pkt: Packet
         :rtype: set Packet
         """
-        return _match(**self.map).eval(pkt)
+        for field, pattern in self.translated_map().iteritems():
+            try:
+                v = pkt[field]
+                if not field in ['srcip', 'dstip']:
+                    if pattern is None or pattern != v:
+                        return set()
+                else:
+                    v = util.string_to_IP(v)
+                    if pattern is None or not v in pattern:
+                        return set()
+            except Exception, e:
+                if pattern is not None:
+                    return set()
+        return {pkt}
+
+    def translated_map(self):
+        """
+        The field map with virtual fields translated to the headers carrying
+        them, computed on first use and again when virtual fields change.
+
+        :rtype: frozendict
+        """
+        if self._translated_version != virtual_fields_version:
+            self._translated_map = self.translate_virtual_fields()
+            self._translated_version = virtual_fields_version
+        return self._translated_map
+
+    def translate_virtual_fields(self):
+        from pyretic.core.runtime import virtual_field
+        _map = {}
+        _vf  = {}
+
+        for field, pattern in self.map.iteritems():
+            if field in compilable_headers:
+                _map[field] = pattern
+            else:
+                _vf[field] = pattern
+
+        _map.update(
+          virtual_field.map_to_vlan(
+            virtual_field.compress(_vf)))
+
+        return util.frozendict(**_map)
 
     def generate_classifier(self):
         return _match(**self.map).generate_classifier()
 
+    def generate_structural_key(self):
+        return policy_key((self.__class__, self.map))
+
     def __eq__(self, other):
         return ( (isinstance(other, match) and self.map == other.map)
                  or (len(self.map) == 0 and other == identity) )
@@ -433,45 +584,14 @@ class _match(match):
         super(_match,self).__init__(*args, **kwargs)
 
         self.map = self.translate_virtual_fields()
+        self._translated_map = self.map
+        self._translated_version = virtual_fields_version
 
     def generate_classifier(self):
         r1 = Rule(self,{identity},[self])
         r2 = Rule(identity,set(),[None])
         return Classifier([r1, r2])
 
-    def eval(self,pkt):
-        for field, pattern in self.map.iteritems():
-            try:
-                v = pkt[field]
-                if not field in ['srcip', 'dstip']:
-                    if pattern is None or pattern != v:
-                        return set()
-                else:
-                    v = util.string_to_IP(v)
-                    if pattern is None or not v in pattern:
-                        return set()
-            except Exception, e:
-                if pattern is not None:
-                    return set()
-        return {pkt}
-
-    def translate_virtual_fields(self):
-        from pyretic.core.runtime import virtual_field
-        _map = {}
-        _vf  = {}
-
-        for field, pattern in self.map.iteritems():
-            if field in compilable_headers:
-                _map[field] = pattern
-            else:
-                _vf[field] = pattern
-
-        _map.update(
-          virtual_field.map_to_vlan(
-            virtual_field.compress(_vf)))
-
-        return util.frozendict(**_map)
-
 class modify(Policy):
     """
     Modify on all specified fields to specified values.
@@ -490,7 +610,8 @@ class modify(Policy):
                        acc and (f in compilable_headers),
                    self.map.keys(),
                    True)
-        self._classifier = self.generate_classifier()
+        self._translated_map = None
+        self._translated_version = None
         super(modify,self).__init__()
 
     def eval(self, pkt):
@@ -501,11 +622,30 @@ class modify(Policy):
         :type pkt: Packet
         :rtype: set Packet
         """
-        return _modify(**self.map).eval(pkt)
+        return {pkt.modifymany(self.translated_map())}
+
+    def translated_map(self):
+        """
+        The field assignments with virtual fields translated to the headers
+        carrying them, computed on first use and again when virtual fields
+        change.
+
+        :rtype: dict
+        """
+        if self._translated_version != virtual_fields_version:
+            self._translated_map = self.translate_virtual_fields()
+            self._translated_version = virtual_fields_version
+        return self._translated_map
 
     def generate_classifier(self):
         return _modify(**self.map).generate_classifier()
 
+    def generate_structural_key(self):
+        try:
+            return policy_key((self.__class__, util.frozendict(self.map)))
+        except TypeError:  # unhashable field value
+            return super(modify,self).generate_structural_key()
+
     def __repr__(self):
         return "modify: %s" % ' '.join(map(str,self.map.items()))
 
@@ -513,19 +653,6 @@ class modify(Policy):
         return ( isinstance(other, modify)
            and (self.map == other.map) )
 
-class _modify(modify):
-    def __init__(self, *args, **kwargs):
-        super(_modify,self).__init__(*args, **kwargs)
-        # Translate virtual-fields
-        self.map = self.translate_virtual_fields()
-
-    def generate_classifier(self):
-        r = Rule(identity,{self},[self])
-        return Classifier([r])
-
-    def eval(self,pkt):
-        return {pkt.modifymany(self.map)}
-
     def translate_virtual_fields(self):
         from pyretic.core.runtime import virtual_field
         _map = {}
@@ -543,6 +670,18 @@ class _modify(modify):
 
         return _map
 
+class _modify(modify):
+    def __init__(self, *args, **kwargs):
+        super(_modify,self).__init__(*args, **kwargs)
+        # Translate virtual-fields
+        self.map = self.translate_virtual_fields()
+        self._translated_map = self.map
+        self._translated_version = virtual_fields_version
+
+    def generate_classifier(self):
+        r = Rule(identity,{self},[self])
+        return Classifier([r])
+
 # FIXME: Srinivas =).
 class Query(Filter):
     """
@@ -748,10 +887,7 @@ class CountBucket(Query):
             for pkt in self.bucket:
                 self.log.info('In CountBucket ' + str(id(self)) + ' apply():'
                                + ' Packet is:\n' + repr(pkt))
-                self.packet_count_persistent += 1
-                self.byte_count_persistent += pkt['payload_len']
-                self.packet_count_persistent_apply += 1
-                self.byte_count_persistent_apply += pkt['payload_len']
+                self.count_applied(pkt)
             self.bucket.clear()
         self.log.debug('In bucket ' +  str(id(self)) + ' apply(): ' +
                        'persistent packet count is ' +
@@ -837,13 +973,13 @@ class CountBucket(Query):
             return '(to_be_deleted=%s,existing_rule=%s)' % \
                 (self.to_be_deleted,self.existing_rule)
 
-    def add_match(self, match, priority, version):
+    def add_match(self, match, priority, version, existing_rule=False):
         """Add a match to list of classifier rules to be queried for counts,
         corresponding to a given version of the classifier.
         """
         k = self.match_entry(match, priority, version)
         if not k in self.matches:
-            self.matches[k] = self.match_status() 
+            self.matches[k] = self.match_status(existing_rule=existing_rule)
 
     def delete_match(self, match, priority, version, to_be_deleted=False,
                      existing_rule=False):
@@ -884,13 +1020,7 @@ class CountBucket(Query):
                         self.log.info(("Adding persistent pkt count %d"
                                         + " to bucket %d") % (
                                 packet_count, id(self) ) )
-                        self.log.debug(("persistent count is now %d" %
-                                        (self.packet_count_persistent +
-                                         packet_count) ) )
-                    self.packet_count_persistent += packet_count
-                    self.byte_count_persistent += byte_count
-                    self.packet_count_persistent_removed += packet_count
-                    self.byte_count_persistent_removed += byte_count
+                    self.count_removed(k, packet_count, byte_count)
                 # Note that there is no else action. We just forget
                 # that this rule was ever associated with the bucket
                 # if we get a "flow removed" message before we got
@@ -936,8 +1066,7 @@ class CountBucket(Query):
         if not queries_issued:
             self.clear_transient_counters()
             self.log.info("Didn't issue stat queries; directly returning!")
-            self.call_callbacks([self.packet_count_persistent,
-                                 self.byte_count_persistent])
+            self.call_callbacks(self.current_counts())
 
     def call_callbacks(self, args):
         """ Pace callbacks according to pull_stats issued by application. """
@@ -979,6 +1108,42 @@ class CountBucket(Query):
         self.packet_count_table = 0
         self.byte_count_table   = 0
 
+    def count_applied(self, pkt):
+        """Count a packet evaluated at the controller."""
+        self.packet_count_persistent += 1
+        self.byte_count_persistent += pkt['payload_len']
+        self.packet_count_persistent_apply += 1
+        self.byte_count_persistent_apply += pkt['payload_len']
+
+    def count_removed(self, entry, packet_count, byte_count):
+        """Count the final counters of a deleted rule."""
+        self.packet_count_persistent += packet_count
+        self.byte_count_persistent += byte_count
+        self.packet_count_persistent_removed += packet_count
+        self.byte_count_persistent_removed += byte_count
+
+    def count_table(self, entry, packet_count, byte_count):
+        """Count the counters of an installed rule in a stats reply."""
+        self.packet_count_table += packet_count
+        self.byte_count_table   += byte_count
+
+    def count_existing(self, entry, packet_count, byte_count):
+        """Discount the counters a rule had before the bucket was created."""
+        self.packet_count_persistent -= packet_count
+        self.byte_count_persistent -= byte_count
+        self.packet_count_persistent_existing += packet_count
+        self.byte_count_persistent_existing += byte_count
+
+    def current_counts(self):
+        """
+        The counts reported to callbacks: the counters of installed rules
+        from the latest stats replies plus the persistent counts.
+
+        :rtype: [int, int]
+        """
+        return [(self.packet_count_table + self.packet_count_persistent),
+                (self.byte_count_table   + self.byte_count_persistent)]
+
     def handle_flow_stats_reply(self,switch,flow_stats):
         """
         Given a flow_stats_reply from switch s, collect only those
@@ -1003,7 +1168,7 @@ class CountBucket(Query):
             fme = self.match_entry(self.str_convert_match(f),
                                    flow_stat['priority'],
                                    flow_stat['cookie'])
-            if fme in self.matches.keys():
+            if fme in self.matches:
                 return fme
             return None
 
@@ -1036,18 +1201,16 @@ class CountBucket(Query):
                                                str(extracted_pkts) + ' bytes: '
                                                + str(extracted_bytes))
                             if not self.matches[me].existing_rule:
-                                self.packet_count_table += extracted_pkts
-                                self.byte_count_table   += extracted_bytes
+                                self.count_table(me, extracted_pkts,
+                                                 extracted_bytes)
                             else: # pre-existing rule when bucket was created
-                                self.log.debug(('In bucket %d: removing' +
+                                self.log.debug(('In bucket %d: removing ' +
                                                 'pre-existing rule counts %d' +
-                                                ' %d') % id(self))
-                                self.packet_count_persistent -= extracted_pkts
-                                self.byte_count_persistent -= extracted_bytes
-                                self.packet_count_persistent_existing += (
-                                    extracted_pkts)
-                                self.byte_count_persistent_existing += (
-                                    extracted_bytes)
+                                                ' %d') % (id(self),
+                                                          extracted_pkts,
+                                                          extracted_bytes))
+                                self.count_existing(me, extracted_pkts,
+                                                    extracted_bytes)
                                 self.clear_existing_rule_flag(me)
                     else:
                         raise RuntimeError("weird flow entry")
@@ -1071,10 +1234,7 @@ class CountBucket(Query):
                     "perst. total: %d\n" % self.packet_count_persistent,
                     "bucket total: %d\n" % (self.packet_count_table +
                                             self.packet_count_persistent)))
-            self.call_callbacks([(self.packet_count_table +
-                                  self.packet_count_persistent),
-                                 (self.byte_count_table   +
-                                  self.byte_count_persistent)])
+            self.call_callbacks(self.current_counts())
             self.clear_transient_counters()
 
     def clear_existing_rule_flag(self, entry):
@@ -1083,14 +1243,110 @@ class CountBucket(Query):
         holding the bucket's in_update_cv since it updates the matches
         structure.
         """
-        assert k in self.matches
-        self.matches[k].existing_rule = False
+        assert entry in self.matches
+        self.matches[entry].existing_rule = False
 
     def __eq__(self, other):
         # TODO: if buckets eventually have names, equality should
         # be on names.
         return id(self) == id(other)
 
+
+class GroupedCountBucket(CountBucket):
+    """
+    A CountBucket keeping separate counts for each group of packets, where a
+    group is given by the packets' values for the group_by fields. A single
+    bucket serves every group: its rules are told apart by their match on
+    those fields, so each switch is queried once and its stats reply is split
+    among the groups in one pass. Callbacks are called with a dict from each
+    group (a tuple of values for group_by) to [packet count, byte count].
+
+    :param group_by: the fields identifying a group
+    :type group_by: list string
+    """
+    def __init__(self, group_by):
+        self.group_by = tuple(group_by)
+        self.groups = {}          # group -> [persistent packets, bytes]
+        self.table_counts = {}    # group -> [packets, bytes] in rules
+        super(GroupedCountBucket, self).__init__()
+
+    def __repr__(self):
+        return "GroupedCountBucket " + str(id(self))
+
+    def add_group(self, group):
+        """
+        Start counting group, with no packets so far.
+
+        :param group: a value for each of the group_by fields
+        :type group: tuple
+        """
+        with self.in_update_cv:
+            self.groups.setdefault(group, [0, 0])
+
+    def group_of(self, m):
+        """
+        The group whose packets m matches, or None if m doesn't pin down a
+        group.
+
+        :param m: a packet or a concrete rule match
+        :rtype: tuple
+        """
+        try:
+            group = []
+            for f in self.group_by:
+                v = m[f]
+                if isinstance(v, basestring):
+                    if f in ['srcip', 'dstip']:
+                        v = interned_ip(v)
+                    elif f in ['srcmac', 'dstmac']:
+                        v = interned_mac(v)
+                group.append(v)
+        except (KeyError, ValueError):
+            return None
+        group = tuple(group)
+        if group in self.groups:
+            return group
+        return None
+
+    def add_counts(self, counts, group, packet_count, byte_count):
+        if group is None:
+            self.log.debug("Counts outside any group in bucket %d" % id(self))
+            return
+        c = counts.setdefault(group, [0, 0])
+        c[0] += packet_count
+        c[1] += byte_count
+
+    def clear_transient_counters(self):
+        self.table_counts = {}
+
+    def count_applied(self, pkt):
+        self.add_counts(self.groups, self.group_of(pkt), 1,
+                        pkt['payload_len'])
+
+    def count_removed(self, entry, packet_count, byte_count):
+        self.add_counts(self.groups, self.group_of(entry.match),
+                        packet_count, byte_count)
+
+    def count_table(self, entry, packet_count, byte_count):
+        self.add_counts(self.table_counts, self.group_of(entry.match),
+                        packet_count, byte_count)
+
+    def count_existing(self, entry, packet_count, byte_count):
+        self.add_counts(self.groups, self.group_of(entry.match),
+                        -packet_count, -byte_count)
+
+    def current_counts(self):
+        """
+        The counts of each group reported to callbacks.
+
+        :rtype: dict tuple -> [int, int]
+        """
+        counts = {}
+        for (group, (packets, bytes)) in self.groups.iteritems():
+            (table_packets, table_bytes) = self.table_counts.get(group, (0, 0))
+            counts[group] = [packets + table_packets, bytes + table_bytes]
+        return counts
+
 ################################################################################
 # Combinator Policies                                                          #
 ################################################################################
@@ -1108,17 +1364,9 @@ class CombinatorPolicy(Policy):
         self._classifier = None
         super(CombinatorPolicy,self).__init__()
 
-    def compile(self):
-        """
-        Produce a Classifier for this policy
-
-        :rtype: Classifier
-        """
-        if NO_CACHE: 
-            self._classifier = self.generate_classifier()
-        if not self._classifier:
-            self._classifier = self.generate_classifier()
-        return self._classifier
+    def generate_structural_key(self):
+        return policy_key((self.__class__,) +
+                         tuple(p.structural_key() for p in self.policies))
 
     def __repr__(self):
         return "%s:\n%s" % (self.name(),util.repr_plus(self.policies))
@@ -1198,7 +1446,15 @@ class parallel(CombinatorPolicy):
         if len(self.policies) == 0:  # EMPTY PARALLEL IS A DROP
             return drop.compile()
         classifiers = map(lambda p: p.compile(), self.policies)
-        return reduce(lambda acc, c: acc + c, classifiers)
+        # Combine pairwise rather than folding left, so each rule is crossed
+        # O(log n) rather than O(n) times.
+        while len(classifiers) > 1:
+            paired = [c1 + c2 for (c1, c2) in zip(classifiers[0::2],
+                                                  classifiers[1::2])]
+            if len(classifiers) % 2:
+                paired.append(classifiers[-1])
+            classifiers = paired
+        return classifiers[0]
 
 
 class union(parallel,Filter):
@@ -1350,21 +1606,16 @@ class DerivedPolicy(Policy):
         """
         return self.policy.eval(pkt)
 
-    def compile(self):
-        """
-        Produce a Classifier for this policy
-
-        :rtype: Classifier
-        """
-        if NO_CACHE: 
-            self._classifier = self.generate_classifier()
-        if not self._classifier:
-            self._classifier = self.generate_classifier()
-        return self._classifier
-
     def generate_classifier(self):
         return self.policy.compile()
 
+    def generate_structural_key(self):
+        # a derived policy compiles to exactly its inner policy's classifier
+        if (self.__class__.generate_classifier.im_func is
+            DerivedPolicy.generate_classifier.im_func):
+            return self.policy.structural_key()
+        return super(DerivedPolicy,self).generate_structural_key()
+
     def __repr__(self):
         return "[DerivedPolicy]\n%s" % repr(self.policy)
 
@@ -1415,12 +1666,53 @@ class if_(DerivedPolicy):
         else:
             return self.f_branch.eval(pkt)
 
+    def generate_classifier(self):
+        pred = self.pred.compile()
+        if not pred.is_filter_classifier():
+            return self.policy.compile()
+        # priority order stands in for the negation of pred
+        return pred.first_match(self.t_branch.compile(),
+                                self.f_branch.compile())
+
+    def generate_structural_key(self):
+        return policy_key((if_, self.pred.structural_key(),
+                           self.t_branch.structural_key(),
+                           self.f_branch.structural_key()))
+
     def __repr__(self):
         return "if\n%s\nthen\n%s\nelse\n%s" % (util.repr_plus([self.pred]),
                                                util.repr_plus([self.t_branch]),
                                                util.repr_plus([self.f_branch]))
 
 
+class first_match(DerivedPolicy):
+    """
+    The policy of the first case whose predicate holds, or the default policy
+    if none does: a chain of if_'s.
+
+    :param cases: (predicate, policy) pairs, highest priority first
+    :type cases: list (Filter, Policy)
+    :param default: the policy for packets no predicate holds for
+    :type default: Policy
+    """
+    def __init__(self, cases, default=identity):
+        self.cases = list(cases)
+        self.default = default
+        policy = default
+        for (pred, case_policy) in reversed(self.cases):
+            policy = if_(pred, case_policy, policy)
+        super(first_match,self).__init__(policy)
+
+    def eval(self, pkt):
+        for (pred, case_policy) in self.cases:
+            if pred.eval(pkt):
+                return case_policy.eval(pkt)
+        return self.default.eval(pkt)
+
+    def __repr__(self):
+        return "first_match\n%s" % util.repr_plus([self.policy])
+
+
 class fwd(DerivedPolicy):
     """
     fwd out a specified port.
@@ -1452,6 +1744,190 @@ class xfwd(DerivedPolicy):
         return "xfwd %s" % self.outport
 
 
+################################################################################
+# Table Policies                                                               #
+################################################################################
+
+class lookup(Policy):
+    """
+    Exact-match table keyed on a tuple of header fields. A packet whose
+    values for fields are a key of the table is handled by that key's
+    policy, any other packet by the default policy.
+
+    Unlike a chain of if_ policies, evaluation is a single dict lookup, and
+    compilation emits each entry's rules restricted to its key, followed by
+    the default's rules, without negating the other keys. Entries are added
+    and removed in place (table[key] = policy, del table[key]), after which
+    the enclosing policy must be recompiled, e.g., by reassigning the policy
+    of an enclosing DynamicPolicy.
+
+    :param fields: the header fields making up each key
+    :type fields: list string
+    :param default: the policy for packets matching no key
+    :type default: Policy
+    :param entries: the initial entries
+    :type entries: dict or list (tuple * Policy)
+    """
+    def __init__(self, fields, default=drop, entries=()):
+        self.fields = tuple(fields)
+        self.default = default
+        self.table = OrderedDict()
+        self.version = 0
+        # key -> (the entry policy's classifier, the entry's rules)
+        self._entry_rules = {}
+        super(lookup,self).__init__()
+        for key, policy in OrderedDict(entries).iteritems():
+            self[key] = policy
+
+    def normalize_key(self, key):
+        """
+        The key with address fields given as strings converted to the IP and
+        MAC objects found in packets.
+
+        :param key: a value for each of self.fields
+        :type key: tuple
+        :rtype: tuple
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) != len(self.fields):
+            raise TypeError('key %s does not match fields %s' %
+                            (key, self.fields))
+        converted = []
+        for (f, v) in zip(self.fields, key):
+            if isinstance(v, basestring):
+                if f in ['srcip', 'dstip']:
+                    v = interned_ip(v)
+                elif f in ['srcmac', 'dstmac']:
+                    v = interned_mac(v)
+            converted.append(v)
+        return tuple(converted)
+
+    def select(self, pkt):
+        """
+        The policy handling pkt.
+
+        :param pkt: the packet to look up
+        :type pkt: Packet
+        :rtype: Policy
+        """
+        try:
+            key = tuple(pkt[f] for f in self.fields)
+        except KeyError:
+            return self.default
+        return self.table.get(key, self.default)
+
+    def eval(self, pkt):
+        """
+        evaluate this policy on a single packet
+
+        :param pkt: the packet on which to be evaluated
+        :type pkt: Packet
+        :rtype: set Packet
+        """
+        return self.select(pkt).eval(pkt)
+
+    @property
+    def policies(self):
+        """The entries' policies, followed by the default."""
+        return self.table.values() + [self.default]
+
+    def __getitem__(self, key):
+        return self.table[self.normalize_key(key)]
+
+    def __setitem__(self, key, policy):
+        key = self.normalize_key(key)
+        self.table[key] = policy
+        self._entry_rules.pop(key, None)
+        self.entries_changed()
+
+    def __delitem__(self, key):
+        key = self.normalize_key(key)
+        del self.table[key]
+        self._entry_rules.pop(key, None)
+        self.entries_changed()
+
+    def __contains__(self, key):
+        return self.normalize_key(key) in self.table
+
+    def __len__(self):
+        return len(self.table)
+
+    def entries_changed(self):
+        self.version += 1
+        self._classifier = None
+        self._structural_key = None
+
+    def invalidate_classifier(self):
+        # a sub-policy changed; the entries holding it compile to new
+        # classifiers, which generate_classifier notices
+        self.entries_changed()
+
+    def compile(self):
+        """
+        Produce a Classifier for this policy. Tables change too often to be
+        worth sharing through the compilation cache; instead, the rules of
+        unchanged entries are reused.
+
+        :rtype: Classifier
+        """
+        if NO_CACHE:
+            self._entry_rules = {}
+            self._classifier = self.generate_classifier()
+        elif self._classifier is None:
+            self._classifier = self.generate_classifier()
+        return self._classifier
+
+    def key_match(self, key):
+        """
+        The match for packets with key.
+
+        :rtype: _match
+        """
+        m = {}
+        for (f, v) in zip(self.fields, key):
+            if f in ['srcip', 'dstip']:
+                v = repr(v)
+            m[f] = v
+        return _match(**m)
+
+    def generate_classifier(self):
+        rules = []
+        for key, policy in self.table.iteritems():
+            classifier = policy.compile()
+            (compiled, entry_rules) = self._entry_rules.get(key, (None, None))
+            if compiled is not classifier:
+                # the entry's classifier is total, so its rules restricted
+                # to the key cover every packet with that key
+                key_match = self.key_match(key)
+                entry_rules = []
+                for r in classifier.rules:
+                    m = key_match.intersect(r.match)
+                    if m == drop:
+                        continue
+                    entry_rules.append(Rule(m, r.actions, [r], "sequential"))
+                self._entry_rules[key] = (classifier, entry_rules)
+            rules.extend(entry_rules)
+        rules.extend(self.default.compile().rules)
+        return Classifier(rules)
+
+    def generate_structural_key(self):
+        return policy_key((self.__class__, id(self), self.version), self)
+
+    def __eq__(self, other):
+        return ( isinstance(other, lookup)
+                 and self.fields == other.fields
+                 and self.default == other.default
+                 and dict(self.table) == dict(other.table) )
+
+    def __repr__(self):
+        return "lookup on %s:\n%s\ndefault\n%s" % (
+            ','.join(self.fields),
+            util.indent_str("\n".join("%s -> %s" % (k, p)
+                                       for (k, p) in self.table.iteritems())),
+            util.repr_plus([self.default]))
+
+
 ################################################################################
 # Dynamic Policies                                                             #
 ################################################################################
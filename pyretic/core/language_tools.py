@@ -35,6 +35,9 @@ def default_mapper(parent, children):
             isinstance(parent,intersection))):
         return (type(parent))(children)
     # Derived policies are treated case by case:
+    elif isinstance(parent,lookup):
+        return lookup(parent.fields, children[-1],
+                      zip(parent.table.keys(), children[:-1]))
     elif isinstance(parent,difference):
         return difference(parent.f1, parent.f2)
     elif isinstance(parent,if_):
@@ -83,7 +86,8 @@ def ast_map(fun, policy):
           isinstance(policy,parallel) or
           isinstance(policy,union) or
           isinstance(policy,sequential) or
-          isinstance(policy,intersection)):
+          isinstance(policy,intersection) or
+          isinstance(policy,lookup)):
         for sub_policy in policy.policies:
             children_pols.append(ast_map(fun, sub_policy))
     elif (isinstance(policy,difference) or
@@ -110,7 +114,8 @@ def ast_fold(fun, acc, policy):
           isinstance(policy,parallel) or
           isinstance(policy,union) or
           isinstance(policy,sequential) or
-          isinstance(policy,intersection)):
+          isinstance(policy,intersection) or
+          isinstance(policy,lookup)):
         acc = fun(acc,policy)
         for sub_policy in policy.policies:
             acc = ast_fold(fun,acc,sub_policy)
@@ -140,6 +145,13 @@ def add_query_sub_pols(acc, policy):
     else:
         return acc
 
+def add_polled_sub_pols(acc, policy):
+    from pyretic.lib.query import PolledQuery
+    if isinstance(policy,PolledQuery):
+        return acc + [policy]
+    else:
+        return acc
+
 def add_all_sub_pols(acc, policy):
     return acc | {policy}
 
@@ -158,6 +170,16 @@ def queries_in_eval(acc, policy):
         acc = (res,new_pkts)
     elif isinstance(policy,Query):
         acc = (res | {policy}, set())
+    elif isinstance(policy,lookup):
+        # packets may select different entries
+        lookup_res = set()
+        lookup_pkts = set()
+        for pkt in pkts:
+            new_res,new_pkts = queries_in_eval((res,{pkt}),
+                                               policy.select(pkt))
+            lookup_res |= new_res
+            lookup_pkts |= new_pkts
+        acc = (lookup_res,lookup_pkts)
     elif isinstance(policy,DerivedPolicy):
         acc = queries_in_eval(acc,policy.policy)
     elif isinstance(policy,parallel):
@@ -176,6 +198,85 @@ def queries_in_eval(acc, policy):
     return acc
 
 
+def buckets_see_modified_packets(policy):
+    """
+    Whether a count or path bucket in policy may be reached by packets that an
+    earlier part of a sequential composition modified. Classifier rules keep
+    the buckets a packet reaches but not the modifications made before, so
+    queries_in_classifier_eval can't be used for such policies.
+
+    :param policy: the policy to check
+    :type policy: Policy
+    :rtype: bool
+    """
+    def walk(policy, modified):
+        """ (whether modified packets reach a bucket in policy, whether policy
+        may modify packets), for input packets already modified or not. """
+        if isinstance(policy, modify):
+            return (False, True)
+        elif isinstance(policy, CountBucket) or isinstance(policy, PathBucket):
+            return (modified, False)
+        elif isinstance(policy, sequential):
+            reached = False
+            modifies = False
+            for sub_pol in policy.policies:
+                (sub_reached, sub_modifies) = walk(sub_pol, modified)
+                reached |= sub_reached
+                modified |= sub_modifies
+                modifies |= sub_modifies
+            return (reached, modifies)
+        elif isinstance(policy, CombinatorPolicy):
+            results = [walk(sub_pol, modified) for sub_pol in policy.policies]
+            return (any(r for (r, _) in results), any(m for (_, m) in results))
+        elif isinstance(policy, lookup):
+            results = [walk(sub_pol, modified) for sub_pol in
+                       policy.table.values() + [policy.default]]
+            return (any(r for (r, _) in results), any(m for (_, m) in results))
+        elif isinstance(policy, DerivedPolicy):
+            return walk(policy.policy, modified)
+        else:
+            return (False, False)
+    return walk(policy, False)[0]
+
+
+def queries_in_classifier_eval(classifier, pkt):
+    """
+    Evaluate pkt against a compiled classifier, in a single rule lookup.
+
+    Packets reaching count or path buckets are added to them, as evaluation
+    would. If the matching rule sends packets to the controller (e.g., for a
+    FwdBucket, which the classifier doesn't identify), returns None so the
+    caller can fall back to queries_in_eval and policy evaluation. Buckets are
+    given pkt itself, so the classifier must not be that of a policy for
+    which buckets_see_modified_packets holds.
+
+    :param classifier: the compiled policy
+    :type classifier: Classifier
+    :param pkt: the packet to evaluate
+    :type pkt: Packet
+    :returns: (queries reached, output packets) or None
+    :rtype: (set Query, set Packet)
+    """
+    rule = classifier.find_rule(pkt)
+    if rule is None:
+        return (set(), set())
+    queries = set()
+    output = set()
+    for act in rule.actions:
+        if act is identity:
+            output.add(pkt)
+        elif act is drop:
+            pass
+        elif isinstance(act, modify):
+            output |= act.eval(pkt)
+        elif isinstance(act, CountBucket) or isinstance(act, PathBucket):
+            act.eval(pkt)
+            queries.add(act)
+        else:
+            return None
+    return (queries, output)
+
+
 def on_recompile_path_set(acc,pol_id,policy):
     if (  policy == identity or
           policy == drop or
@@ -188,7 +289,8 @@ def on_recompile_path_set(acc,pol_id,policy):
           isinstance(policy,parallel) or
           isinstance(policy,union) or
           isinstance(policy,sequential) or
-          isinstance(policy,intersection)):
+          isinstance(policy,intersection) or
+          isinstance(policy,lookup)):
         sub_acc = set()
         for sub_policy in policy.policies:
             sub_acc |= on_recompile_path_set(sub_acc,pol_id,sub_policy)
@@ -220,7 +322,8 @@ def on_recompile_path_list(pol_id,policy):
           isinstance(policy,parallel) or
           isinstance(policy,union) or
           isinstance(policy,sequential) or
-          isinstance(policy,intersection)):
+          isinstance(policy,intersection) or
+          isinstance(policy,lookup)):
         sub_acc = list()
         for sub_policy in policy.policies:
             sub_acc += on_recompile_path_list(pol_id,sub_policy)
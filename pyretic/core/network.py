@@ -31,6 +31,7 @@
 import socket
 import struct
 from bitarray import bitarray
+from ipaddr import AddressValueError, NetmaskValueError
 import networkx as nx
 
 from pyretic.core import util
@@ -49,20 +50,64 @@ IPV6_TYPE = 0x86dd
 ################################################################################
 
 class IPPrefix(object):
+    """
+    An IPv4 prefix, kept as its network address and mask as integers.
+    Prefixes compare equal when they have the same network and length; an
+    address compares equal to a prefix containing it.
+
+    :param pattern: "a.b.c.d/len", "a.b.c.d/netmask", "a.b.c.d/hostmask", or
+        a prefix
+    :type pattern: string or IPPrefix
+    :raises AddressValueError: if the address isn't a dotted quad
+    :raises NetmaskValueError: if the length or mask isn't valid
+    """
+    max_prefixlen = 32
+
     def __init__(self, pattern):
-        self.masklen = 32
-        parts = pattern.split("/")
-        self.pattern = IP(parts[0])
-        if len(parts) == 2:
-            self.masklen = int(parts[1])
+        if isinstance(pattern, IPPrefix):
+            (ip, masklen) = (pattern.pattern, pattern.masklen)
         else:
-            raise TypeError
-        self.prefix = self.pattern.to_bits()[:self.masklen]
+            parts = pattern.split("/")
+            if len(parts) == 1:
+                raise TypeError("%s is not a prefix" % pattern)
+            elif len(parts) > 2:
+                raise AddressValueError(pattern)
+            ip = IP(parse_ip(parts[0]))
+            masklen = _parse_masklen(parts[1])
+        self.pattern = ip
+        self.masklen = masklen
+        self.mask = (0xffffffff << (32 - masklen)) & 0xffffffff
+        self.value = ip.value & self.mask
+        self._hash = hash((self.value, masklen))
+
+    @property
+    def prefixlen(self):
+        return self.masklen
+
+    @property
+    def ip(self):
+        """The address the prefix was written with, host bits included."""
+        return self.pattern
+
+    @property
+    def network(self):
+        return IP(self.value)
+
+    def __contains__(self, other):
+        """Whether the address or prefix other lies within this prefix."""
+        if isinstance(other, IPPrefix):
+            return (other.masklen >= self.masklen and
+                    other.value & self.mask == self.value)
+        elif isinstance(other, IPAddr):
+            return other.value & self.mask == self.value
+        return False
 
     def __eq__(self, other):
         """Match by checking prefix equality"""
-        if isinstance(other,IPAddr):
-            return self.prefix == other.to_bits()[:self.masklen]
+        if isinstance(other, IPPrefix):
+            return self.value == other.value and self.masklen == other.masklen
+        elif isinstance(other,IPAddr):
+            return other.value & self.mask == self.value
         else:
             return False
 
@@ -70,54 +115,109 @@ class IPPrefix(object):
         return not (self == other)
 
     def __hash__(self):
-        return hash((self.pattern,self.masklen))
+        return self._hash
 
     def __repr__(self):
         return "%s/%d" % (repr(self.pattern),self.masklen)
 
+def parse_ip(s):
+    """
+    The value of the dotted quad s, read strictly: four decimal octets with no
+    leading zeros.
+
+    :param s: the address
+    :type s: string
+    :rtype: int
+    :raises AddressValueError: if s isn't a dotted quad
+    """
+    if not isinstance(s, basestring):
+        raise AddressValueError(repr(s))
+    octets = s.split('.')
+    if len(octets) != 4:
+        raise AddressValueError(s)
+    value = 0
+    for octet in octets:
+        if (not octet.isdigit() or (len(octet) > 1 and octet[0] == '0') or
+            int(octet) > 255):
+            raise AddressValueError(s)
+        value = (value << 8) | int(octet)
+    return value
+
+def _parse_masklen(s):
+    """ The prefix length written s, as a length, netmask or hostmask."""
+    if s.isdigit():
+        if int(s) <= 32:
+            return int(s)
+    else:
+        try:
+            mask = parse_ip(s)
+        except AddressValueError:
+            mask = None
+        if mask is not None:
+            for m in [mask, ~mask & 0xffffffff]:
+                masklen = 32 - (~m & 0xffffffff).bit_length()
+                if m == (0xffffffff << (32 - masklen)) & 0xffffffff:
+                    return masklen
+    raise NetmaskValueError("%s is not a valid netmask" % s)
+
 class IPAddr(object):
+    """
+    An IPv4 address, kept as an integer.
+
+    :param ip: a dotted quad, 4 bytes in network order, an integer, or an
+        address
+    :type ip: string, int or IPAddr
+    """
     def __init__(self, ip):
 
         # already a IP object
         if isinstance(ip, IPAddr):
-            self.bits = ip.bits
+            self.value = ip.value
+
+        elif isinstance(ip, (int, long)):
+            self.value = ip
 
         # otherwise will be in byte or string encoding
         else:
             assert isinstance(ip, basestring)
-            
-            b = bitarray()
 
             # byte encoding
             if len(ip) == 4:
-                b.frombytes(ip)
+                self.value = struct.unpack("!I", ip)[0]
 
             # string encoding
             else:
-                b.frombytes(socket.inet_aton(ip))
+                self.value = struct.unpack("!I", socket.inet_aton(ip))[0]
 
-            self.bits = b
+        self._repr = None
 
     def to_bits(self):
-        return self.bits
+        b = bitarray()
+        b.frombytes(self.to_bytes())
+        return b
 
     def to01(self):
-        return self.bits.to01()
+        return bin(self.value)[2:].zfill(32)
 
     def to_bytes(self):
-        return self.bits.tobytes()
+        return struct.pack("!I", self.value)
 
     def fromRaw(self):
         return self.to_bytes()
 
+    def __int__(self):
+        return self.value
+
     def __repr__(self):
-        return socket.inet_ntoa(self.to_bytes())
+        if self._repr is None:
+            self._repr = socket.inet_ntoa(self.to_bytes())
+        return self._repr
 
     def __hash__(self):
-        return hash(self.to_bytes())    
+        return hash(self.value)
 
     def __eq__(self,other):
-        return repr(self) == repr(other)
+        return isinstance(other, IPAddr) and self.value == other.value
 
     def __ne__(self, other):
         return not (self == other)
@@ -127,21 +227,30 @@ class IP(IPAddr):
 
             
 class EthAddr(object):
+    """
+    An Ethernet address, kept as an integer.
+
+    :param mac: colon or dash separated hex bytes, 6 bytes in network order,
+        an integer, or an address
+    :type mac: string, int or EthAddr
+    """
     def __init__(self, mac):
 
         # already a MAC object
         if isinstance(mac, EthAddr):
-            self.bits = mac.bits
+            self.value = mac.value
+
+        elif isinstance(mac, (int, long)):
+            self.value = mac
 
         # otherwise will be in byte or string encoding
         else:
             assert isinstance(mac, basestring)
-            
-            b = bitarray()
 
             # byte encoding
             if len(mac) == 6:
-                b.frombytes(mac)
+                (hi, lo) = struct.unpack("!HI", mac)
+                self.value = (hi << 32) | lo
 
             # string encoding
             else:
@@ -157,29 +266,36 @@ class EthAddr(object):
                 if not m:
                     raise ValueError
                 else:
-                    b.frombytes(struct.pack("!BBBBBB", *(int(s, 16) for s in m.groups())))
+                    self.value = reduce(lambda acc, s: (acc << 8) | int(s, 16),
+                                        m.groups(), 0)
 
-            self.bits = b
+        self._repr = None
         
     def to_bits(self):
-        return self.bits
+        b = bitarray()
+        b.frombytes(self.to_bytes())
+        return b
 
     def to01(self):
-        return self.bits.to01()
+        return bin(self.value)[2:].zfill(48)
 
     def to_bytes(self):
-        return self.bits.tobytes()
+        return struct.pack("!HI", self.value >> 32, self.value & 0xffffffff)
+
+    def __int__(self):
+        return self.value
 
     def __repr__(self):
-        parts = struct.unpack("!BBBBBB", self.to_bytes())
-        mac = ":".join(hex(part)[2:].zfill(2) for part in parts)
-        return mac
+        if self._repr is None:
+            parts = struct.unpack("!BBBBBB", self.to_bytes())
+            self._repr = ":".join(hex(part)[2:].zfill(2) for part in parts)
+        return self._repr
 
     def __hash__(self):
-        return hash(self.to_bytes())
+        return hash(self.value)
 
     def __eq__(self,other):
-        return repr(self) == repr(other)
+        return isinstance(other, EthAddr) and self.value == other.value
 
     def __ne__(self, other):
         return not (self == other)
@@ -187,6 +303,39 @@ class EthAddr(object):
 class MAC(EthAddr):
     pass
 
+# Packet-ins carry the same few addresses over and over, so the runtime shares
+# one IP/MAC object per address string instead of parsing it afresh for every
+# packet; matches likewise share one IPPrefix per prefix. Address objects are
+# never modified in place.
+INTERN_CACHE_SIZE = 65536
+
+@util.cached_bounded(INTERN_CACHE_SIZE)
+def interned_ip(ip):
+    return IP(ip)
+
+@util.cached_bounded(INTERN_CACHE_SIZE)
+def interned_mac(mac):
+    return MAC(mac)
+
+@util.cached_bounded(INTERN_CACHE_SIZE)
+def interned_prefix(pattern):
+    """
+    The shared IPPrefix for an address or prefix, as written in a match:
+    a bare address is a /32.
+
+    :raises AddressValueError: if the address isn't a dotted quad
+    :raises NetmaskValueError: if the length or mask isn't valid
+    """
+    if isinstance(pattern, IPPrefix):
+        return pattern
+    if isinstance(pattern, (IPAddr, int, long)):
+        pattern = repr(IP(pattern))
+    elif not isinstance(pattern, basestring):
+        raise AddressValueError(repr(pattern))
+    if not "/" in pattern:
+        pattern += "/32"
+    return IPPrefix(pattern)
+
 ################################################################################
 # Tools
 ################################################################################
@@ -1,4 +1,5 @@
 import struct, re
+import socket
 import pyretic.vendor
 
 from ryu.lib.packet import *
@@ -90,6 +91,216 @@ def get_protocol(ryu_pkt, protocol):
 
     return None
 
+################################################################################
+# Fast Header Parsing
+################################################################################
+ETH_HEADER  = struct.Struct('!6s6sH')
+VLAN_HEADER = struct.Struct('!HH')
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+ARP_HEADER  = struct.Struct('!HHBBH6s4s6s4s')
+PORTS       = struct.Struct('!HH')
+ICMP_HEADER = struct.Struct('!BB')
+
+# Smallest transport header (or ICMP message) ryu parses without error
+TRANSPORT_MIN_LEN = { TCP_PROTO : 20, UDP_PROTO : 8, ICMP_PROTO : 8 }
+
+def mac_to_text(b):
+    return '%02x:%02x:%02x:%02x:%02x:%02x' % struct.unpack('6B', b)
+
+def parse_headers(raw):
+    """
+    Decode the headers of an Ethernet (optionally VLAN tagged) frame
+    carrying IPv4 TCP, UDP or ICMP, or ARP, straight from fixed offsets in
+    the raw bytes, as Processor.unpack does through ryu.
+
+    :param raw: the packet bytes
+    :type raw: str
+    :returns: the headers with the offsets of the network and (for IPv4) the
+        transport header, or None if the packet needs the full ryu parser
+    :rtype: (dict, int, int)
+    """
+    size = len(raw)
+    if size < ETH_HEADER.size:
+        return None
+    (dst, src, ethtype) = ETH_HEADER.unpack_from(raw)
+    headers = { 'srcmac' : mac_to_text(src),
+                'dstmac' : mac_to_text(dst),
+                'header_len' : ETH_HEADER.size,
+                'payload_len' : size }
+    offset = ETH_HEADER.size
+    if ethtype == VLAN:
+        if size < offset + VLAN_HEADER.size:
+            return None
+        (tci, ethtype) = VLAN_HEADER.unpack_from(raw, offset)
+        headers['vlan_pcp'] = tci >> 13
+        headers['vlan_id'] = tci & 0xfff
+        offset += VLAN_HEADER.size
+    headers['ethtype'] = ethtype
+
+    if ethtype == IPV4:
+        if size < offset + IPV4_HEADER.size:
+            return None
+        (version, tos, total_length, _, _, _, proto, _, srcip, dstip) = \
+            IPV4_HEADER.unpack_from(raw, offset)
+        ihl = version & 0xf
+        if ihl < 5:
+            return None
+        headers['srcip'] = socket.inet_ntoa(srcip)
+        headers['dstip'] = socket.inet_ntoa(dstip)
+        headers['protocol'] = proto
+        headers['tos'] = tos
+        min_len = TRANSPORT_MIN_LEN.get(proto)
+        if min_len is None:
+            return None
+        # the transport header, as ryu slices it from the IPv4 payload
+        start = offset + ihl * 4
+        end = min(offset + total_length, size)
+        if end - start < min_len:
+            return None
+        # ryu drops a TCP layer whose data offset is 0 (its length is 0)
+        if proto == TCP_PROTO and ord(raw[start + 12]) < 0x10:
+            return None
+        if proto == ICMP_PROTO:
+            (headers['srcport'], headers['dstport']) = \
+                ICMP_HEADER.unpack_from(raw, start)
+        else:
+            (headers['srcport'], headers['dstport']) = \
+                PORTS.unpack_from(raw, start)
+        return (headers, offset, start)
+    elif ethtype == ARP:
+        if size < offset + ARP_HEADER.size:
+            return None
+        (_, _, _, _, opcode, _, srcip, _, dstip) = \
+            ARP_HEADER.unpack_from(raw, offset)
+        headers['protocol'] = opcode
+        headers['srcip'] = socket.inet_ntoa(srcip)
+        headers['dstip'] = socket.inet_ntoa(dstip)
+        return (headers, offset, None)
+    return None
+
+def fast_unpack(raw):
+    """
+    The headers Processor.unpack decodes from raw, or None if the packet
+    needs the full ryu parser (see parse_headers).
+
+    :param raw: the packet bytes
+    :type raw: str
+    :rtype: dict
+    """
+    parsed = parse_headers(raw)
+    if parsed is None:
+        return None
+    return parsed[0]
+
+# Header fields written by Processor.pack
+PACKED_FIELDS = ('srcmac', 'dstmac', 'ethtype', 'vlan_id', 'vlan_pcp',
+                 'srcip', 'dstip', 'protocol', 'tos', 'srcport', 'dstport')
+
+# Offsets of header fields fast_pack patches, from the start of their layer
+MAC_OFFSETS  = { 'dstmac' : 0, 'srcmac' : 6 }
+IPV4_OFFSETS = { 'srcip' : 12, 'dstip' : 16 }
+ARP_OFFSETS  = { 'srcip' : 14, 'dstip' : 24 }
+PORT_OFFSETS = { 'srcport' : 0, 'dstport' : 2 }
+TCP_CSUM = 16
+UDP_CSUM = 6
+IPV4_CSUM = 10
+
+def checksum_update(csum, old, new):
+    """Incrementally update a ones' complement checksum for 16-bit aligned
+    bytes changed from old to new (RFC 1624)."""
+    total = ~csum & 0xffff
+    for i in range(0, len(old), 2):
+        total += (~((ord(old[i]) << 8) | ord(old[i+1])) & 0xffff)
+        total += (ord(new[i]) << 8) | ord(new[i+1])
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+def fast_pack(pyr_pkt):
+    """
+    Pack headers into the packet's raw bytes as Processor.pack does, by
+    patching just the changed fields (and checksums) in place, or passing
+    the raw bytes through untouched if no field changed.
+
+    :param pyr_pkt: headers, including 'raw'
+    :type pyr_pkt: dict
+    :returns: the packet bytes, or None if the change needs the full
+        ryu-based packer (e.g., VLAN tags or protocols change)
+    :rtype: str
+    """
+    raw = pyr_pkt.get('raw')
+    if not raw:
+        return None
+    # a flooded packet is packed once per outport, from the same raw bytes
+    (last_raw, parsed) = fast_pack.last
+    if not raw is last_raw:
+        parsed = parse_headers(raw)
+        fast_pack.last = (raw, parsed)
+    if parsed is None:
+        return None
+    (original, l3, l4) = parsed
+    changed = []
+    for field in PACKED_FIELDS:
+        if not field in pyr_pkt:
+            # no VLAN fields means the tag gets stripped
+            if field in original and field in ('vlan_id', 'vlan_pcp'):
+                return None
+            continue
+        value = pyr_pkt[field]
+        if isinstance(value, IPAddr) or isinstance(value, EthAddr):
+            value = str(value)
+        if field in original and value == original[field]:
+            continue
+        changed.append((field, value))
+    if not changed:
+        return raw
+
+    ethtype = original['ethtype']
+    proto = original.get('protocol')
+    data = bytearray(raw)
+    def patch(offset, new, csum_offsets=()):
+        old = str(data[offset:offset + len(new)])
+        for csum_offset in csum_offsets:
+            (csum,) = struct.unpack_from('!H', data, csum_offset)
+            if csum_offset == l4 + UDP_CSUM and proto == UDP_PROTO:
+                if csum == 0:
+                    continue # no UDP checksum
+                csum = checksum_update(csum, old, new) or 0xffff
+            else:
+                csum = checksum_update(csum, old, new)
+            struct.pack_into('!H', data, csum_offset, csum)
+        data[offset:offset + len(new)] = new
+
+    transport_csum = None
+    if ethtype == IPV4 and proto == TCP_PROTO:
+        transport_csum = (l4 + TCP_CSUM,)
+    elif ethtype == IPV4 and proto == UDP_PROTO:
+        transport_csum = (l4 + UDP_CSUM,)
+    try:
+        for (field, value) in changed:
+            if field in MAC_OFFSETS:
+                patch(MAC_OFFSETS[field], addrconv.mac.text_to_bin(value))
+            elif field in IPV4_OFFSETS and ethtype == IPV4:
+                # the TCP/UDP checksum covers the addresses (pseudo-header)
+                patch(l3 + IPV4_OFFSETS[field],
+                      addrconv.ipv4.text_to_bin(value),
+                      (l3 + IPV4_CSUM,) + (transport_csum or ()))
+            elif field in ARP_OFFSETS and ethtype == ARP:
+                patch(l3 + ARP_OFFSETS[field],
+                      addrconv.ipv4.text_to_bin(value))
+            elif field == 'tos' and ethtype == IPV4:
+                patch(l3, raw[l3] + chr(value), (l3 + IPV4_CSUM,))
+            elif field in PORT_OFFSETS and transport_csum:
+                patch(l4 + PORT_OFFSETS[field], struct.pack('!H', value),
+                      transport_csum)
+            else:
+                return None
+    except Exception:
+        # values the ryu packer may still make sense of
+        return None
+    return str(data)
+fast_pack.last = (None, None)
+
 ################################################################################
 # Processor
 ################################################################################
@@ -134,7 +345,15 @@ class Processor(object):
 
                 return pyr_pkt
 
+        # fast_unpack decodes exactly the built-in fields
+        fast = frozenset(of_fields()) == BUILTIN_FIELDS
+
         def expand(ryu_pkt):
+            if fast and isinstance(ryu_pkt, str):
+                headers = fast_unpack(ryu_pkt)
+                if headers is not None:
+                    return headers
+
             if not isinstance(ryu_pkt, packet.Packet):
                 ryu_pkt = packet.Packet(ryu_pkt)
 
@@ -146,6 +365,11 @@ class Processor(object):
             return headers
 
         def contract(pyr_pkt):
+            if fast:
+                raw = fast_pack(pyr_pkt)
+                if raw is not None:
+                    return raw
+
             pkt = packet.Packet(pyr_pkt['raw'])
 
             if len(pyr_pkt['raw']) == 0:
@@ -483,6 +707,8 @@ class ArpSrcIp(object): pass
 @of_field("arp.dst_ip", "dstip", ether_validator(ARP), version="1.0")
 class ArpDstIp(object): pass
 
+BUILTIN_FIELDS = frozenset(of_fields("1.0"))
+
 ################################################################################
 # Packet 
 ################################################################################
@@ -492,6 +718,22 @@ class Packet(object):
     def __init__(self, state={}):
         self.header = util.frozendict(state)
 
+    @classmethod
+    def from_headers(cls, headers):
+        """
+        Build a packet directly from a fresh dict of headers, without the
+        copies made by Packet(...).modifymany(...). The dict is handed over
+        to the packet and must not be modified afterwards; unlike
+        modifymany, headers set to None are kept.
+
+        :param headers: header name to value
+        :type headers: dict
+        :rtype: Packet
+        """
+        pkt = cls.__new__(cls)
+        pkt.header = util.frozendict.adopt(headers)
+        return pkt
+
     def available_fields(self):
         return self.header.keys()
 
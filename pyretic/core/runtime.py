@@ -35,16 +35,27 @@ from pyretic.core.network import *
 from pyretic.core.packet import *
 from pyretic.core.classifier import get_rule_exact_match
 from pyretic.core.classifier import get_rule_derivation_tree
+from pyretic.core.classifier import track_provenance
 
 from multiprocessing import Process, Manager, RLock, Lock, Value, Queue, Condition
 import logging, sys, time
+import bisect
+import random
+import threading
 from datetime import datetime
 import copy
 
 TABLE_MISS_PRIORITY = 0
 TABLE_START_PRIORITY = 60000
 STATS_REQUERY_THRESHOLD_SEC = 10
+POLL_JITTER = 0.1
+ADDRESS_CONVERSIONS = {'srcmac' : interned_mac, 'dstmac' : interned_mac,
+                       'srcip' : interned_ip, 'dstip' : interned_ip}
 NUM_PATH_TAGS=1022
+# tables of the multi-table path query pipeline
+PATH_IN_TABLE = 0
+FORWARDING_TABLE = 1
+PATH_OUT_TABLE = 2
 
 class Runtime(object):
     """
@@ -61,10 +72,18 @@ class Runtime(object):
     :type mode: string
     :param verbosity: one of low, normal, high, please-make-it-stop
     :type verbosity: string
+    :param compiled_eval: interpret packets against the compiled policy
+    :type compiled_eval: bool
+    :param multitable: install path queries as a pipeline of OpenFlow 1.3
+        tables (tagging, forwarding, capture) instead of a single table
+    :type multitable: bool
     """
     def __init__(self, backend, main, path_main, kwargs, mode='interpreted',
-                 verbosity='normal'):
+                 verbosity='normal', compiled_eval=False, multitable=False):
         self.verbosity = self.verbosity_numeric(verbosity)
+        # rule derivations cost memory, so only keep them when debugging
+        track_provenance(self.verbosity >=
+                         self.verbosity_numeric('please-make-it-stop'))
         self.log = logging.getLogger('%s.Runtime' % __name__)
         self.network = ConcreteNetwork(self)
         self.prev_network = self.network.copy()
@@ -76,6 +95,8 @@ class Runtime(object):
         self.path_out_capture = DynamicPolicy(drop)
         self.dynamic_sub_path_pols = set()
         self.dynamic_path_preds    = set()
+        self.pipeline = None
+        self.pipeline_suffixes = {}
 
         if path_main:
             from pyretic.lib.path import pathcomp
@@ -88,11 +109,30 @@ class Runtime(object):
             out_capture = (in_tag_policy >> self.path_out_capture)
             virtual_tag = virtual_field_tagging()
             virtual_untag = virtual_field_untagging()
+            fwding_policy = self.policy
             self.policy = ((virtual_tag >> forwarding >> virtual_untag) +
                            (virtual_tag >> in_capture) +
                            (virtual_tag >> out_capture))
+            if multitable:
+                # Each stage is compiled into a table of its own, so that
+                # tagging and capture rules add to the forwarding rules
+                # rather than multiply them. self.policy still interprets
+                # packets sent to the controller from the first table.
+                out_stage = ((self.path_out_tagging >> virtual_untag) +
+                             self.path_out_capture)
+                self.pipeline = [
+                    (PATH_IN_TABLE, virtual_tag >> (self.path_in_tagging +
+                                                    self.path_in_capture)),
+                    (FORWARDING_TABLE, fwding_policy),
+                    (PATH_OUT_TABLE, out_stage)]
+                self.pipeline_suffixes = {
+                    FORWARDING_TABLE : fwding_policy >> out_stage,
+                    PATH_OUT_TABLE : out_stage }
 
         self.mode = mode
+        self.compiled_eval = compiled_eval
+        self.compiled_eval_failed = False
+        self.buckets_see_modified = None # unknown until the next packet-in
         self.backend = backend
         self.backend.runtime = self
         self.policy_lock = RLock()
@@ -102,6 +142,7 @@ class Runtime(object):
         self.extended_values_to_vlan_db = {}
         self.extended_values_lock = RLock()
         self.dynamic_sub_pols = set()
+        self.polled_sub_pols = []
         self.in_network_update = False
         self.in_bucket_apply = False
         self.network_triggered_policy_update = False
@@ -112,14 +153,21 @@ class Runtime(object):
         self.last_queried_time = {}
         self.global_outstanding_deletes_lock = Lock()
         self.global_outstanding_deletes = {}
+        self.stats_index_lock = Lock()
+        self.stats_index = {} # (match, priority, version) -> [buckets]
         self.manager = Manager()
         self.old_rules_lock = Lock()
         # self.old_rules = self.manager.list() # not multiprocess state anymore!
-        self.old_rules = []
+        self.old_rules = index_rules([]) # installed rules, keyed by rule_key
+        self.concrete_rules_cache = {}
+        self.concrete_rules_switches = None
         self.update_rules_lock = Lock()
         self.update_buckets_lock = Lock()
         self.classifier_version_no = 0
         self.classifier_version_lock = Lock()
+        self.installer = RuleInstaller(self.install_diff_lists)
+        self.poller = PollScheduler()
+        self.poller.attach(self)
         self.default_cookie = 0
         self.packet_in_time = 0
         self.num_packet_ins = 0
@@ -150,11 +198,21 @@ class Runtime(object):
         with self.policy_lock:
             pyretic_pkt = self.concrete2pyretic(concrete_pkt)
 
-            # find the queries, if any in the policy, that will be evaluated
-            queries,pkts = queries_in_eval((set(),{pyretic_pkt}),self.policy)
-
-            # evaluate the policy
-            output = self.policy.eval(pyretic_pkt)
+            # a packet sent up from a later table of the pipeline has been
+            # through the earlier ones already
+            policy = self.pipeline_suffixes.get(concrete_pkt.get('table'),
+                                                self.policy)
+            result = None
+            if self.compiled_eval and policy is self.policy:
+                result = self.classifier_eval(pyretic_pkt)
+            if result is None:
+                # find the queries, if any in the policy, that will be evaluated
+                queries,pkts = queries_in_eval((set(),{pyretic_pkt}),policy)
+
+                # evaluate the policy
+                output = policy.eval(pyretic_pkt)
+            else:
+                queries,output = result
 
             # apply the queries whose buckets have received new packets
             self.in_bucket_apply = True
@@ -184,6 +242,39 @@ class Runtime(object):
         if self.mode == 'reactive0' and not queries:
             self.reactive0_install(pyretic_pkt,output)
 
+    def classifier_eval(self, pyretic_pkt):
+        """
+        Evaluate a packet against the compiled policy rather than the policy
+        AST, when the policy can be compiled.
+
+        :param pyretic_pkt: the packet to evaluate
+        :type pyretic_pkt: Packet
+        :returns: (queries reached, output packets), or None if the packet
+            must be evaluated on the policy instead
+        :rtype: (set Query, set Packet)
+        """
+        # compiled virtual-field matches and modifies act on the vlan tag,
+        # not on the packet's virtual headers
+        if self.compiled_eval_failed or virtual_field.fields:
+            return None
+        if self.buckets_see_modified is None:
+            # walks the whole policy, so only once per policy change
+            self.buckets_see_modified = buckets_see_modified_packets(
+                self.policy)
+        if self.buckets_see_modified:
+            self.log.info("buckets see modified packets; evaluating packets "
+                          "on the policy until it changes")
+            self.compiled_eval_failed = True
+            return None
+        try:
+            classifier = self.policy.compile()
+        except (TypeError, NotImplementedError):
+            self.log.warn("policy can't be compiled; evaluating packets on "
+                          "the policy until it changes")
+            self.compiled_eval_failed = True
+            return None
+        return queries_in_classifier_eval(classifier, pyretic_pkt)
+
 
 #############
 # DYNAMICS  
@@ -199,7 +290,11 @@ class Runtime(object):
             # tag stale classifiers as invalid
             recompile_list = on_recompile_path_list(id(sub_pol),
                                                     self.policy)
+            for root in self.pipeline_roots():
+                recompile_list += on_recompile_path_list(id(sub_pol), root)
             map(lambda p: p.invalidate_classifier(), recompile_list)
+            self.compiled_eval_failed = False
+            self.buckets_see_modified = None
 
             # if change was driven by a network update, flag
             if self.in_network_update:
@@ -258,6 +353,18 @@ class Runtime(object):
         if self.mode == 'reactive0':
             self.clear_all() 
 
+        elif ((self.mode == 'proactive0' or self.mode == 'proactive1') and
+              not self.pipeline is None):
+            classifiers = [(table, policy.compile())
+                           for (table, policy) in self.pipeline]
+            for (table, classifier) in classifiers:
+                self.log.debug(
+                    '|%s|\n\t%s\n\t%s\n' % (str(datetime.now()),
+                                              "generate classifier, table %d"
+                                              % table,
+                                              "classifier=\n"+repr(classifier)))
+            self.install_classifier(classifiers)
+
         elif self.mode == 'proactive0' or self.mode == 'proactive1':
             classifier = self.policy.compile()
             self.log.debug(
@@ -267,6 +374,18 @@ class Runtime(object):
                                               "classifier=\n"+repr(classifier)))
             self.install_classifier(classifier)
 
+    def pipeline_roots(self):
+        """
+        The policies compiled or evaluated for the multi-table pipeline, other
+        than self.policy.
+
+        :rtype: list Policy
+        """
+        if self.pipeline is None:
+            return []
+        return ([policy for (_, policy) in self.pipeline] +
+                self.pipeline_suffixes.values())
+
 
     def update_dynamic_sub_pols(self):
         """
@@ -300,6 +419,22 @@ class Runtime(object):
         for p in new_but_not_old(old, new):
             p.set_network(self.network)
             p.attach(self.handle_policy_change)
+        self.update_polled_sub_pols()
+
+    def update_polled_sub_pols(self):
+        """
+        Runs the periodic queries in self.policy on this runtime's poll
+        scheduler, and stops those that left it.
+        """
+        old = self.polled_sub_pols
+        self.polled_sub_pols = ast_fold(add_polled_sub_pols, list(),
+                                        self.policy)
+        new_ids = set(map(id, self.polled_sub_pols))
+        for p in old:
+            if not id(p) in new_ids:
+                p.set_poll_scheduler(None)
+        for p in self.polled_sub_pols:
+            p.set_poll_scheduler(self.poller)
 
 
     def handle_path_change(self):
@@ -441,20 +576,28 @@ class Runtime(object):
 
     def install_defaults(self, s):
         """ Install backup rules on switch s by default. """
+        if self.pipeline is None:
+            first = {'switch' : s}
+            tables = [first]
+        else:
+            tables = [{'switch' : s, 'table' : table}
+                      for (table, _) in self.pipeline]
+            first = tables[0]
         # Fallback "send to controller" rule under table miss
-        self.install_rule(({'switch' : s},
-                           TABLE_MISS_PRIORITY,
-                           [{'outport' : OFPP_CONTROLLER}],
-                           self.default_cookie,
-                           False))
+        for table_match in tables:
+            self.install_rule((table_match,
+                               TABLE_MISS_PRIORITY,
+                               [{'outport' : OFPP_CONTROLLER}],
+                               self.default_cookie,
+                               False))
         # Send all LLDP packets to controller for topology maintenance
-        self.install_rule(({'switch' : s, 'ethtype': LLDP_TYPE},
+        self.install_rule((dict(first, ethtype=LLDP_TYPE),
                            TABLE_START_PRIORITY + 2,
                            [{'outport' : OFPP_CONTROLLER}],
                            self.default_cookie,
                            False))
         # Drop all IPv6 packets by default.
-        self.install_rule(({'switch':s, 'ethtype':IPV6_TYPE},
+        self.install_rule((dict(first, ethtype=IPV6_TYPE),
                            TABLE_START_PRIORITY + 1,
                            [],
                            self.default_cookie,
@@ -462,13 +605,19 @@ class Runtime(object):
 
     def install_classifier(self, classifier):
         """
-        Proactively installs switch table entries based on the input classifier
+        Proactively installs switch table entries based on the input
+        classifier, or on one classifier per table of the multi-table
+        pipeline.
 
-        :param classifier: the input classifer
-        :type classifier: Classifier
+        :param classifier: the input classifer, or (table, classifier) pairs
+        :type classifier: Classifier or list (int, Classifier)
         """
         if classifier is None:
             return
+        if isinstance(classifier, Classifier):
+            stages = [(None, classifier)]
+        else:
+            stages = classifier
 
         ### CLASSIFIER TRANSFORMS 
 
@@ -488,6 +637,23 @@ class Runtime(object):
                                    filter(lambda a: a != identity,rule.actions))
                               for rule in classifier.rules)
 
+        def keep_identity(classifier):
+            """
+            Replaces identity actions with empty modifies, so that they stay
+            in the action list. In the path in and path out tables an action
+            without an outport passes the packet on down the pipeline, and
+            only an empty action list drops it.
+
+            :param classifier: the input classifer
+            :type classifier: Classifier
+            :returns: the output classifier
+            :rtype: Classifier
+            """
+            return Classifier(Rule(rule.match,
+                                   [modify() if a == identity else a
+                                    for a in rule.actions])
+                              for rule in classifier.rules)
+
         def remove_path_buckets(classifier):
             """
             Removes "path buckets" from the action list. Also hooks up runtime
@@ -627,6 +793,7 @@ class Runtime(object):
                     if isinstance(act, CountBucket):
                         if op == "add":
                             act.add_match(match, priority, version)
+                            self.add_stats_index(match, priority, version, act)
                         elif op == "delete":
                             act.delete_match(match, priority, version)
                             self.add_global_outstanding_delete(rule_key, act)
@@ -634,6 +801,8 @@ class Runtime(object):
                             if act.is_new_bucket():
                                 act.add_match(match, priority, version,
                                               existing_rule=True)
+                                self.add_stats_index(match, priority, version,
+                                                     act)
 
                 # debug: check the existence of entries in outstanding_deletes
                 # for all buckets in actions list, if op is deleting the rule.
@@ -666,6 +835,9 @@ class Runtime(object):
                         self.pull_existing_stats_for_bucket(x)),
                     bucket_list.values())
                 map(lambda x: x.finish_update(), bucket_list.values())
+                # forget the rules this version replaces
+                self.prune_stats_index(to_add + to_modify + to_stay,
+                                       curr_version_no)
         
         def remove_buckets(diff_lists):
             """
@@ -844,23 +1016,32 @@ class Runtime(object):
 
         def prioritize(classifier):
             """
-            Add priorities to classifier rules based on their ordering.
+            Add priorities to classifier rules based on their ordering. Rules
+            already installed keep their priority where the ordering allows,
+            so that unchanged rules don't have to be reinstalled.
             
             :param classifier: the input classifer
             :type classifier: Classifier
             :returns: the output classifier
             :rtype: Classifier
             """
-            priority = {}
-            tuple_rules = list()
-            for rule in classifier.rules:
-                s = rule.match['switch']
-                try:
-                    priority[s] -= 1
-                except KeyError:
-                    priority[s] = TABLE_START_PRIORITY
-                tuple_rules.append((rule.match,priority[s],rule.actions))
-            return tuple_rules
+            with self.old_rules_lock:
+                old_priorities = installed_priorities(self.old_rules)
+            positions = {}
+            for (i, rule) in enumerate(classifier.rules):
+                table = (rule.match['switch'], rule.match.get('table'))
+                positions.setdefault(table, []).append(i)
+            priorities = [None] * len(classifier.rules)
+            for (s, _), switch_positions in positions.iteritems():
+                matches = [util.frozendict(classifier.rules[i].match)
+                           for i in switch_positions]
+                switch_priorities = assign_priorities(
+                    matches, old_priorities.get(s, {}),
+                    TABLE_MISS_PRIORITY + 1, TABLE_START_PRIORITY)
+                for (i, priority) in zip(switch_positions, switch_priorities):
+                    priorities[i] = priority
+            return [(rule.match, priority, rule.actions)
+                    for (rule, priority) in zip(classifier.rules, priorities)]
 
         ### UPDATE LOGIC
 
@@ -898,28 +1079,69 @@ class Runtime(object):
 
         ### INCREMENTAL UPDATE LOGIC
 
-        def find_same_rule(target, rule_list):
-            if rule_list is None:
-                return None
-            for rule in rule_list:
-                if target[0] == rule[0] and target[1] == rule[1]:
-                    return rule
-            return None
-
-        def get_new_rules(classifier, curr_classifier_no):
+        def get_new_rules(stages, curr_classifier_no):
             def add_version(rules, version):
                 new_rules = []
                 for r in rules:
                     new_rules.append(r + (version,))
                 return new_rules
 
+            def concrete_rules(rule, switches, table=None, goto=True):
+                """The OpenFlow rules produced by one classifier rule, in
+                priority order."""
+                c = Classifier([rule])
+                if not table in [None, FORWARDING_TABLE]:
+                    c = keep_identity(c)
+                c = remove_identity(c)
+                c = remove_path_buckets(c)
+                c = controllerify(c)
+                c = layer_3_specialize(c)
+                c = switchify(c,switches)
+                c = concretize(c)
+                # only the forwarding table has to choose an outport
+                if table in [None, FORWARDING_TABLE]:
+                    c = check_OF_rules(c)
+                    c = OF_inportize(c)
+                if table is None:
+                    return list(c.rules)
+                return [pipeline_rule(r, table, goto) for r in c.rules]
+
             switches = self.network.switch_list()
+            out_classifier = dict(stages).get(PATH_OUT_TABLE)
+
+            # Each stage up to prioritize acts on rules independently, so the
+            # concrete rules of a classifier rule are reused from the previous
+            # install when the same rule (by structure) appears again.
+            if switches != self.concrete_rules_switches:
+                self.concrete_rules_cache = {}
+                self.concrete_rules_switches = switches
+            cache = self.concrete_rules_cache
+            used = {}
+            rules = []
+            for (table, classifier) in stages:
+                for rule in classifier.rules:
+                    if (table == FORWARDING_TABLE and
+                        len(pipeline_outputs(rule)) > 1):
+                        # the rule's outputs can't all hand their outport on
+                        # to the path out table; it completes the pipeline
+                        # itself instead
+                        for r in pipeline_fanout(rule, out_classifier).rules:
+                            rules.extend(concrete_rules(r, switches, table,
+                                                        False))
+                        continue
+                    key = classifier_rule_key(rule)
+                    if key is None:
+                        rules.extend(concrete_rules(rule, switches, table))
+                        continue
+                    key = (table, key)
+                    try:
+                        crs = used[key] = cache[key]
+                    except KeyError:
+                        crs = used[key] = concrete_rules(rule, switches, table)
+                    rules.extend(crs)
+            self.concrete_rules_cache = used
 
-            classifier = switchify(classifier,switches)
-            classifier = concretize(classifier)
-            classifier = check_OF_rules(classifier)
-            classifier = OF_inportize(classifier)
-            new_rules = prioritize(classifier)
+            new_rules = prioritize(Classifier(rules))
             new_rules = add_version(new_rules, curr_classifier_no)
             return new_rules
 
@@ -928,69 +1150,18 @@ class Runtime(object):
             are removed and the full new classifier is installed afresh.
             """
             with self.old_rules_lock:
-                import copy
-                to_delete = copy.copy(self.old_rules)
+                to_delete = self.old_rules.values()
                 to_add = new_rules
                 to_modify = list()
                 to_stay = list()
-                self.old_rules = new_rules
+                self.old_rules = index_rules(new_rules)
             return (to_add, to_delete, to_modify, to_stay)
 
         def get_incremental_diff(new_rules):
             """Compute diff lists, i.e., (+), (-) and (0) rules from the earlier
             (versioned) classifier."""
-            def different_actions(old_acts, new_acts):
-                def buckets_removed(acts):
-                    return filter(lambda a: not isinstance(a, CountBucket),
-                                  acts)
-                return buckets_removed(old_acts) != buckets_removed(new_acts)
-
             with self.old_rules_lock:
-                # calculate diff
-                old_rules = self.old_rules
-                to_add = list()
-                to_delete = list()
-                to_modify = list()
-                to_modify_old = list() # old counterparts of modified rules
-                to_stay = list()
-                for old in old_rules:
-                    new = find_same_rule(old, new_rules)
-                    if new is None:
-                        to_delete.append(old)
-                    else:
-                        (new_match,new_priority,new_actions,_) = new
-                        (_,_,old_actions,old_version) = old
-                        if different_actions(old_actions, new_actions):
-                            modified_rule = (new_match, new_priority,
-                                             new_actions, old_version)
-                            to_modify.append(modified_rule)
-                            to_modify_old.append(old)
-                            # We also add the new and old rules to the to_add
-                            # and to_delete lists (resp.) to keep track of the
-                            # changes to be made to old_rules. These are later
-                            # removed from to_add and to_delete when returning.
-                            to_add.append(modified_rule)
-                            to_delete.append(old)
-                        else:
-                            to_stay.append(old)
-
-                for new in new_rules:
-                    old = find_same_rule(new, old_rules)
-                    if old is None:
-                        to_add.append(new)
-
-                # update old_rules to reflect changes in the classifier
-                for rule in to_delete:
-                    self.old_rules.remove(rule)
-                for rule in to_add:
-                    self.old_rules.append(rule)
-                # see note above where to_modify* lists are populated.
-                for rule in to_modify:
-                    to_add.remove(rule)
-                for rule in to_modify_old:
-                    to_delete.remove(rule)
-
-            return (to_add, to_delete, to_modify, to_stay)
+                return incremental_diff(self.old_rules, new_rules)
 
         def get_diff_lists(new_rules):
             assert self.mode in ['proactive0', 'proactive1']
@@ -999,70 +1170,16 @@ class Runtime(object):
             elif self.mode == 'proactive1':
                 return get_incremental_diff(new_rules)
 
-        def install_diff_lists(diff_lists, classifier_version_no):
-            """Install the difference between the input classifier and the
-            current switch tables. The function takes the set of rules (added,
-            deleted, modified, untouched), and does necessary flow
-            installs/deletes/modifies.
-            
-            :param diff_lists: list of rules to add, delete, modify, stay.
-            :type diff_lists: 4 tuple of rule lists
-            :param classifier_version_no: version of the classifier after
-            controller bootup
-            :type classifier_version_no: int
-            """
-            (to_add, to_delete, to_modify, to_stay) = diff_lists
-            switches = self.network.switch_list()
-
-            # If the controller just came up, clear out the switches.
-            if classifier_version_no == 1 or self.mode == 'proactive0':
-                for s in switches:
-                    self.send_barrier(s)
-                    self.send_clear(s)
-                    self.send_barrier(s)
-                    self.install_defaults(s)
-
-            # There's no need to delete rules if nuclear install:
-            if self.mode == 'proactive0':
-                to_delete = list()
-                to_modify = list()
-                to_stay   = list()
-
-            if to_delete:
-                for rule in to_delete:
-                    (match_dict,priority,_,_) = rule
-                    if match_dict['switch'] in switches:
-                        self.delete_rule((match_dict, priority))
-            if to_add:
-                for rule in to_add:
-                    self.install_rule(rule)
-            if to_modify:
-                for rule in to_modify:
-                    self.modify_rule(rule)
-            for s in switches:
-                self.send_barrier(s)
-            self.log.debug('\n-----\n\n\ninstalled new set of rules\n\n\n----')
-
-
-        ### PROCESS THAT DOES INSTALL
-
-        def f(diff_lists,curr_version_no):
-            self.send_reset_install_time()
-            with self.switch_lock:
-                install_diff_lists(diff_lists,curr_version_no)
-
         curr_version_no = None
         with self.classifier_version_lock:
             self.classifier_version_no += 1
             curr_version_no = self.classifier_version_no
 
         # Process classifier to an openflow-compatible format before
-        # sending out rule installs
+        # sending out rule installs. remove_identity, remove_path_buckets,
+        # controllerify and layer_3_specialize are applied rule by rule in
+        # get_new_rules.
         #classifier = send_drops_to_controller(classifier)
-        classifier = remove_identity(classifier)
-        classifier = remove_path_buckets(classifier)
-        classifier = controllerify(classifier)
-        classifier = layer_3_specialize(classifier)
 
         # TODO(ngsrinivas): As of OVS 1.9, vlan_specialize seems unnecessary to
         # keep track of rules that match packets without a VLAN, to the best of
@@ -1076,7 +1193,7 @@ class Runtime(object):
         # bookkeeping and removing of bucket actions happens at the end of the
         # whole pipeline, because buckets need very precise mappings to the
         # rules installed by the runtime.
-        new_rules = get_new_rules(classifier, curr_version_no)
+        new_rules = get_new_rules(stages, curr_version_no)
         self.log.debug("Number of rules in classifier: %d" % len(new_rules))
         diff_lists = get_diff_lists(new_rules)
         bookkeep_buckets(diff_lists)
@@ -1088,9 +1205,60 @@ class Runtime(object):
             self.log.debug(str(rule))
         self.log.debug('================================')
 
-        p = Process(target=f, args=(diff_lists,curr_version_no))
-        p.daemon = True
-        p.start()
+        # If the controller just came up, or on a nuclear install, the
+        # switches are cleared out before the new rules go in.
+        clear = curr_version_no == 1 or self.mode == 'proactive0'
+        self.installer.submit(curr_version_no, diff_lists, clear)
+
+    def install_diff_lists(self, diff_lists, version, clear):
+        """Install the difference between the input classifier and the
+        current switch tables. The function takes the set of rules (added,
+        deleted, modified, untouched), and does necessary flow
+        installs/deletes/modifies. Called from the installer worker.
+
+        :param diff_lists: list of rules to add, delete, modify, stay.
+        :type diff_lists: 4 tuple of rule lists
+        :param version: version of the (newest) classifier installed
+        :type version: int
+        :param clear: whether to clear out the switches first
+        :type clear: bool
+        """
+        self.send_reset_install_time()
+        with self.switch_lock:
+            (to_add, to_delete, to_modify, to_stay) = diff_lists
+            switches = self.network.switch_list()
+
+            if clear:
+                for s in switches:
+                    self.send_barrier(s)
+                    self.send_clear(s)
+                    self.send_barrier(s)
+                    self.install_defaults(s)
+
+            # There's no need to delete rules if nuclear install:
+            if self.mode == 'proactive0':
+                to_delete = list()
+                to_modify = list()
+                to_stay   = list()
+
+            # Group the updates by switch, so that each switch gets a single
+            # batch message (and a single barrier) per classifier version.
+            batches = {}
+            def batch(switch):
+                if not switch in batches:
+                    batches[switch] = ([], [], [])
+                return batches[switch]
+            for rule in to_delete:
+                (match_dict,priority) = rule[:2]
+                if match_dict['switch'] in switches:
+                    batch(match_dict['switch'])[0].append((match_dict,priority))
+            for rule in to_add:
+                batch(rule[0]['switch'])[1].append(rule)
+            for rule in to_modify:
+                batch(rule[0]['switch'])[2].append(rule)
+            for (s, (deletes, installs, modifies)) in batches.items():
+                self.install_rule_batch(s, deletes, installs, modifies)
+            self.log.debug('\n-----\n\n\ninstalled new set of rules\n\n\n----')
 
 ###################
 # QUERYING SUPPORT
@@ -1140,7 +1308,7 @@ class Runtime(object):
                     need_to_query = ((time.time() - self.last_queried_time[s])
                                        > STATS_REQUERY_THRESHOLD_SEC)
             if need_to_query:
-                self.request_flow_stats(s)
+                self.poller.request_stats(s)
                 self.add_last_queried_time(s)
                 self.log.debug('in pull_stats: sent out stats query to switch '
                                + str(s))
@@ -1194,27 +1362,72 @@ class Runtime(object):
         with self.last_queried_time_lock:
             self.last_queried_time[s] = time.time()
 
+    def add_stats_index(self, match, priority, version, bucket):
+        """Record that the counters of a rule, as reported in flow stats
+        replies, are of interest to bucket."""
+        key = stats_index_key(match, priority, version)
+        with self.stats_index_lock:
+            buckets = self.stats_index.setdefault(key, [])
+            if not bucket in buckets:
+                buckets.append(bucket)
+
+    def remove_stats_index(self, match, priority, version):
+        with self.stats_index_lock:
+            self.stats_index.pop(stats_index_key(match, priority, version),
+                                 None)
+
+    def prune_stats_index(self, rules, version):
+        """Drop the stats index entries of rules from versions before version
+        that are not among rules, the full set of rules now installed.
+
+        :param rules: the installed rules, as (match, priority, actions,
+            version) tuples
+        :type rules: list
+        :param version: the classifier version being installed
+        :type version: int
+        """
+        live = set(stats_index_key(r[0], r[1], None)[:2] for r in rules)
+        with self.stats_index_lock:
+            for key in self.stats_index.keys():
+                (m, priority, v) = key
+                if v < version and not (m, priority) in live:
+                    del self.stats_index[key]
+
+    def remove_switch_stats_index(self, switch):
+        """Drop the stats index entries of the rules on switch."""
+        with self.stats_index_lock:
+            for key in self.stats_index.keys():
+                if key[0].get('switch') == switch:
+                    del self.stats_index[key]
+
+    def clear_stats_index(self):
+        with self.stats_index_lock:
+            self.stats_index = {}
+
 ####################################
 # PACKET MARSHALLING/UNMARSHALLING 
 ####################################
 
     def concrete2pyretic(self,raw_pkt):
         packet = get_packet_processor().unpack(raw_pkt['raw'])
+
+        # convert addresses and drop unset headers in place, then hand the
+        # dict straight to the packet rather than copying it through
+        # modifymany
+        for h in packet.keys():
+            val = packet[h]
+            if val is None:
+                del packet[h]
+            elif h in ADDRESS_CONVERSIONS:
+                packet[h] = ADDRESS_CONVERSIONS[h](val)
         packet['raw'] = raw_pkt['raw']
         packet['switch'] = raw_pkt['switch']
         packet['inport'] = raw_pkt['inport']
-
-        def convert(h,val):
-            if h in ['srcmac','dstmac']:
-                return MAC(val)
-            elif h in ['srcip','dstip']:
-                return IP(val)
-            else:
-                return val
-
-        pyretic_packet = Packet(util.frozendict())
-        d = { h : convert(h,v) for (h,v) in packet.items() }
-        return pyretic_packet.modifymany(d)
+        # sent up from the path out table, with the outport chosen by the
+        # forwarding table
+        if 'outport' in raw_pkt:
+            packet['outport'] = raw_pkt['outport']
+        return Packet.from_headers(packet)
 
     def pyretic2concrete(self,packet):
         concrete_packet = {}
@@ -1241,6 +1454,8 @@ class Runtime(object):
                 pass
 
         concrete_packet = dict(concrete_packet.items() + virtual_field.expand(headers).items())
+        # pack passes raw through untouched if no header field changed (e.g.,
+        # only outport was set), and otherwise patches just the changed bytes
         concrete_packet['raw'] = get_packet_processor().pack(headers)
         return concrete_packet
 
@@ -1268,6 +1483,13 @@ class Runtime(object):
     def delete_rule(self,(concrete_pred,priority)):
         self.backend.send_delete(concrete_pred,priority)
 
+    def install_rule_batch(self,switch,to_delete,to_install,to_modify):
+        self.log.debug(
+            '|%s|\n\t%s %s: -%d +%d ~%d\n' % (str(datetime.now()),
+                "sending openflow rule batch to switch", switch,
+                len(to_delete), len(to_install), len(to_modify)))
+        self.backend.send_install_batch(switch,to_delete,to_install,to_modify)
+
     def send_barrier(self,switch):
         self.backend.send_barrier(switch)
 
@@ -1275,16 +1497,14 @@ class Runtime(object):
         self.backend.send_clear(switch)
 
     def clear_all(self):
-        def f():
-            switches = self.network.switch_list()
-            for s in switches:
-                self.send_barrier(s)
-                self.send_clear(s)
-                self.send_barrier(s)
-                self.install_defaults(s)
-        p = Process(target=f)
-        p.daemon = True
-        p.start()
+        """Clear the switches. Installs go through the installer thread, so
+        this waits for the clear to be done: callers such as reactive0 send
+        rules to the switches directly afterwards."""
+        with self.classifier_version_lock:
+            version = self.classifier_version_no
+        self.installer.submit(version, ([], [], [], []), True)
+        self.installer.wait_idle()
+        self.clear_stats_index()
 
     def request_flow_stats(self,switch):
         self.backend.send_flow_stats_request(switch)
@@ -1301,6 +1521,7 @@ class Runtime(object):
         self.network.handle_switch_join(switch_id)
 
     def handle_switch_part(self,switch_id):
+        self.remove_switch_stats_index(switch_id)
         self.network.handle_switch_part(switch_id)
 
     def handle_port_join(self,switch_id,port_id,conf_up,stat_up,port_type):
@@ -1326,10 +1547,8 @@ class Runtime(object):
             vals = ast.literal_eval(val)
             return [ { g : self.ofp_convert(g,v) for g,v in val.items() }
                      for val in vals ]
-        if f in ['srcmac','dstmac']:
-            return MAC(val)
-        elif f in ['srcip','dstip']:
-            return IP(val)
+        if f in ADDRESS_CONVERSIONS:
+            return ADDRESS_CONVERSIONS[f](val)
         else:
             return val
 
@@ -1345,6 +1564,7 @@ class Runtime(object):
 
     def handle_flow_stats_reply(self, switch, flow_stats):
         self.log.info('received a flow stats reply from switch ' + str(switch))
+        self.poller.stats_received(switch)
         flow_stats = [ { f : self.ofp_convert(f,v)
                          for (f,v) in flow_stat.items() }
                        for flow_stat in flow_stats       ]
@@ -1369,8 +1589,21 @@ class Runtime(object):
                 del self.global_outstanding_queries[switch]
             self.log.debug('in stats_reply: outstanding switches is now:' +
                            str(self.global_outstanding_queries) )
+        # hand each bucket just the flow stats of its rules, demultiplexing
+        # the reply in a single pass
+        bucket_stats = { id(bucket) : [] for bucket in buckets_list }
+        with self.stats_index_lock:
+            for f in flow_stats:
+                if not 'match' in f:
+                    continue
+                m = dict(f['match'])
+                m['switch'] = switch
+                key = stats_index_key(m, f['priority'], f['cookie'])
+                for bucket in self.stats_index.get(key, []):
+                    if id(bucket) in bucket_stats:
+                        bucket_stats[id(bucket)].append(f)
         for bucket in buckets_list:
-            bucket.handle_flow_stats_reply(switch, flow_stats)
+            bucket.handle_flow_stats_reply(switch, bucket_stats[id(bucket)])
 
     def handle_flow_removed(self, dpid, flow_stat_dict):
         def str_convert_match(m):
@@ -1416,6 +1649,7 @@ class Runtime(object):
                                   id(bucket))
                     bucket.handle_flow_removed(rule_match, priority, version, f)
                 del self.global_outstanding_deletes[match_entry]
+                self.remove_stats_index(rule_match, priority, version)
 
 ################################################################################
 # Topology Transfer and Full Policy Functions
@@ -1473,6 +1707,288 @@ class Runtime(object):
             assert extended_values is not None, "use of vlan that pyretic didn't allocate! not allowed."
             return extended_values
 
+################################################################################
+# Installed Rule Bookkeeping
+################################################################################
+
+def rule_key(rule):
+    """
+    Key identifying an installed rule across classifier versions. Two rules
+    are the same switch table entry iff they agree on switch, match and
+    priority; actions and version (cookie) may differ.
+
+    :param rule: a rule tuple (match, priority, actions, version, ...)
+    :type rule: tuple
+    :rtype: (int, frozendict, int)
+    """
+    match_dict = rule[0]
+    return (match_dict['switch'], util.frozendict(match_dict), rule[1])
+
+def index_rules(rules):
+    """
+    Index a list of rule tuples by rule_key.
+
+    :param rules: rule tuples
+    :type rules: list tuple
+    :rtype: dict from rule_key to rule tuple
+    """
+    return dict((rule_key(r), r) for r in rules)
+
+def incremental_diff(old_rules, new_rules):
+    """
+    Compute the (+), (-), modify and (0) diff lists between the installed
+    rules and a new versioned list of rules, in time linear in the number of
+    rules. The installed rule index is updated in place to reflect the new
+    classifier.
+
+    :param old_rules: installed rules, as produced by index_rules
+    :type old_rules: dict
+    :param new_rules: rule tuples (match, priority, actions, version)
+    :type new_rules: list tuple
+    :returns: (to_add, to_delete, to_modify, to_stay)
+    :rtype: 4 tuple of rule lists
+    """
+    def buckets_removed(acts):
+        return filter(lambda a: not isinstance(a, CountBucket), acts)
+
+    new_keys = map(rule_key, new_rules)
+    new_index = dict(zip(new_keys, new_rules))
+    to_add = list()
+    to_delete = list()
+    to_modify = list()
+    to_stay = list()
+    for key, old in old_rules.items():
+        new = new_index.get(key)
+        if new is None:
+            to_delete.append(old)
+            del old_rules[key]
+        else:
+            (new_match,new_priority,new_actions,_) = new
+            (_,_,old_actions,old_version) = old
+            if buckets_removed(old_actions) != buckets_removed(new_actions):
+                # a modified rule keeps the version of the rule it replaces
+                modified_rule = (new_match, new_priority,
+                                 new_actions, old_version)
+                to_modify.append(modified_rule)
+                old_rules[key] = modified_rule
+            else:
+                to_stay.append(old)
+    for key, new in zip(new_keys, new_rules):
+        if not key in old_rules:
+            to_add.append(new)
+            old_rules[key] = new
+    return (to_add, to_delete, to_modify, to_stay)
+
+def installed_priorities(installed):
+    """
+    Priorities of the installed rules, by switch and match.
+
+    :param installed: installed rules, as produced by index_rules
+    :type installed: dict
+    :returns: switch -> match -> priorities, highest first
+    :rtype: dict
+    """
+    priorities = {}
+    for (switch, match_dict, priority) in installed:
+        by_match = priorities.setdefault(switch, {})
+        by_match.setdefault(match_dict, []).append(priority)
+    for by_match in priorities.itervalues():
+        for prios in by_match.itervalues():
+            prios.sort(reverse=True)
+    return priorities
+
+def assign_priorities(matches, old_priorities, lowest, highest):
+    """
+    Assign strictly decreasing priorities to a switch's rules, keeping the
+    installed priority of as many rules as the new ordering allows (a
+    longest decreasing subsequence of the old priorities). The other rules
+    are placed in the gaps between kept ones; if some gap is too small, all
+    the rules are spread afresh over [lowest, highest].
+
+    :param matches: the switch's rule matches, highest priority first
+    :type matches: list frozendict
+    :param old_priorities: match -> installed priorities, highest first
+    :type old_priorities: dict
+    :param lowest: lowest usable priority
+    :type lowest: int
+    :param highest: highest usable priority
+    :type highest: int
+    :rtype: list int
+    """
+    def spread(n, lo, hi):
+        """n decreasing priorities strictly between lo and hi."""
+        step = max(1, (hi - lo) / (n + 1))
+        return [hi - step * (i + 1) for i in range(n)]
+
+    n = len(matches)
+    if n > highest - lowest + 1:
+        raise RuntimeError('Too many rules for the priority range')
+    # candidate old priority for each rule (duplicate matches take them in
+    # order)
+    used = {}
+    old = []
+    for m in matches:
+        prios = old_priorities.get(m, [])
+        k = used.get(m, 0)
+        used[m] = k + 1
+        old.append(prios[k] if k < len(prios) else None)
+
+    # longest strictly decreasing subsequence of the old priorities
+    tails = []          # -priority of the last element of the best runs
+    tail_pos = []
+    back = [None] * n
+    for (i, p) in enumerate(old):
+        if p is None:
+            continue
+        j = bisect.bisect_left(tails, -p)
+        back[i] = tail_pos[j - 1] if j > 0 else None
+        if j == len(tails):
+            tails.append(-p)
+            tail_pos.append(i)
+        else:
+            tails[j] = -p
+            tail_pos[j] = i
+    priorities = [None] * n
+    i = tail_pos[-1] if tail_pos else None
+    while i is not None:
+        priorities[i] = old[i]
+        i = back[i]
+
+    # fill the runs of rules between kept ones
+    i = 0
+    while i < n:
+        if priorities[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j < n and priorities[j] is None:
+            j += 1
+        above = priorities[i - 1] if i > 0 else None
+        below = priorities[j] if j < n else None
+        hi = above if above is not None else highest + 1
+        lo = below if below is not None else lowest - 1
+        k = j - i
+        if hi - lo - 1 < k:
+            return spread(n, lowest - 1, highest + 1)
+        if above is None and below is not None:
+            run = range(lo + k, lo, -1)     # room left above for new rules
+        elif above is not None and below is None:
+            run = range(hi - 1, hi - 1 - k, -1)
+        else:
+            run = spread(k, lo, hi)
+        priorities[i:j] = run
+        i = j
+    return priorities
+
+def classifier_rule_key(rule):
+    """
+    Structural key of a classifier rule, equal for rules with equal matches
+    and actions, or None if some action has no structural key.
+
+    :param rule: a classifier rule
+    :type rule: Rule
+    """
+    try:
+        return (rule.match.structural_key(),
+                frozenset(a.structural_key() for a in rule.actions))
+    except AttributeError:
+        return None
+
+def pipeline_outputs(rule):
+    """
+    The actions of a forwarding table rule that send packets on towards the
+    path out table, i.e., its modifies, unless the rule sends packets to the
+    controller.
+
+    :param rule: a classifier rule of the forwarding table
+    :type rule: Rule
+    :rtype: list modify
+    """
+    if any(a == Controller for a in rule.actions):
+        return []
+    return [a for a in rule.actions if isinstance(a, modify)]
+
+def pipeline_fanout(rule, out_classifier):
+    """
+    Compose a forwarding table rule with the path out table, one output at a
+    time, into rules that complete the pipeline in the forwarding table. This
+    is for rules sending packets out several ports, which can't hand a single
+    outport on to the path out table.
+
+    :param rule: a classifier rule of the forwarding table
+    :type rule: Rule
+    :param out_classifier: the classifier of the path out table
+    :type out_classifier: Classifier
+    :rtype: Classifier
+    """
+    buckets = set(a for a in rule.actions if isinstance(a, CountBucket))
+    fanout = None
+    for a in pipeline_outputs(rule):
+        c = Classifier([Rule(rule.match, [a])]) >> out_classifier
+        if fanout is None:
+            fanout = c
+        else:
+            fanout = fanout + c
+    return Classifier(Rule(r.match, set(r.actions) | buckets)
+                      for r in fanout.rules)
+
+def pipeline_rule(rule, table, goto=True):
+    """
+    Place a concrete rule in a table of the multi-table pipeline. A rule of
+    the path in table passes the packet it tags on to the forwarding table,
+    and a forwarding table rule with a single output on to the path out
+    table, which matches on the outport chosen and leaves that output in
+    place. The match gets a 'table' field and the actions passing packets on
+    a 'goto_table' field.
+
+    :param rule: a concrete rule (match and action dicts)
+    :type rule: Rule
+    :param table: one of PATH_IN_TABLE, FORWARDING_TABLE, PATH_OUT_TABLE
+    :type table: int
+    :param goto: whether a forwarding table rule may pass packets on
+    :type goto: bool
+    :rtype: Rule
+    """
+    def goto_table(actions, action, next_table):
+        return [dict(a, goto_table=next_table) if a is action else a
+                for a in actions]
+
+    match_dict = dict(rule.match, table=table)
+    actions = rule.actions
+    forwarded = [a for a in actions if not isinstance(a, CountBucket)]
+    if table == FORWARDING_TABLE:
+        if (goto and len(forwarded) == 1 and
+            forwarded[0]['outport'] != OFPP_CONTROLLER):
+            actions = goto_table(actions, forwarded[0], PATH_OUT_TABLE)
+    else:
+        passed = [a for a in forwarded if not 'outport' in a]
+        if len(passed) > 1:
+            # one packet can't carry several tags down the pipeline
+            actions = [{'outport' : OFPP_CONTROLLER}]
+        elif passed and table == PATH_IN_TABLE:
+            actions = goto_table(actions, passed[0], FORWARDING_TABLE)
+    return Rule(match_dict, actions)
+
+def stats_index_key(match, priority, version):
+    """
+    Key of a rule in Runtime.stats_index, equal for the match of an
+    installed concrete rule and that of the rule's flow stats (whose srcip
+    and dstip are IP objects rather than strings).
+
+    :param match: the rule's match, including its switch
+    :type match: dict
+    :param priority: the rule's priority
+    :type priority: int
+    :param version: the rule's classifier version (its cookie)
+    :type version: int
+    :rtype: tuple
+    """
+    m = dict(match)
+    for field in ['srcip', 'dstip']:
+        if field in m:
+            m[field] = str(m[field])
+    return (util.frozendict.adopt(m), priority, version)
+
 @util.cached
 def extended_values_from(packet):
     extended_values = {}
@@ -1484,10 +2000,376 @@ def extended_values_from(packet):
 
 
 ################################################################################
-# Concrete Network
+# Rule Installer
 ################################################################################
 
-import threading 
+def merge_diff_lists(diff_lists_seq):
+    """
+    Merge successive diff lists, each computed against the rules left by the
+    one before, into a single diff list with the same net effect on the
+    switches. A rule deleted and then added again (e.g., with a new version)
+    ends up in both the delete and the add list; deletes are applied first.
+
+    Rules that ask for flow removed notifications (which count buckets wait
+    for when the rule is deleted) can't be added and deleted again without
+    ever reaching the switches, so such diff lists are not merged.
+
+    :param diff_lists_seq: (to_add, to_delete, to_modify, to_stay) tuples, in
+        the order they were computed
+    :type diff_lists_seq: list tuple
+    :returns: (to_add, to_delete, to_modify, to_stay), to_stay always empty,
+        or None if the diff lists can't be merged
+    :rtype: 4 tuple of rule lists
+    """
+    def notify(rule):
+        return len(rule) > 4 and rule[4]
+
+    if len(diff_lists_seq) == 1:
+        return diff_lists_seq[0]
+    # rule_key -> [initially installed, rule initially installed,
+    #              installed at the end (or None), initial rule deleted,
+    #              notifying rule added]
+    net = {}
+    order = []
+    def entry(rule, installed):
+        key = rule_key(rule)
+        e = net.get(key)
+        if e is None:
+            e = net[key] = [installed, rule, rule if installed else None,
+                            False, False]
+            order.append(key)
+        return e
+    for (to_add, to_delete, to_modify, _) in diff_lists_seq:
+        for rule in to_delete:
+            e = entry(rule, True)
+            if e[4]:
+                return None
+            if e[0]:
+                e[3] = True
+            e[2] = None
+        for rule in to_add:
+            e = entry(rule, False)
+            if e[0]:
+                e[3] = True
+            e[2] = rule
+            e[4] = notify(rule)
+        for rule in to_modify:
+            entry(rule, True)[2] = rule
+    to_add = list()
+    to_delete = list()
+    to_modify = list()
+    for key in order:
+        (installed, initial, final, deleted, _) = net[key]
+        if installed and deleted:
+            to_delete.append(initial)
+        if final is None:
+            continue
+        if installed and not deleted:
+            to_modify.append(final)
+        else:
+            to_add.append(final)
+    return (to_add, to_delete, to_modify, list())
+
+
+class RuleInstaller(object):
+    """
+    A long-lived worker thread that installs diff lists on the switches in
+    classifier version order. Diff lists submitted while an install is in
+    progress are coalesced, so only the net change up to the newest pending
+    classifier version is sent. A diff list that clears the switches is a
+    barrier: it is only merged with the diff lists queued after it.
+
+    :param install: called as install(diff_lists, version, clear)
+    :type install: function
+    :param max_pending: the queue length at which pending diff lists are
+        merged eagerly; if they can't be, submit blocks until the queue
+        drains below it
+    :type max_pending: int
+    """
+    def __init__(self, install, max_pending=64):
+        self.install = install
+        self.max_pending = max_pending
+        self.log = logging.getLogger('%s.RuleInstaller' % __name__)
+        self.cond = threading.Condition()
+        self.pending = []
+        self.seq = 0
+        self.busy = False
+        self.thread = None
+        self.submitted = 0
+        self.installs = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    def submit(self, version, diff_lists, clear=False):
+        """
+        Queue diff lists computed for a classifier version.
+
+        :param version: the classifier version
+        :type version: int
+        :param diff_lists: (to_add, to_delete, to_modify, to_stay)
+        :type diff_lists: 4 tuple of rule lists
+        :param clear: whether the switches are cleared before installing
+        :type clear: bool
+        """
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                self.pending = self.coalesce(self.pending)
+            while len(self.pending) >= self.max_pending:
+                # can't be merged (e.g., rules waiting for flow removed
+                # notifications); wait for the worker to catch up
+                self.cond.wait()
+            bisect.insort(self.pending,
+                          (version, self.seq, time.time(), diff_lists, clear))
+            self.seq += 1
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self.pending))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify_all()
+
+    def coalesce(self, entries):
+        """Merge version-ordered queue entries into one entry per run of
+        entries starting at a clear (or at the head of the queue), where
+        possible.
+
+        :rtype: list tuple
+        """
+        runs = []
+        for e in entries:
+            if e[4] or not runs:
+                runs.append([])
+            runs[-1].append(e)
+        merged = []
+        for run in runs:
+            diff_lists = None
+            if len(run) > 1:
+                diff_lists = merge_diff_lists([e[3] for e in run])
+            if diff_lists is None:
+                merged.extend(run)
+                continue
+            self.coalesced += len(run) - 1
+            (version, seq, _, _, _) = run[-1]
+            submitted = min(e[2] for e in run)
+            merged.append((version, seq, submitted, diff_lists, run[0][4]))
+        return merged
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.busy = False
+                    self.cond.notify_all()
+                    self.cond.wait()
+                entries = self.coalesce(self.pending)
+                self.pending = []
+                self.busy = True
+                # make room for submitters waiting on a full queue
+                self.cond.notify_all()
+            for (version, _, submitted, diff_lists, clear) in entries:
+                try:
+                    self.install(diff_lists, version, clear)
+                except Exception:
+                    self.log.exception(
+                        "failed to install classifier version %s" % version)
+                latency = time.time() - submitted
+                with self.cond:
+                    self.installs += 1
+                    self.last_latency = latency
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until every submitted diff list has been installed.
+
+        :param timeout: seconds to wait at most
+        :type timeout: float
+        :returns: whether the installer is idle
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.pending or self.busy:
+                if deadline is None:
+                    self.cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+            return True
+
+    def stats(self):
+        """
+        Counters for monitoring the installer. Latencies (in seconds) run from
+        the submission of the oldest diff list in an install to its end.
+
+        :rtype: dict
+        """
+        with self.cond:
+            return {'submitted' : self.submitted,
+                    'installs' : self.installs,
+                    'coalesced' : self.coalesced,
+                    'queue_depth' : len(self.pending),
+                    'max_queue_depth' : self.max_depth,
+                    'last_latency' : self.last_latency,
+                    'mean_latency' : (self.total_latency / self.installs
+                                      if self.installs else 0.0),
+                    'max_latency' : self.max_latency}
+
+
+class PollScheduler(object):
+    """
+    Runs the periodic statistics queries of a runtime's policy (e.g., counts
+    with an interval) from a single thread. Each runtime has its own. Queries
+    registered with the same interval share ticks, which fall on multiples of
+    the interval so that queries with commensurate intervals fire together.
+    Each tick is delayed by a random jitter of up to `jitter` times its
+    interval, so that controllers and queries do not poll in lockstep. Flow
+    stats requests issued while a tick runs are sent once per switch at its
+    end, and the time until each switch replies is recorded.
+
+    :param jitter: the maximum delay of a tick, as a fraction of its interval
+    :type jitter: float
+    """
+    def __init__(self, jitter=POLL_JITTER):
+        self.jitter = jitter
+        self.runtime = None
+        self.log = logging.getLogger('%s.PollScheduler' % __name__)
+        self.cond = threading.Condition()
+        self.jobs = {}        # interval -> [function]
+        self.next_tick = {}   # interval -> time of the next tick
+        self.thread = None
+        self.batch = None     # switches to query at the end of a tick
+        self.batch_thread = None
+        self.requested = {}   # switch -> time of the outstanding request
+        self.latency = {}     # switch -> poll latency counters
+
+    def attach(self, runtime):
+        """Send the flow stats requests through runtime."""
+        self.runtime = runtime
+
+    def tick_after(self, interval, now):
+        return ((int(now / interval) + 1) * interval +
+                random.uniform(0, self.jitter * interval))
+
+    def register(self, interval, fun):
+        """
+        Call fun every interval seconds.
+
+        :param interval: the time between calls, in seconds
+        :type interval: float
+        :param fun: the function to call, without arguments
+        :type fun: function
+        """
+        with self.cond:
+            if not interval in self.jobs:
+                self.jobs[interval] = []
+                self.next_tick[interval] = self.tick_after(interval,
+                                                           time.time())
+            self.jobs[interval].append(fun)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify_all()
+
+    def unregister(self, interval, fun):
+        with self.cond:
+            jobs = self.jobs.get(interval, [])
+            if fun in jobs:
+                jobs.remove(fun)
+            if not jobs:
+                self.jobs.pop(interval, None)
+                self.next_tick.pop(interval, None)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.next_tick:
+                    self.cond.wait()
+                now = time.time()
+                due = min(self.next_tick.values())
+                if due > now:
+                    self.cond.wait(due - now)
+                    continue
+                jobs = []
+                for (interval, tick) in self.next_tick.items():
+                    if tick <= now:
+                        jobs.extend(self.jobs[interval])
+                        self.next_tick[interval] = self.tick_after(interval,
+                                                                   now)
+            self.fire(jobs)
+
+    def fire(self, jobs):
+        """Run the jobs of a tick, then send their flow stats requests."""
+        with self.cond:
+            self.batch = set()
+            self.batch_thread = threading.current_thread()
+        for fun in jobs:
+            try:
+                fun()
+            except Exception:
+                self.log.exception("periodic query failed")
+        with self.cond:
+            (switches, self.batch) = (self.batch, None)
+        for s in switches:
+            self.send(s)
+
+    def request_stats(self, switch):
+        """Request flow stats from switch, deferring the request to the end
+        of the current tick if called from one."""
+        with self.cond:
+            if (self.batch is not None and
+                threading.current_thread() is self.batch_thread):
+                self.batch.add(switch)
+                return
+        self.send(switch)
+
+    def send(self, switch):
+        with self.cond:
+            self.requested.setdefault(switch, time.time())
+        if self.runtime is not None:
+            self.runtime.request_flow_stats(switch)
+
+    def stats_received(self, switch):
+        """Record the latency of the outstanding request to switch."""
+        with self.cond:
+            sent = self.requested.pop(switch, None)
+            if sent is None:
+                return
+            latency = time.time() - sent
+            counters = self.latency.setdefault(switch, {'polls' : 0,
+                                                        'total' : 0.0,
+                                                        'max' : 0.0})
+            counters['polls'] += 1
+            counters['total'] += latency
+            counters['max'] = max(counters['max'], latency)
+            counters['last'] = latency
+
+    def poll_latency(self):
+        """
+        Flow stats poll latencies (in seconds) per switch, from the first
+        request to the reply.
+
+        :rtype: dict from switch to dict
+        """
+        with self.cond:
+            return { s : {'polls' : c['polls'],
+                          'last_latency' : c['last'],
+                          'mean_latency' : c['total'] / c['polls'],
+                          'max_latency' : c['max']}
+                     for (s, c) in self.latency.items() }
+
+
+################################################################################
+# Concrete Network
+################################################################################
 
 class ConcreteNetwork(Network):
     def __init__(self,runtime=None):
@@ -1497,6 +2379,10 @@ class ConcreteNetwork(Network):
         self.wait_period = 0.25
         self.update_no_lock = threading.Lock()
         self.update_no = 0
+        self.update_cond = threading.Condition()
+        self.update_deadline = None
+        self.pending_update_no = None
+        self.update_thread = None
         self.log = logging.getLogger('%s.ConcreteNetwork' % __name__)
         self.debug_log = logging.getLogger('%s.DEBUG_TOPO_DISCOVERY' % __name__)
         self.debug_log.setLevel(logging.DEBUG)
@@ -1510,18 +2396,35 @@ class ConcreteNetwork(Network):
     #
 
     def queue_update(self,this_update_no):
-        def f(this_update_no):
-            time.sleep(self.wait_period)
+        """Apply the discovered topology wait_period after the latest update,
+        from a single long-lived thread."""
+        with self.update_cond:
+            self.update_deadline = time.time() + self.wait_period
+            self.pending_update_no = this_update_no
+            if self.update_thread is None:
+                self.update_thread = threading.Thread(target=self.apply_updates)
+                self.update_thread.daemon = True
+                self.update_thread.start()
+            self.update_cond.notify()
+
+    def apply_updates(self):
+        while True:
+            with self.update_cond:
+                while self.update_deadline is None:
+                    self.update_cond.wait()
+                delay = self.update_deadline - time.time()
+                if delay > 0:
+                    self.update_cond.wait(delay)
+                    continue
+                this_update_no = self.pending_update_no
+                self.update_deadline = None
             with self.update_no_lock:
                 if this_update_no != self.update_no:
-                    return
+                    continue
 
             self.topology = self.next_topo.copy()
             self.runtime.handle_network_change()
 
-        p = threading.Thread(target=f,args=(this_update_no,))
-        p.start()
-
     def get_update_no(self):
         with self.update_no_lock:
             self.update_no += 1
@@ -1685,6 +2588,8 @@ class virtual_field:
         self.cardinality = len(values) + 1
         self.type   = type
         virtual_field.fields[name] = self
+        # matches and modifies on virtual fields now translate differently
+        virtual_fields_changed()
 
     def index(self,key):
         try:
@@ -32,11 +32,12 @@
 ################################################################################
 
 from functools import wraps
+import threading
 
 from multiprocessing import Lock
 from logging import StreamHandler
 import sys
-from ipaddr import IPv4Network, AddressValueError, IPv4Address
+from ipaddr import AddressValueError
 
 
 def singleton(f):
@@ -53,6 +54,29 @@ def cached(f):
     wrapper.cache = {}
     return wrapper
 
+def cached_bounded(size):
+    """
+    Like cached, for functions whose argument space is too large to keep
+    forever: once the cache holds size entries it is emptied and refilled.
+
+    :param size: the maximum number of entries kept
+    :type size: int
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args):
+            cache = wrapper.cache
+            try:
+                return cache[args]
+            except KeyError:
+                if len(cache) >= size:
+                    cache.clear()
+                cache[args] = v = f(*args)
+                return v
+        wrapper.cache = {}
+        return wrapper
+    return decorator
+
 class frozendict(object):
     __slots__ = ["_dict", "_cached_hash"]
 
@@ -62,6 +86,14 @@ class frozendict(object):
             self._dict.update(new_dict)
         self._dict.update(kwargs)
 
+    @classmethod
+    def adopt(cls, d):
+        """Wrap the dict d without copying it. The caller hands d over and
+        must not modify it afterwards."""
+        fd = cls.__new__(cls)
+        fd._dict = d
+        return fd
+
     def update(self, new_dict=None, **kwargs):
         d = self._dict.copy()
         
@@ -135,6 +167,91 @@ class frozendict(object):
         return len(self._dict)
 
 
+class LRUCache(object):
+    """
+    A size-bounded map that evicts its least recently used entry, and counts
+    lookup hits and misses.
+
+    :param capacity: the maximum number of entries kept
+    :type capacity: int
+    """
+    # fields of a link in the circular recency list
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self.lock:
+            self.map = {}
+            self.root = []
+            self.root[:] = [self.root, self.root, None, None]
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the value cached for key (marking it most recently used),
+        or default."""
+        PREV, NEXT = self.PREV, self.NEXT
+        with self.lock:
+            link = self.map.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # move to the most recently used end of the list
+            link[PREV][NEXT] = link[NEXT]
+            link[NEXT][PREV] = link[PREV]
+            root = self.root
+            last = root[PREV]
+            last[NEXT] = root[PREV] = link
+            link[PREV] = last
+            link[NEXT] = root
+            return link[self.VALUE]
+
+    def put(self, key, value):
+        """Cache value under key, evicting the least recently used entry if the
+        cache is full."""
+        PREV, NEXT = self.PREV, self.NEXT
+        with self.lock:
+            if self.capacity <= 0:
+                return
+            link = self.map.get(key)
+            if link is not None:
+                link[self.VALUE] = value
+                return
+            if len(self.map) >= self.capacity:
+                oldest = self.root[NEXT]
+                oldest[PREV][NEXT] = oldest[NEXT]
+                oldest[NEXT][PREV] = oldest[PREV]
+                del self.map[oldest[self.KEY]]
+            root = self.root
+            last = root[PREV]
+            link = [last, root, key, value]
+            last[NEXT] = root[PREV] = self.map[key] = link
+
+    def stats(self):
+        """
+        Counters for monitoring the cache.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {'hits' : self.hits,
+                    'misses' : self.misses,
+                    'size' : len(self.map),
+                    'capacity' : self.capacity}
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def __len__(self):
+        return len(self.map)
+
+
 def indent_str(s, indent=4):
     return "\n".join(indent * " " + i for i in s.splitlines())
 
@@ -171,21 +288,28 @@ class QueueStreamHandler(StreamHandler):
         self.queue.put(record)
 
 def string_to_network(ip_str):
-    """ Return an IPv4Network object from a dotted quad IP address/subnet. """
+    """ Return an IPPrefix object from a dotted quad IP address/subnet. """
+    from pyretic.core.network import interned_prefix
     try:
-        return IPv4Network(ip_str)
+        return interned_prefix(ip_str)
     except AddressValueError:
         raise TypeError('Input not a valid IP address!')
 
 def string_to_IP(ip_str):
+    from pyretic.core.network import IPAddr, interned_ip, parse_ip
+    if isinstance(ip_str, IPAddr):
+        return ip_str
     try:
-        return IPv4Address(ip_str)
+        if isinstance(ip_str, (int, long)) and 0 <= ip_str <= 0xffffffff:
+            return interned_ip(ip_str)
+        return interned_ip(parse_ip(ip_str))
     except AddressValueError:
         raise TypeError('Input not a valid IP address!')
 
 def network_to_string(ip_net):
-    """ Return a dotted quad IP address/subnet from an IPv4Network object. """
-    assert isinstance(ip_net, IPv4Network)
+    """ Return a dotted quad IP address/subnet from an IPPrefix object. """
+    from pyretic.core.network import IPPrefix
+    assert isinstance(ip_net, IPPrefix)
     if ip_net.prefixlen < 32:
         return str(ip_net.network) + '/' + str(ip_net.prefixlen)
     else:
@@ -0,0 +1,71 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_classifier --sizes 100 200 400           #
+#                                                                              #
+# Times proactive compilation of a policy built from many parallel             #
+# match(dstip=...) >> fwd(...) fragments, and reports the classifier size.     #
+################################################################################
+
+import argparse
+import time
+
+from pyretic.core.language import match, fwd, parallel
+
+def dstip_policy(n):
+    """n parallel fragments, each forwarding one /32 destination, plus a few
+    /24 aggregates overlapping them."""
+    fragments = []
+    for i in range(n):
+        ip = '10.0.%d.%d' % (i / 250, i % 250 + 1)
+        fragments.append(match(dstip=ip) >> fwd(i % 8 + 1))
+    for j in range(n / 250 + 1):
+        fragments.append(match(dstip='10.0.%d.0/24' % j, switch=1) >> fwd(9))
+    return parallel(fragments)
+
+def run(n):
+    policy = dstip_policy(n)
+    start = time.time()
+    classifier = policy.compile()
+    elapsed = time.time() - start
+    print "%6d fragments: compiled in %8.3fs, %6d rules" % (
+        n, elapsed, len(classifier))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compilation")
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[100, 200, 400, 800],
+                        help="numbers of match(dstip=...) fragments")
+    args = parser.parse_args()
+    for n in args.sizes:
+        run(n)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_comm --sizes 64 1500                     #
+#                                                                              #
+# Measures backend <-> OF client messages/s for the JSON and binary framings:  #
+# encoding and decoding packet-in messages with payloads of the given sizes,   #
+# and streaming them between two channels over a local socket pair.           #
+################################################################################
+
+import argparse
+import asynchat
+import asyncore
+import os
+import socket
+import time
+
+from pyretic.backend.comm import *
+
+class Channel(asynchat.async_chat, FramedChannel):
+    def __init__(self, sock, socket_map, framing):
+        asynchat.async_chat.__init__(self, sock, socket_map)
+        self.init_framing()
+        self.set_in_framing(framing)
+        self.out_framing = framing
+        self.received = 0
+
+    def collect_incoming_data(self, data):
+        self.received_data.append(data)
+
+    def found_terminator(self):
+        if self.read_frame_header():
+            return
+        self.read_message()
+        self.received += 1
+
+def packet_in(size, i):
+    return ['packet', {'switch': i % 16 + 1, 'inport': 1,
+                       'srcmac': os.urandom(6), 'dstmac': os.urandom(6),
+                       'srcip': os.urandom(4), 'dstip': os.urandom(4),
+                       'ethtype': 0x800, 'protocol': 6,
+                       'srcport': 5000, 'dstport': 80,
+                       'vlan_id': None, 'vlan_pcp': None,
+                       'raw': os.urandom(size)}]
+
+def codec(msgs, framing):
+    sender = FramedChannel()
+    sender.out_framing = framing
+    start = time.time()
+    frames = [sender.frame(msg) for msg in msgs]
+    encode = time.time() - start
+    start = time.time()
+    for frame in frames:
+        if framing == FRAMING_BINARY:
+            deserialize_binary([frame[FRAME_HEADER.size:]])
+        else:
+            deserialize([frame])
+    decode = time.time() - start
+    return (encode, decode, sum(map(len, frames)))
+
+def stream(msgs, framing):
+    socket_map = {}
+    (a, b) = socket.socketpair()
+    sender = Channel(a, socket_map, framing)
+    receiver = Channel(b, socket_map, framing)
+    start = time.time()
+    for msg in msgs:
+        sender.push(sender.frame(msg))
+    while receiver.received < len(msgs):
+        asyncore.loop(timeout=0.1, map=socket_map, count=1)
+    elapsed = time.time() - start
+    sender.close()
+    receiver.close()
+    return elapsed
+
+def run(size, n):
+    msgs = [packet_in(size, i) for i in range(n)]
+    for framing in [FRAMING_JSON, FRAMING_BINARY]:
+        (encode, decode, length) = codec(msgs, framing)
+        elapsed = stream(msgs, framing)
+        print "%5d B payload, %-6s: encode %8.0f msg/s, decode %8.0f msg/s," \
+            " stream %8.0f msg/s, %6d B/msg" % (
+            size, framing, n / encode, n / decode, n / elapsed, length / n)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message framing")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[64, 1500],
+                        help="packet payload sizes")
+    parser.add_argument("--messages", type=int, default=5000,
+                        help="number of messages per run")
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.messages)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_if --sizes 50 200 400                    #
+#                                                                              #
+# Compares compiling if_ natively, by priority-ordered concatenation, against  #
+# the expansion (pred >> t) + (~pred >> f) it is defined by. Two policies of   #
+# each size are compiled: a chain of if_'s forwarding by destination address,  #
+# and a firewall dropping by source prefix and port before routing.            #
+################################################################################
+
+import argparse
+import sys
+import time
+
+from pyretic.core.language import *
+
+def chain(n):
+    policy = drop
+    for i in range(n):
+        policy = if_(match(dstip='10.0.%d.%d' % (i / 256, i % 256)),
+                     fwd(i % 4 + 1), policy)
+    return policy
+
+def firewall(n):
+    acl = [(match(srcip='10.%d.%d.0/24' % (i / 256, i % 256),
+                  dstport=22 + i % 3), drop)
+           for i in range(n)]
+    routes = (match(dstip='192.168.0.0/16') >> fwd(1)) + \
+             (match(dstip='172.16.0.0/12') >> fwd(2))
+    return first_match(acl, routes)
+
+def expand(policy):
+    """The if_'s of policy replaced by their derived definitions."""
+    if isinstance(policy, if_):
+        return (policy.pred >> expand(policy.t_branch)) + \
+               (~policy.pred >> expand(policy.f_branch))
+    if isinstance(policy, first_match):
+        return expand(policy.policy)
+    return policy
+
+def timed_compile(policy):
+    clear_compile_cache()
+    start = time.time()
+    c = policy.compile()
+    return (len(c.rules), time.time() - start)
+
+def run(name, policy, n):
+    (native_rules, native_time) = timed_compile(policy)
+    (expanded_rules, expanded_time) = timed_compile(expand(policy))
+    print "%-8s %5d: native %6d rules %8.3fs, expanded %6d rules %8.3fs" % (
+        name, n, native_rules, native_time, expanded_rules, expanded_time)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark if_ compilation")
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[50, 200, 400],
+                        help="numbers of if_ cases")
+    args = parser.parse_args()
+    # the policies nest one if_ per case
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 50 * max(args.sizes)))
+    for n in args.sizes:
+        run("chain", chain(n), n)
+        run("firewall", firewall(n), n)
+
+if __name__ == "__main__":
+    main()
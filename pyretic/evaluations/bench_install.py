@@ -0,0 +1,143 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_install --rules 1000 10000               #
+#                                                                              #
+# Measures rule install throughput (rules/s) from the runtime's Backend to an  #
+# OF client over the backend socket, sending one 'install' message per rule    #
+# plus a barrier per switch, and one 'install_batch' message per switch. The   #
+# receiving end stands in for the OF client: it deserializes every message    #
+# but does not talk to switches. Uses BACKEND_PORT, so no controller may be    #
+# running.                                                                     #
+################################################################################
+
+import argparse
+import asyncore
+import threading
+import time
+
+from pyretic.backend.backend import Backend
+from pyretic.backend.comm import *
+
+NUM_SWITCHES = 16
+
+class Receiver(asynchat.async_chat):
+    """Connects to the backend and counts the rules it receives."""
+    def __init__(self, socket_map):
+        self.received_data = []
+        self.rules = 0
+        self.barriers = 0
+        self.done = threading.Event()
+        self.expected_barriers = None
+        asynchat.async_chat.__init__(self, map=socket_map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(('localhost', BACKEND_PORT))
+        self.set_terminator(TERM_CHAR)
+
+    def collect_incoming_data(self, data):
+        self.received_data.append(data)
+
+    def found_terminator(self):
+        msg = deserialize(self.received_data)
+        if msg[0] == 'install':
+            self.rules += 1
+        elif msg[0] == 'install_batch':
+            self.rules += len(msg[2]) + len(msg[3]) + len(msg[4])
+            self.barriers += 1
+        elif msg[0] == 'barrier':
+            self.barriers += 1
+        if self.barriers == self.expected_barriers:
+            self.done.set()
+
+    def expect(self, barriers):
+        self.rules = 0
+        self.barriers = 0
+        self.expected_barriers = barriers
+        self.done.clear()
+
+def make_rules(n):
+    rules = {}
+    for i in range(n):
+        s = i % NUM_SWITCHES + 1
+        m = {'switch': s,
+             'dstip': '10.%d.%d.%d' % ((i >> 16) & 0xff, (i >> 8) & 0xff,
+                                       i & 0xff),
+             'ethtype': 0x800}
+        rules.setdefault(s, []).append(
+            (m, 60000 - i / NUM_SWITCHES, [{'outport': 1}], 1, False))
+    return rules
+
+def timed(receiver, send, n):
+    receiver.expect(NUM_SWITCHES)
+    start = time.time()
+    send()
+    receiver.done.wait()
+    elapsed = time.time() - start
+    assert receiver.rules == n
+    return elapsed
+
+def run(backend, receiver, n):
+    rules = make_rules(n)
+    def per_rule():
+        for (s, rs) in rules.items():
+            for (pred, priority, actions, cookie, notify) in rs:
+                backend.send_install(pred, priority, actions, cookie, notify)
+            backend.send_barrier(s)
+    def batched():
+        for (s, rs) in rules.items():
+            backend.send_install_batch(s, [], rs, [])
+    elapsed = timed(receiver, per_rule, n)
+    print "%8d rules: per-rule %8.3fs (%9.0f rules/s)" % (n, elapsed,
+                                                          n / elapsed)
+    elapsed = timed(receiver, batched, n)
+    print "%8d rules: batched  %8.3fs (%9.0f rules/s)" % (n, elapsed,
+                                                          n / elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rule installs")
+    parser.add_argument("--rules", type=int, nargs='+',
+                        default=[1000, 10000, 50000],
+                        help="numbers of rules to install")
+    args = parser.parse_args()
+
+    backend = Backend()
+    socket_map = {}
+    receiver = Receiver(socket_map)
+    loop = threading.Thread(target=asyncore.loop,
+                            kwargs={'timeout' : 0.01, 'map' : socket_map})
+    loop.daemon = True
+    loop.start()
+    while backend.backend_channel is None:
+        time.sleep(0.01)
+    for n in args.rules:
+        run(backend, receiver, n)
+
+if __name__ == "__main__":
+    main()
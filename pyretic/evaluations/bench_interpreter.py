@@ -0,0 +1,99 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_interpreter --hosts 50 200 800           #
+#                                                                              #
+# Measures packet-in interpretation throughput for a learned mac_learner-like  #
+# forwarding table, evaluating on the policy AST (queries_in_eval followed by  #
+# eval, as Runtime.handle_packet_in does by default) and on the compiled       #
+# classifier (Runtime's compiled_eval mode).                                   #
+################################################################################
+
+import argparse
+import random
+import time
+
+from pyretic.core.language import match, fwd, parallel
+from pyretic.core.language_tools import queries_in_eval
+from pyretic.core.language_tools import queries_in_classifier_eval
+from pyretic.core.network import EthAddr
+from pyretic.core.packet import Packet
+
+NUM_SWITCHES = 4
+
+def forwarding_policy(num_hosts):
+    """Forward to each host's port on every switch."""
+    macs = [EthAddr('00:00:00:00:%02x:%02x' % (i >> 8, i & 0xff))
+            for i in range(num_hosts)]
+    policy = parallel([match(switch=s, dstmac=mac) >> fwd(i % 4 + 1)
+                       for i, mac in enumerate(macs)
+                       for s in range(1, NUM_SWITCHES + 1)])
+    return (policy, macs)
+
+def run(num_hosts, num_pkts):
+    (policy, macs) = forwarding_policy(num_hosts)
+    pkts = [Packet({'switch' : random.randint(1, NUM_SWITCHES),
+                    'inport' : 1,
+                    'srcmac' : random.choice(macs),
+                    'dstmac' : random.choice(macs)})
+            for _ in range(num_pkts)]
+
+    start = time.time()
+    for pkt in pkts:
+        queries_in_eval((set(), {pkt}), policy)
+        policy.eval(pkt)
+    ast_rate = num_pkts / (time.time() - start)
+
+    start = time.time()
+    classifier = policy.compile()
+    classifier.find_rule(pkts[0])
+    setup = time.time() - start
+    start = time.time()
+    for pkt in pkts:
+        queries_in_classifier_eval(classifier, pkt)
+    classifier_rate = num_pkts / (time.time() - start)
+
+    print "%5d hosts (%5d rules): AST %8.0f pkt/s, classifier %8.0f pkt/s" \
+        " (compiled and indexed in %.2fs)" % (
+        num_hosts, len(classifier), ast_rate, classifier_rate, setup)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packet-in "
+                                     "interpretation")
+    parser.add_argument("--hosts", type=int, nargs='+', default=[50, 200, 800],
+                        help="numbers of learned hosts")
+    parser.add_argument("--packets", type=int, default=1000,
+                        help="packets to interpret per run")
+    args = parser.parse_args()
+    for n in args.hosts:
+        run(n, args.packets)
+
+if __name__ == "__main__":
+    main()
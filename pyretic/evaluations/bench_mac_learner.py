@@ -0,0 +1,123 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_mac_learner --hosts 100 1000 5000        #
+# python -m pyretic.evaluations.bench_mac_learner --hosts 100 300 --compile    #
+#                                                                              #
+# Measures modules.mac_learner as the number of learned hosts grows: the learn #
+# rate (hosts/s, including the recompilation a proactive runtime does after    #
+# each learn, with --compile), and the packet-in latency of evaluating the     #
+# learned policy as Runtime.handle_packet_in does. Compares the lookup-table   #
+# learner with the earlier learner that wraps its forwarding policy in one     #
+# more if_ per host, skipping the latter past the recursion limit.             #
+################################################################################
+
+import argparse
+import random
+import sys
+import time
+
+from pyretic.core.language import if_, match, fwd
+from pyretic.core.language_tools import queries_in_eval
+from pyretic.core.network import EthAddr
+from pyretic.core.packet import Packet
+from pyretic.modules.mac_learner import mac_learner
+
+NUM_SWITCHES = 4
+
+class if_chain_learner(mac_learner):
+    """The mac_learner as it was before lookup tables."""
+    def set_initial_state(self):
+        super(if_chain_learner,self).set_initial_state()
+        self.forward = self.flood
+        self.update_policy()
+
+    def learn_new_MAC(self,pkt):
+        self.forward = if_(match(dstmac=pkt['srcmac'],
+                                switch=pkt['switch']),
+                          fwd(pkt['inport']),
+                          self.forward)
+        self.update_policy()
+
+def make_packets(num_hosts, n):
+    macs = [EthAddr('00:00:00:%02x:%02x:%02x' % (i >> 16, (i >> 8) & 0xff,
+                                                 i & 0xff))
+            for i in range(num_hosts)]
+    learned = [Packet({'switch' : i % NUM_SWITCHES + 1,
+                       'inport' : i % 8 + 1,
+                       'srcmac' : mac})
+               for i, mac in enumerate(macs)]
+    packet_ins = [Packet({'switch' : random.randint(1, NUM_SWITCHES),
+                          'inport' : 1,
+                          'srcmac' : random.choice(macs),
+                          'dstmac' : random.choice(macs)})
+                  for _ in range(n)]
+    return (learned, packet_ins)
+
+def run(name, learner, learned, packet_ins, compile):
+    # as the runtime does when a dynamic policy changes
+    learner.attach(lambda policy: policy.invalidate_classifier())
+    start = time.time()
+    for pkt in learned:
+        learner.learn_new_MAC(pkt)
+        if compile:
+            learner.compile()
+    learn_rate = len(learned) / (time.time() - start)
+
+    start = time.time()
+    for pkt in packet_ins:
+        queries_in_eval((set(), {pkt}), learner.policy)
+        learner.policy.eval(pkt)
+    latency = (time.time() - start) / len(packet_ins)
+
+    print "%6d hosts %-8s: learn %9.0f hosts/s, packet-in %8.1f us" % (
+        len(learned), name, learn_rate, 1e6 * latency)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MAC learning")
+    parser.add_argument("--hosts", type=int, nargs='+',
+                        default=[100, 1000, 5000],
+                        help="numbers of hosts to learn")
+    parser.add_argument("--packets", type=int, default=1000,
+                        help="packet-ins to evaluate per run")
+    parser.add_argument("--compile", action="store_true",
+                        help="recompile the policy after each learn")
+    args = parser.parse_args()
+    for n in args.hosts:
+        (learned, packet_ins) = make_packets(n, args.packets)
+        run('lookup', mac_learner(), learned, packet_ins, args.compile)
+        try:
+            run('if_', if_chain_learner(), learned, packet_ins, args.compile)
+        except RuntimeError:
+            print "%6d hosts %-8s: exceeds the recursion limit (%d)" % (
+                n, 'if_', sys.getrecursionlimit())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_multitable --switches 4 6                #
+#                                                                              #
+# Compiles the path queries of bench_path_dfa together with shortest-path      #
+# forwarding on a cycle of switches, and compares the classifier rules of the  #
+# single-table policy the runtime builds with those of the multi-table         #
+# pipeline (--multitable): path in table, forwarding table, path out table.    #
+# Forwarding rules with several outputs count once per rule they fan out to.   #
+################################################################################
+
+import argparse
+import time
+
+from pyretic.core.language import *
+from pyretic.core.runtime import pipeline_outputs, pipeline_fanout
+from pyretic.lib.path import *
+from pyretic.evaluations.bench_path_dfa import QUERIES, HOST_PORT
+
+def forwarding(n):
+    """Host i hangs off switch i; every switch forwards clockwise (port 1)
+    to the others."""
+    policy = None
+    for s in range(1, n+1):
+        for h in range(1, n+1):
+            port = HOST_PORT if h == s else 1
+            p = match(switch=s, dstip='10.0.0.%d' % h) >> fwd(port)
+            policy = p if policy is None else policy + p
+    return policy
+
+def timed_compile(policy):
+    start = time.time()
+    classifier = policy.compile()
+    return (classifier, time.time() - start)
+
+def run(name, n):
+    (in_tag, in_cap, out_tag, out_cap) = pathcomp.compile(QUERIES[name](n))
+    fwding = forwarding(n)
+
+    single = (((in_tag >> fwding) >> out_tag) + in_cap +
+              ((in_tag >> fwding) >> out_cap))
+    (c, single_time) = timed_compile(single)
+    single_rules = len(c.rules)
+
+    stages = [in_tag + in_cap, fwding, out_tag + out_cap]
+    compiled = [timed_compile(stage) for stage in stages]
+    pipeline_time = sum(t for (_, t) in compiled)
+    (in_c, fwd_c, out_c) = [c for (c, _) in compiled]
+    fwd_rules = 0
+    for rule in fwd_c.rules:
+        if len(pipeline_outputs(rule)) > 1:
+            fwd_rules += len(pipeline_fanout(rule, out_c).rules)
+        else:
+            fwd_rules += 1
+    pipeline_rules = len(in_c.rules) + fwd_rules + len(out_c.rules)
+
+    print "%-8s %3d switches: single table %7d rules %8.3fs" % (
+        name, n, single_rules, single_time)
+    print "%-8s %3d switches: pipeline     %7d rules %8.3fs (%d + %d + %d)" % (
+        name, n, pipeline_rules, pipeline_time, len(in_c.rules), fwd_rules,
+        len(out_c.rules))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark single- vs multi-table path query rules")
+    parser.add_argument("--switches", type=int, nargs='+', default=[4, 6],
+                        help="numbers of switches in the topology")
+    parser.add_argument("--queries", nargs='+', default=sorted(QUERIES.keys()),
+                        choices=sorted(QUERIES.keys()),
+                        help="bench_path_dfa queries to compile")
+    args = parser.parse_args()
+    pathcomp.init(1022)
+    for name in args.queries:
+        for n in args.switches:
+            run(name, n)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_packet_in --packets 20000 --hosts 100    #
+#                                                                              #
+# Measures Runtime.concrete2pyretic, which turns each packet-in from the OF    #
+# client into a pyretic Packet, against the earlier conversion (fresh IP/MAC   #
+# objects per packet, Packet built through modifymany). Packets are TCP        #
+# between random pairs of --hosts hosts. Reports time per packet-in and the    #
+# address objects and frozendicts allocated per packet-in.                     #
+################################################################################
+
+import argparse
+import random
+import time
+
+import pyretic.vendor
+from ryu.lib.packet import packet, ethernet, ipv4, tcp
+
+from pyretic.core import util
+from pyretic.core.network import IPAddr, EthAddr, IP, MAC
+from pyretic.core.packet import Packet, get_packet_processor
+from pyretic.core.runtime import Runtime
+
+def make_packet_ins(n, hosts):
+    templates = []
+    for i in range(hosts):
+        for j in range(min(hosts, 8)):
+            src, dst = i + 1, (i + j + 1) % hosts + 1
+            pkt = packet.Packet()
+            pkt.add_protocol(ethernet.ethernet('00:00:00:00:%02x:%02x' % (
+                dst >> 8, dst & 0xff), '00:00:00:00:%02x:%02x' % (
+                src >> 8, src & 0xff), 0x800))
+            pkt.add_protocol(ipv4.ipv4(proto=6,
+                                       src='10.0.%d.%d' % (src >> 8, src & 0xff),
+                                       dst='10.0.%d.%d' % (dst >> 8, dst & 0xff)))
+            pkt.add_protocol(tcp.tcp(1234, 80))
+            pkt.serialize()
+            templates.append(str(pkt.data))
+    rand = random.Random(0)
+    return [{'raw': rand.choice(templates), 'switch': 1, 'inport': 1}
+            for _ in xrange(n)]
+
+def legacy_concrete2pyretic(raw_pkt):
+    """The conversion previously done by Runtime.concrete2pyretic."""
+    packet = get_packet_processor().unpack(raw_pkt['raw'])
+    packet['raw'] = raw_pkt['raw']
+    packet['switch'] = raw_pkt['switch']
+    packet['inport'] = raw_pkt['inport']
+
+    def convert(h,val):
+        if h in ['srcmac','dstmac']:
+            return MAC(val)
+        elif h in ['srcip','dstip']:
+            return IP(val)
+        else:
+            return val
+
+    pyretic_packet = Packet(util.frozendict())
+    d = { h : convert(h,v) for (h,v) in packet.items() }
+    return pyretic_packet.modifymany(d)
+
+class AllocationCounter(object):
+    """Counts instances of the given classes (and their subclasses) created
+    while active."""
+    def __init__(self, *classes):
+        self.classes = classes
+        self.counts = dict.fromkeys(classes, 0)
+
+    def __enter__(self):
+        def counting_new(c):
+            def new(cls, *args, **kwargs):
+                self.counts[c] += 1
+                return object.__new__(cls)
+            return staticmethod(new)
+        for c in self.classes:
+            c.__new__ = counting_new(c)
+        return self
+
+    def __exit__(self, *exc):
+        for c in self.classes:
+            del c.__new__
+
+def run(name, convert, packet_ins):
+    n = len(packet_ins)
+    start = time.time()
+    for p in packet_ins:
+        convert(p)
+    elapsed = time.time() - start
+    with AllocationCounter(IPAddr, EthAddr, util.frozendict) as counter:
+        for p in packet_ins:
+            convert(p)
+    print "%-8s %8.2f us/pkt  %5.2f addresses/pkt  %5.2f frozendicts/pkt" % (
+        name, 1e6 * elapsed / n, float(counter.counts[IPAddr] +
+                                       counter.counts[EthAddr]) / n,
+        float(counter.counts[util.frozendict]) / n)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packet-in conversion")
+    parser.add_argument("--packets", type=int, default=20000,
+                        help="number of packet-ins to convert")
+    parser.add_argument("--hosts", type=int, default=100,
+                        help="number of distinct hosts sending packets")
+    args = parser.parse_args()
+
+    packet_ins = make_packet_ins(args.packets, args.hosts)
+    runtime = Runtime.__new__(Runtime)
+    for p in packet_ins:
+        assert runtime.concrete2pyretic(p) == legacy_concrete2pyretic(p)
+    run('legacy', legacy_concrete2pyretic, packet_ins)
+    run('current', runtime.concrete2pyretic, packet_ins)
+
+if __name__ == "__main__":
+    main()
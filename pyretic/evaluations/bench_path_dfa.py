@@ -0,0 +1,119 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_path_dfa --switches 4 8 16               #
+#                                                                              #
+# Compiles the path queries of evaluations/eval_path.py (loops, traffic        #
+# matrix, waypoint) for growing numbers of switches, and reports the DFA       #
+# states, DFA edges and tagging/capture rules (fragments) generated by         #
+# pathcomp.compile, without and with DFA minimization and edge merging. As in  #
+# the cycle topologies of eval_path.py, hosts hang off port HOST_PORT, which   #
+# stands in for ingress_network() and the older end_path here.                 #
+################################################################################
+
+import argparse
+import time
+
+from pyretic.core.language import *
+from pyretic.lib.path import *
+
+HOST_PORT = 3
+
+def loops_query(n):
+    """As eval_path.path_test_loop."""
+    policy = None
+    for s in range(1, n+1):
+        p = (atom(match(switch=s)) ^ +(atom(~match(switch=s))) ^
+             atom(match(switch=s)))
+        policy = p if policy is None else policy + p
+    return policy
+
+def tm_query(n):
+    """As eval_path.path_test_tm."""
+    policy = None
+    for s1 in range(1, n+1):
+        for s2 in range(1, n+1):
+            if s1 == s2:
+                continue
+            p = (in_atom(match(switch=s1, port=HOST_PORT)) ^
+                 out_atom(match(switch=s2, port=HOST_PORT)))
+            p.set_bucket(CountBucket())
+            policy = p if policy is None else policy + p
+    return policy
+
+def waypoint_query(n):
+    """As eval_path.path_test_waypoint, with switch n as the firewall."""
+    return (atom(match(port=HOST_PORT)) ^ atom(~match(switch=n)) ^
+            atom(~match(switch=n)) ^ out_atom(identity))
+
+QUERIES = {'loops': loops_query,
+           'tm': tm_query,
+           'waypoint': waypoint_query}
+
+def count_rules(frags):
+    """The number of tagging/capture fragments in the compiled policies."""
+    count = 0
+    for frag in frags:
+        if isinstance(frag, parallel):
+            count += len(frag.policies)
+        elif frag != drop:
+            count += 1
+    return count
+
+def run(name, n):
+    for minimize in [False, True]:
+        policy = QUERIES[name](n)
+        start = time.time()
+        frags = pathcomp.compile(policy, minimize=minimize)
+        elapsed = time.time() - start
+        # rebuild the DFA compile used, from the atoms it left behind
+        (re_list, _) = path_policy_utils.path_policy_ast_fold(
+            policy, pathcomp.__get_re_pols__, ([], []))
+        dfa = dfa_utils.regexes_to_dfa(re_list, minimize=minimize)
+        print "%-8s %3d switches, %-9s %5d states %6d edges %6d rules %8.3fs" % (
+            name, n, 'minimized' if minimize else 'plain',
+            dfa_utils.get_num_states(dfa), dfa_utils.get_num_transitions(dfa),
+            count_rules(frags), elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark path query DFAs")
+    parser.add_argument("--switches", type=int, nargs='+', default=[4, 8],
+                        help="numbers of switches in the topology")
+    parser.add_argument("--queries", nargs='+', default=sorted(QUERIES.keys()),
+                        choices=sorted(QUERIES.keys()),
+                        help="eval_path queries to compile")
+    args = parser.parse_args()
+    pathcomp.init(1022)
+    for name in args.queries:
+        for n in args.switches:
+            run(name, n)
+
+if __name__ == "__main__":
+    main()
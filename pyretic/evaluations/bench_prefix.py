@@ -0,0 +1,84 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_prefix --matches 1000 --calls 200000     #
+#                                                                              #
+# Measures match.intersect and match.covers calls per second on random         #
+# srcip/dstip prefix matches, the comparisons at the heart of classifier       #
+# composition and shadow elimination.                                          #
+################################################################################
+
+import argparse
+import random
+import time
+
+from pyretic.core.language import match
+
+def random_prefix(rand):
+    plen = rand.choice([8, 16, 24, 32])
+    addr = rand.getrandbits(plen) << (32 - plen)
+    return "%d.%d.%d.%d/%d" % ((addr >> 24) & 0xff, (addr >> 16) & 0xff,
+                               (addr >> 8) & 0xff, addr & 0xff, plen)
+
+def make_matches(n, rand):
+    # few distinct /8's, so that many pairs overlap
+    matches = []
+    for i in range(n):
+        m = {'dstip' : '10.%s' % random_prefix(rand).split('.', 1)[1]}
+        if rand.random() < 0.5:
+            m['srcip'] = random_prefix(rand)
+        matches.append(match(**m))
+    return matches
+
+def timed(name, f, pairs):
+    start = time.time()
+    for (m1, m2) in pairs:
+        f(m1, m2)
+    elapsed = time.time() - start
+    print "%-9s %8d calls %8.3fs (%9.0f calls/s)" % (name, len(pairs),
+                                                    elapsed,
+                                                    len(pairs) / elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prefix matches")
+    parser.add_argument("--matches", type=int, default=1000,
+                        help="number of distinct matches")
+    parser.add_argument("--calls", type=int, default=200000,
+                        help="number of calls to time")
+    args = parser.parse_args()
+    rand = random.Random(0)
+    matches = make_matches(args.matches, rand)
+    pairs = [(rand.choice(matches), rand.choice(matches))
+             for i in range(args.calls)]
+    timed("intersect", lambda m1, m2: m1.intersect(m2), pairs)
+    timed("covers", lambda m1, m2: m1.covers(m2), pairs)
+
+if __name__ == "__main__":
+    main()
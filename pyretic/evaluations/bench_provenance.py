@@ -0,0 +1,99 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_provenance --sizes 100 400               #
+#                                                                              #
+# Compiles a synthetic policy (an ACL, then routing in parallel with per-host  #
+# monitoring) with and without rule provenance tracking, each in a fresh       #
+# process, and reports the compiler's peak memory, the Rule objects still      #
+# alive once compilation is over, and the compile time.                        #
+################################################################################
+
+import argparse
+import gc
+import multiprocessing
+import resource
+import time
+
+from pyretic.core.language import *
+from pyretic.core.classifier import Rule, track_provenance
+
+def make_policy(n):
+    acl = union([match(srcip='10.%d.%d.0/24' % (i / 256, i % 256),
+                       dstport=22 + i % 3)
+                 for i in range(n / 4)])
+    routes = union([match(dstip='10.0.%d.%d' % (i / 256, i % 256)) >>
+                    fwd(i % 8 + 1)
+                    for i in range(n)])
+    monitor = union([match(srcip='10.0.%d.%d' % (i / 256, i % 256),
+                           dstport=80) >> fwd(9)
+                     for i in range(n / 2)])
+    return ~acl >> (routes + monitor)
+
+def live_rules():
+    gc.collect()
+    return sum(1 for o in gc.get_objects() if isinstance(o, Rule))
+
+def measure(n, tracked, conn):
+    track_provenance(tracked)
+    policy = make_policy(n)
+    gc.collect()
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    c = policy.compile()
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    # only the compiled classifier should keep rules alive
+    del policy
+    clear_compile_cache()
+    conn.send((len(c.rules), peak, live_rules(), elapsed))
+
+def run(n, tracked):
+    (parent, child) = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=measure, args=(n, tracked, child))
+    p.start()
+    (rules, peak, alive, elapsed) = parent.recv()
+    p.join()
+    print "%6d: %-11s %7d rules, peak +%8d KB, %9d live Rules, %7.2fs" % (
+        n, "tracked" if tracked else "not tracked", rules, peak, alive,
+        elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark compiler memory with and without provenance")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[100, 400],
+                        help="numbers of routes in the synthetic policy")
+    args = parser.parse_args()
+    for n in args.sizes:
+        run(n, True)
+        run(n, False)
+
+if __name__ == "__main__":
+    main()
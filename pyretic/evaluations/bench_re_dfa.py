@@ -0,0 +1,128 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_re_dfa --queries 10 20 40 --paths 1 2 3  #
+#                                                                              #
+# Times DFA construction for growing numbers of queries, in the shapes used by #
+# tests/test_re.py (makeDFA_vector over plain regular expressions) and by      #
+# tests/test_path.py (pathcomp.compile over a union of path queries built from #
+# in, out and in_out atoms). Reports the number of DFA states and the entries  #
+# of the derivative memo table. Path compilation is dominated by predicate    #
+# handling in lib/path.py, so keep --paths small.                              #
+################################################################################
+
+import argparse
+import time
+
+from pyretic.core.language import *
+from pyretic.lib.re import *
+from pyretic.lib.path import *
+
+ALPHABET = string.ascii_letters
+
+def regex_queries(n):
+    """n regular expressions over ALPHABET, cycling through the shapes of
+    tests/test_re.py."""
+    syms = [re_symbol(c) for c in ALPHABET]
+    anything = reduce(lambda acc, s: acc | s, syms[1:], syms[0])
+    queries = []
+    for i in range(n):
+        (a, b, c) = (syms[i % len(syms)], syms[(3*i + 1) % len(syms)],
+                     syms[(7*i + 2) % len(syms)])
+        shape = i % 5
+        if shape == 0:
+            queries.append((a ^ b) | (a ^ c))
+        elif shape == 1:
+            queries.append((+a) | (b ^ c))
+        elif shape == 2:
+            queries.append(a ^ (+anything) ^ b)
+        elif shape == 3:
+            queries.append((a ^ +c) & ~(b ^ a ^ c))
+        else:
+            queries.append(+(a ^ b) ^ c)
+    return queries
+
+def path_queries(n):
+    """A union of n path queries, cycling through the shapes of
+    tests/test_path.py."""
+    def ip(i):
+        return IPAddr('10.0.%d.%d' % ((i >> 8) & 0xff, i & 0xff))
+    policy = None
+    for i in range(n):
+        a1 = atom(match(srcip=ip(i), switch=i % 4 + 1))
+        a2 = atom(match(dstip=ip(i + 1)))
+        a3 = atom(match(switch=i % 4 + 1)) | atom(match(srcip=ip(i + 2)))
+        shape = i % 4
+        if shape == 0:
+            p = a1 ^ a2
+        elif shape == 1:
+            p = ((a1 ^ a2) | (a2 ^ a1)) & a3
+        elif shape == 2:
+            p = in_atom(match(srcip=ip(i))) ^ out_atom(match(dstip=ip(i + 1)))
+        else:
+            p = a1 ^ +a3 ^ in_out_atom(match(switch=1), match(dstip=ip(i)))
+        pp = path_policy(p, FwdBucket())
+        policy = pp if policy is None else policy + pp
+    return policy
+
+def run_regex(n):
+    queries = regex_queries(n)
+    deriv.cache.clear()
+    start = time.time()
+    dfa = makeDFA_vector(queries, ALPHABET)
+    elapsed = time.time() - start
+    print "%4d regexes: %8.3fs, %6d states, %7d memoized derivatives" % (
+        n, elapsed, dfa_utils.get_num_states(dfa), len(deriv.cache))
+
+def run_path(n):
+    policy = path_queries(n)
+    deriv.cache.clear()
+    start = time.time()
+    pathcomp.compile(policy)
+    elapsed = time.time() - start
+    print "%4d paths:   %8.3fs, %7d memoized derivatives" % (
+        n, elapsed, len(deriv.cache))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DFA construction")
+    parser.add_argument("--queries", type=int, nargs='+',
+                        default=[10, 20, 40],
+                        help="numbers of regular expressions to compile")
+    parser.add_argument("--paths", type=int, nargs='*', default=[1, 2, 3],
+                        help="numbers of path queries to compile")
+    args = parser.parse_args()
+    pathcomp.init(1022)
+    for n in args.queries:
+        run_regex(n)
+    for n in args.paths:
+        run_path(n)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+################################################################################
+# USAGE                                                                        #
+# -------------------------------------------------------------------          #
+# python -m pyretic.evaluations.bench_rule_diff --sizes 10000 100000           #
+#                                                                              #
+# Times the proactive1 incremental rule diff between two classifier versions   #
+# in which a small fraction of rules were added, removed or had their actions  #
+# changed. With --legacy, also times the earlier list-scan diff (quadratic;    #
+# only practical for a few thousand rules).                                    #
+################################################################################
+
+import argparse
+import time
+
+from pyretic.core.runtime import index_rules, incremental_diff
+
+NUM_SWITCHES = 16
+
+def make_rules(n, version, changed=frozenset(), offset=0):
+    """Generate n rule tuples spread over NUM_SWITCHES switches. Rules whose
+    index is in `changed` get a different outport."""
+    rules = []
+    for i in range(offset, offset + n):
+        m = {'switch': i % NUM_SWITCHES + 1,
+             'dstip': '10.%d.%d.%d' % ((i >> 16) & 0xff, (i >> 8) & 0xff,
+                                       i & 0xff),
+             'ethtype': 0x800}
+        outport = 2 if i in changed else 1
+        rules.append((m, 60000 - i / NUM_SWITCHES, [{'outport': outport}],
+                      version))
+    return rules
+
+def legacy_diff(old_rules, new_rules):
+    """The list-scan diff previously used by Runtime.install_classifier."""
+    def find_same_rule(target, rule_list):
+        for rule in rule_list:
+            if target[0] == rule[0] and target[1] == rule[1]:
+                return rule
+        return None
+    to_add, to_delete, to_modify, to_stay = [], [], [], []
+    for old in old_rules:
+        new = find_same_rule(old, new_rules)
+        if new is None:
+            to_delete.append(old)
+        elif old[2] != new[2]:
+            to_modify.append((new[0], new[1], new[2], old[3]))
+        else:
+            to_stay.append(old)
+    for new in new_rules:
+        if find_same_rule(new, old_rules) is None:
+            to_add.append(new)
+    return (to_add, to_delete, to_modify, to_stay)
+
+def run(n, churn, legacy):
+    num_changed = max(1, int(n * churn))
+    old_rules = make_rules(n, 1)
+    # drop the first num_changed rules, add as many fresh ones, and change the
+    # actions on another num_changed rules.
+    changed = frozenset(range(num_changed, 2 * num_changed))
+    new_rules = make_rules(n, 2, changed, offset=num_changed)
+
+    installed = index_rules(old_rules)
+    start = time.time()
+    (to_add, to_delete, to_modify, to_stay) = incremental_diff(installed,
+                                                               new_rules)
+    elapsed = time.time() - start
+    print "%8d rules: indexed diff %8.3fs (%6.2f us/rule)" % (
+        n, elapsed, 1e6 * elapsed / n),
+    print " +%d -%d ~%d =%d" % (len(to_add), len(to_delete), len(to_modify),
+                               len(to_stay))
+    if legacy:
+        start = time.time()
+        legacy_diff(old_rules, new_rules)
+        elapsed = time.time() - start
+        print "%8d rules: legacy diff  %8.3fs (%6.2f us/rule)" % (
+            n, elapsed, 1e6 * elapsed / n)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rule diffs")
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help="numbers of installed rules to diff")
+    parser.add_argument("--churn", type=float, default=0.01,
+                        help="fraction of rules added/deleted/modified")
+    parser.add_argument("--legacy", action="store_true",
+                        help="also time the list-scan diff")
+    args = parser.parse_args()
+    for n in args.sizes:
+        run(n, args.churn, args.legacy)
+
+if __name__ == "__main__":
+    main()
@@ -28,12 +28,15 @@
 
 from pyretic.core.language import identity, egress_network, Filter, drop, match
 from pyretic.core.language import modify, Query, FwdBucket, CountBucket
-from pyretic.core.language import PathBucket, DynamicFilter
+from pyretic.core.language import PathBucket, DynamicFilter, DerivedPolicy
+from pyretic.core.language import negate, union, intersection, parallel
+from pyretic.core.language import sequential
 from pyretic.core.language_tools import ast_fold as policy_ast_fold
 from pyretic.core.language_tools import add_dynamic_sub_pols
 
 from pyretic.lib.query import counts, packets
 from pyretic.core.runtime import virtual_field
+from pyretic.core import util
 
 from pyretic.lib.re import *
 
@@ -41,6 +44,13 @@ import subprocess
 import pyretic.vendor
 import pydot
 import copy
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
 
 TOKEN_START_VALUE = 48 # start with printable ASCII for visual inspection ;)
 # token type definitions
@@ -142,6 +152,176 @@ class classifier_utils(object):
         return ~matched_packets
 
 
+class pred_space(object):
+    """ A table of field-wise decision diagrams (FDDs), which represent
+    predicates over packet header fields exactly. Leaf-level predicates are
+    compared and refined on their FDDs rather than by compiling classifiers.
+
+    An FDD node tests one field against a value (exact, or an IP prefix for
+    srcip/dstip), and has a `hi` child for packets passing the test and a `lo`
+    child for the rest. Tests are ordered by field, and IP prefixes from the
+    most to the least specific, so once a test on a field passes all later
+    tests on that field are decided; they never appear in the `hi` child.
+    Nodes are hash-consed into integer ids, with FALSE and TRUE as leaves, so
+    equal predicates have equal ids. Sets of prefixes covering a larger
+    prefix exactly are not detected, so such a difference counts as
+    non-empty.
+    """
+    FALSE = 0
+    TRUE  = 1
+    IP_FIELDS = ('srcip', 'dstip')
+
+    def __init__(self):
+        self.nodes  = [None, None] # id -> (test, hi, lo)
+        self.unique = {}           # (test, hi, lo) -> id
+        self.op_cache = {}
+        self.match_cache = {}      # match map -> id
+
+    def test(self, field, value):
+        """ The test of `field` against `value`, as an ordering key. """
+        if field in self.IP_FIELDS and hasattr(value, 'prefixlen'):
+            return (field, -value.prefixlen, int(value.network))
+        elif isinstance(value, (int, long)):
+            return (field, 1, value)
+        else:
+            return (field, 1, repr(value))
+
+    def implies(self, t, u):
+        """ Whether test u, on the same field as and ordered after test t,
+        passes when t passes. """
+        if t[1] == 1 or u[1] == 1:
+            return False
+        shift = 32 + u[1] # u is at most as specific as t
+        return (t[2] >> shift) == (u[2] >> shift)
+
+    def mk(self, t, hi, lo):
+        if hi == lo:
+            return hi
+        key = (t, hi, lo)
+        try:
+            return self.unique[key]
+        except KeyError:
+            n = self.unique[key] = len(self.nodes)
+            self.nodes.append(key)
+            return n
+
+    def restrict(self, n, t):
+        """ The FDD n, for packets passing test t, which precedes all tests
+        in n. """
+        while n > self.TRUE:
+            (u, hi, lo) = self.nodes[n]
+            if u[0] != t[0]:
+                break
+            n = hi if self.implies(t, u) else lo
+        return n
+
+    def neg(self, n):
+        if n <= self.TRUE:
+            return self.TRUE - n
+        key = ('not', n)
+        try:
+            return self.op_cache[key]
+        except KeyError:
+            pass
+        (t, hi, lo) = self.nodes[n]
+        r = self.op_cache[key] = self.mk(t, self.neg(hi), self.neg(lo))
+        return r
+
+    def apply(self, op, a, b):
+        """ Conjunction (op 'and') or disjunction (op 'or') of FDDs a, b. """
+        (T, F) = (self.TRUE, self.FALSE)
+        if op == 'and':
+            if a == F or b == F:
+                return F
+            elif a == T:
+                return b
+            elif b == T or a == b:
+                return a
+        else:
+            if a == T or b == T:
+                return T
+            elif a == F:
+                return b
+            elif b == F or a == b:
+                return a
+        if a > b:
+            (a, b) = (b, a)
+        key = (op, a, b)
+        try:
+            return self.op_cache[key]
+        except KeyError:
+            pass
+        (ta, a_hi, a_lo) = self.nodes[a]
+        (tb, b_hi, b_lo) = self.nodes[b]
+        if ta < tb:
+            t = ta
+            (b_hi, b_lo) = (self.restrict(b, t), b)
+        elif tb < ta:
+            t = tb
+            (a_hi, a_lo) = (self.restrict(a, t), a)
+        else:
+            t = ta
+        r = self.mk(t, self.apply(op, a_hi, b_hi), self.apply(op, a_lo, b_lo))
+        self.op_cache[key] = r
+        return r
+
+    def diff(self, a, b):
+        return self.apply('and', a, self.neg(b))
+
+    def from_pred(self, p):
+        """ The FDD of the filter policy p. Raises TypeError if p is not built
+        from matches, boolean combinators and derived (e.g., dynamic) filters.
+
+        :param p: predicate
+        :type p: Filter
+        """
+        if p is identity:
+            return self.TRUE
+        elif p is drop:
+            return self.FALSE
+        elif isinstance(p, match):
+            try:
+                return self.match_cache[p.map]
+            except KeyError:
+                pass
+            n = self.TRUE
+            for (f, v) in p.map.items():
+                n = self.apply('and', n,
+                               self.mk(self.test(f, v), self.TRUE, self.FALSE))
+            self.match_cache[p.map] = n
+            return n
+        elif isinstance(p, negate):
+            return self.neg(self.from_pred(p.policies[0]))
+        elif isinstance(p, parallel) or isinstance(p, sequential):
+            op = 'or' if isinstance(p, parallel) else 'and'
+            n = self.FALSE if op == 'or' else self.TRUE
+            for q in p.policies:
+                if not isinstance(q, Filter):
+                    raise TypeError("FDDs only represent filters")
+                n = self.apply(op, n, self.from_pred(q))
+            return n
+        elif isinstance(p, DerivedPolicy) and isinstance(p, Filter):
+            return self.from_pred(p.policy)
+        else:
+            raise TypeError("FDDs only represent filters")
+
+    def get_overlap_mode(self, pred, new_pred):
+        """ classifier_utils.get_overlap_mode, on the FDDs of two predicates.
+        """
+        pred_only = self.diff(pred, new_pred)
+        new_only = self.diff(new_pred, pred)
+        (is_equal,is_superset,is_subset,intersects) = (False,False,False,False)
+        if pred_only == self.FALSE and new_only == self.FALSE:
+            is_equal = True
+        elif new_only == self.FALSE:
+            is_superset = True
+        elif pred_only == self.FALSE:
+            is_subset = True
+        elif self.apply('and', pred, new_pred) != self.FALSE:
+            intersects = True
+        return (is_equal, is_superset, is_subset, intersects)
+
+
 class re_tree_gen(object):
     """ A class that provides utilities to book-keep "leaf-level" predicates in
     a regular expression abstract syntax tree (AST), and return new re_deriv
@@ -154,6 +334,12 @@ class re_tree_gen(object):
     pred_to_atoms  = {}
     symbol_to_pred = {}
     dyn_preds      = []
+    # Per symbol, the atoms (same lists as in pred_to_atoms) and the FDD of its
+    # predicate in `space` (None if the predicate has no FDD). Looking these up
+    # by symbol avoids hashing predicates, which hashes their repr.
+    symbol_to_atoms = {}
+    symbol_to_fdd   = {}
+    space = pred_space()
 
     @classmethod
     def repr_state(cls):
@@ -170,13 +356,15 @@ class re_tree_gen(object):
         return output
 
     @classmethod
-    def __add_pred__(cls, pred, symbol, atoms):
+    def __add_pred__(cls, pred, symbol, atoms, fdd=None):
         """ Add a new predicate to the global state. """
         assert not pred in cls.pred_to_symbol
         assert not pred in cls.pred_to_atoms
         cls.pred_to_symbol[pred] = symbol
         cls.pred_to_atoms[pred] = atoms
         cls.symbol_to_pred[symbol] = pred
+        cls.symbol_to_atoms[symbol] = atoms
+        cls.symbol_to_fdd[symbol] = fdd
 
     @classmethod
     def __add_dyn_preds__(cls, preds, atom):
@@ -191,6 +379,8 @@ class re_tree_gen(object):
         predicates. """
         sym = cls.pred_to_symbol[pred]
         del cls.symbol_to_pred[sym]
+        del cls.symbol_to_atoms[sym]
+        del cls.symbol_to_fdd[sym]
         del cls.pred_to_symbol[pred]
         del cls.pred_to_atoms[pred]
 
@@ -204,10 +394,10 @@ class re_tree_gen(object):
             return unichr(cls.token)
 
     @classmethod
-    def __replace_pred__(cls, old_pred, new_preds):
-        """ Replace the re symbol corresponding to `old_pred` with an
-        alternation of predicates in `new_preds`. The metadata from the
-        old_pred's re symbol is copied over to all leaf nodes of its new re AST.
+    def __replace_pred__(cls, old_sym, new_syms):
+        """ Replace the re symbol `old_sym` with an alternation of the symbols
+        `new_syms` of other predicates. The metadata from the old re symbol is
+        copied over to all leaf nodes of its new re AST.
         """
         def new_metadata_tree(m, re_tree):
             """ Return a new tree which has a given metadata m on all nodes in
@@ -241,17 +431,14 @@ class re_tree_gen(object):
             else:
                 raise TypeError("Trees are only allowed to have alternation!")
 
-        assert old_pred in cls.pred_to_symbol and old_pred in cls.pred_to_atoms
-        old_sym = cls.pred_to_symbol[old_pred]
+        assert old_sym in cls.symbol_to_pred
         new_re_tree = re_empty()
         # Construct replacement tree (without metadata first)
-        for pred in new_preds:
-            assert pred in cls.pred_to_symbol
-            assert pred in cls.pred_to_atoms
-            new_sym = cls.pred_to_symbol[pred]
+        for new_sym in new_syms:
+            assert new_sym in cls.symbol_to_pred
             new_re_tree = new_re_tree | re_symbol(new_sym)
         # For each atom containing old_pred, replace re leaf by new tree.
-        for at in cls.pred_to_atoms[old_pred]:
+        for at in cls.symbol_to_atoms[old_sym]:
             new_atom_re_tree = replace_node(at.re_tree, new_re_tree, old_sym)
             at.re_tree = new_atom_re_tree # change the atom objects themselves!
 
@@ -260,20 +447,43 @@ class re_tree_gen(object):
         """ Deal with existing leaf-level predicates, taking different actions
         based on whether the existing predicates are equal, superset, subset, or
         just intersecting, the new predicate.
+
+        Overlaps are computed on the FDDs of the predicates (see pred_space),
+        falling back to compiling classifiers for predicates that have none.
         """
         assert isinstance(at, abstract_atom)
         assert isinstance(new_pred, Filter)
 
-        ne_inters   = classifier_utils.has_nonempty_intersection
-        is_not_drop = classifier_utils.is_not_drop
+        space = cls.space
         add_pred = cls.__add_pred__
         new_sym  = re_tree_gen.__new_symbol__
         del_pred = cls.__del_pred__
         replace_pred = cls.__replace_pred__
-        ovlap = classifier_utils.get_overlap_mode
+
+        def ovlap(pred, pred_fdd, new_pred, new_fdd):
+            if pred_fdd is None or new_fdd is None:
+                return classifier_utils.get_overlap_mode(pred, new_pred)
+            return space.get_overlap_mode(pred_fdd, new_fdd)
+
+        def fdd_op(op, fdd1, fdd2):
+            if fdd1 is None or fdd2 is None:
+                return None
+            elif op == 'diff':
+                return space.diff(fdd1, fdd2)
+            else:
+                return space.apply(op, fdd1, fdd2)
+
+        def is_not_drop(pred, fdd):
+            if fdd is None:
+                return classifier_utils.is_not_drop(pred)
+            return fdd != space.FALSE
 
         re_tree = re_empty()
-        pred_list = cls.pred_to_symbol.keys()
+        pred_list = cls.pred_to_symbol.items()
+        try:
+            new_fdd = space.from_pred(new_pred)
+        except TypeError:
+            new_fdd = None
 
         """ Record dynamic predicates separately for update purposes."""
         dyn_pols = path_policy_utils.get_dyn_pols(new_pred)
@@ -285,44 +495,52 @@ class re_tree_gen(object):
         """ For each case of overlap between new and existing predicates, do
         actions that will only retain and keep track of non-overlapping
         pieces. """
-        for pred in pred_list:
-            assert pred in cls.pred_to_atoms
-            pred_atoms = cls.pred_to_atoms[pred]
-            pred_symbol = cls.pred_to_symbol[pred]
-            (is_equal,is_superset,is_subset,intersects) = ovlap(pred, new_pred)
+        for (pred, pred_symbol) in pred_list:
+            pred_atoms = cls.symbol_to_atoms[pred_symbol]
+            pred_fdd = cls.symbol_to_fdd[pred_symbol]
+            (is_equal,is_superset,is_subset,intersects) = ovlap(pred, pred_fdd,
+                                                                new_pred,
+                                                                new_fdd)
             if is_equal:
                 pred_atoms.append(at)
                 re_tree |= re_symbol(pred_symbol, metadata=at)
                 return re_tree
             elif is_superset:
-                add_pred(pred & ~new_pred, new_sym(), pred_atoms)
-                add_pred(new_pred, new_sym(), pred_atoms + [at])
-                replace_pred(pred, [pred & ~new_pred, new_pred])
+                rest_sym = new_sym()
+                add_pred(pred & ~new_pred, rest_sym, pred_atoms,
+                         fdd_op('diff', pred_fdd, new_fdd))
+                added_sym = new_sym()
+                add_pred(new_pred, added_sym, pred_atoms + [at], new_fdd)
+                replace_pred(pred_symbol, [rest_sym, added_sym])
                 del_pred(pred)
-                added_sym = cls.pred_to_symbol[new_pred]
                 re_tree |= re_symbol(added_sym, metadata=at)
                 return re_tree
             elif is_subset:
                 new_pred = new_pred & ~pred
+                new_fdd = fdd_op('diff', new_fdd, pred_fdd)
                 pred_atoms.append(at)
                 re_tree |= re_symbol(pred_symbol, metadata=at)
             elif intersects:
-                add_pred(pred & ~new_pred, new_sym(), pred_atoms)
-                add_pred(pred &  new_pred, new_sym(), pred_atoms + [at])
-                replace_pred(pred, [pred & ~new_pred, pred & new_pred])
+                rest_sym = new_sym()
+                add_pred(pred & ~new_pred, rest_sym, pred_atoms,
+                         fdd_op('diff', pred_fdd, new_fdd))
+                added_sym = new_sym()
+                add_pred(pred & new_pred, added_sym, pred_atoms + [at],
+                         fdd_op('and', pred_fdd, new_fdd))
+                replace_pred(pred_symbol, [rest_sym, added_sym])
                 del_pred(pred)
-                added_sym = cls.pred_to_symbol[pred & new_pred]
                 re_tree |= re_symbol(added_sym, metadata=at)
                 new_pred = new_pred & ~pred
+                new_fdd = fdd_op('diff', new_fdd, pred_fdd)
             else:
                 pass
 
-        if is_not_drop(new_pred):
+        if is_not_drop(new_pred, new_fdd):
             """ The new predicate should be added if some part of it doesn't
             intersect any existing predicate, i.e., new_pred is not drop.
             """
-            add_pred(new_pred, new_sym(), [at])
-            added_sym = cls.pred_to_symbol[new_pred]
+            added_sym = new_sym()
+            add_pred(new_pred, added_sym, [at], new_fdd)
             re_tree |= re_symbol(added_sym, metadata=at)
 
         return re_tree
@@ -335,6 +553,9 @@ class re_tree_gen(object):
         cls.pred_to_atoms   = {}
         cls.symbol_to_pred  = {}
         cls.dyn_preds       = []
+        cls.symbol_to_atoms = {}
+        cls.symbol_to_fdd   = {}
+        cls.space = pred_space()
 
     @classmethod
     def get_symlist(cls):
@@ -344,9 +565,9 @@ class re_tree_gen(object):
     @classmethod
     def get_leaf_preds(cls):
         """ Get a string representation of all leaf-level predicates in the
-        structure. """
+        structure, in the order of their symbols. """
         output = ''
-        for sym in cls.symbol_to_pred:
+        for sym in sorted(cls.symbol_to_pred):
             pred = cls.symbol_to_pred[sym]
             output += (sym + ': ' + repr(pred) + '\n')
         return output
@@ -1081,9 +1302,14 @@ class pathcomp(object):
         __out_re_tree_gen__.clear()
 
     @classmethod
-    def compile(cls, path_pol, max_states=1022):
+    def compile(cls, path_pol, max_states=1022, minimize=True):
         """ Compile the list of paths along with the forwarding policy `fwding`
         into a single classifier to be installed on switches.
+
+        :param max_states: the number of path tag values available
+        :type max_states: int
+        :param minimize: whether to minimize the DFA before generating rules
+        :type minimize: bool
         """
         du = dfa_utils
         in_cg = __in_re_tree_gen__
@@ -1099,7 +1325,7 @@ class pathcomp(object):
         ast_fold(path_pol, inv_trees, None)
         ast_fold(path_pol, prep_trees, None)
         (re_list, pol_list) = ast_fold(path_pol, re_pols, ([], []))
-        dfa = du.regexes_to_dfa(re_list)
+        dfa = du.regexes_to_dfa(re_list, minimize=minimize)
         assert du.get_num_states(dfa) <= max_states
         match_tag = lambda q: cls.__match_tag__(dfa, q)
         set_tag   = lambda q: cls.__set_tag__(dfa, q)
@@ -1117,12 +1343,15 @@ class pathcomp(object):
         in_capture = drop
         out_capture = drop
 
-        """ Generate transition/accept rules from DFA """
-        edges = du.get_edges(dfa)
-        for edge in edges:
-            src = du.get_edge_src(dfa, edge)
-            dst = du.get_edge_dst(dfa, edge)
-            (pred, typ) = get_pred(edge)
+        """ Generate transition/accept rules from DFA. When minimizing, emit
+        one rule for all the edges of an atom type between the same pair of
+        states. """
+        if minimize:
+            edges = du.get_merged_edges(dfa, get_pred)
+        else:
+            edges = [(du.get_edge_src(dfa, e), du.get_edge_dst(dfa, e)) +
+                     get_pred(e) for e in du.get_edges(dfa)]
+        for (src, dst, pred, typ) in edges:
             assert typ in [__in__, __out__]
             if not du.is_dead(dfa, src):
                 tag_frag = ((match_tag(src) & pred) >> set_tag(dst))
@@ -1378,7 +1607,30 @@ class pathcomp(object):
 #############################################################################
 
 class dfa_utils(object):
-    """ Utilities to generate DFAs and access various properties. """
+    """ Utilities to generate DFAs and access various properties.
+
+    Compiled DFAs are cached, keyed by a digest of the regular expressions, the
+    symbol list and the predicate of each symbol. The last MEM_CACHE_SIZE DFAs
+    are kept in memory and, unless cache_dir is None, all of them in JSON
+    files under cache_dir, so that they survive restarts. cache_dir is created
+    private to the current user, and is not used unless the user owns it and
+    nobody else can write to it. On a hit, regexes_to_dfa returns a
+    table_dfa, which has the same states (and state indices) and transitions
+    as the DFA it was made from, but no transition metadata.
+
+    The DFA and leaf-level predicates are also dumped to /tmp for debugging,
+    from a background thread, unless dump_files is False.
+    """
+    CACHE_VERSION = 1 # bump when the DFA construction changes
+    MEM_CACHE_SIZE = 256
+    cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'pyretic')
+    dump_files = True
+    mem_cache = util.LRUCache(MEM_CACHE_SIZE)
+    cache_hits = 0
+    cache_misses = 0
+    dump_lock = threading.Lock()
+    log = logging.getLogger('%s.dfa_utils' % __name__)
+
     @classmethod
     def print_dfa(cls, d):
         """ Print a DFA object d. """
@@ -1420,6 +1672,33 @@ class dfa_utils(object):
         c = cls.get_edge_label(tt_entry)
         return d.transition_table.get_metadata(q, c)
 
+    @classmethod
+    def get_merged_edges(cls, d, get_pred):
+        """ Group the edges of DFA d by source state, destination state and
+        atom type, and return a list of (src, dst, pred, typ) tuples in the
+        order of the edges, where pred is the union of the edge predicates in
+        the group.
+
+        :param get_pred: returns the (predicate, atom type) of an edge
+        :type get_pred: edge -> (Filter, type)
+        """
+        groups = {}
+        order = []
+        for edge in cls.get_edges(d):
+            (pred, typ) = get_pred(edge)
+            key = (cls.get_edge_src(d, edge), cls.get_edge_dst(d, edge), typ)
+            if key in groups:
+                groups[key].append(pred)
+            else:
+                groups[key] = [pred]
+                order.append(key)
+        merged = []
+        for key in order:
+            preds = groups[key]
+            pred = preds[0] if len(preds) == 1 else union(preds)
+            merged.append((key[0], key[1], pred, key[2]))
+        return merged
+
     @classmethod
     def get_state_index(cls, d, q):
         assert isinstance(d, dfa_base)
@@ -1451,7 +1730,8 @@ class dfa_utils(object):
     @classmethod
     def get_accepting_exps(cls, d, q):
         assert isinstance(d, dfa_base) # dfa object
-        assert isinstance(d.all_states, re_vector_state_table)
+        assert isinstance(d.all_states, (re_vector_state_table,
+                                         table_state_table))
         assert cls.is_accepting(d, q)
         return d.all_states.get_accepting_exps_ordinal(q)
 
@@ -1491,16 +1771,145 @@ class dfa_utils(object):
         f.close()
 
     @classmethod
-    def regexes_to_dfa(cls, re_exps, symlist=None):
-        """ Convert a list of regular expressions to a DFA. """
+    def __dump_files__(cls, dfa, leaf_preds):
+        """ Dump the DFA and the leaf-level predicates for debugging, in a
+        background thread. """
+        def dump():
+            with cls.dump_lock:
+                try:
+                    cls.__dump_file__(dfa.dot_repr(),
+                                      '/tmp/pyretic-regexes.txt.dot')
+                    cls.__dump_file__(leaf_preds, '/tmp/symbols.txt')
+                except Exception as e:
+                    cls.log.warn("Couldn't dump DFA: %s" % e)
+        t = threading.Thread(target=dump)
+        t.daemon = True
+        t.start()
+
+    @classmethod
+    def __cache_key__(cls, re_exps, symlist, leaf_preds, minimize):
+        """ Digest of everything the DFA of re_exps depends on. """
+        h = hashlib.sha1()
+        h.update('%d %s\n' % (cls.CACHE_VERSION, minimize))
+        h.update(''.join(symlist) + '\n')
+        for r in re_exps:
+            h.update(r.re_string_repr() + '\n')
+        h.update(leaf_preds)
+        return h.hexdigest()
+
+    @classmethod
+    def __private_cache_dir__(cls):
+        """ cache_dir, created if needed, or None if it isn't private to the
+        current user. """
+        try:
+            if not os.path.isdir(cls.cache_dir):
+                os.makedirs(cls.cache_dir, 0700)
+            st = os.stat(cls.cache_dir)
+        except OSError as e:
+            cls.log.warn("Can't use DFA cache directory %s: %s" %
+                         (cls.cache_dir, e))
+            return None
+        if (st.st_uid != os.getuid() or
+            st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+            cls.log.warn("Not using DFA cache directory %s: not private to "
+                         "the current user" % cls.cache_dir)
+            return None
+        return cls.cache_dir
+
+    @classmethod
+    def __table_to_json__(cls, table):
+        """ table, with symbols (which may be raw bytes) as code points. """
+        stored = dict(table)
+        stored['edges'] = [ (src, dst, ord(c))
+                            for (src, dst, c) in table['edges'] ]
+        stored['symbols'] = [ ord(c) for c in table['symbols'] ]
+        return stored
+
+    @classmethod
+    def __table_from_json__(cls, stored):
+        """ The table __table_to_json__ made stored from. """
+        def symbol(n):
+            # as __new_symbol__ makes them
+            return chr(n) if n < 256 else unichr(n)
+        table = dict(stored)
+        table['accepting'] = { int(q) : ordinals for (q, ordinals)
+                               in stored['accepting'].items() }
+        table['edges'] = [ (src, dst, symbol(c))
+                           for (src, dst, c) in stored['edges'] ]
+        table['symbols'] = [ symbol(c) for c in stored['symbols'] ]
+        return table
+
+    @classmethod
+    def __cache_lookup__(cls, key):
+        """ Return the cached table for key, or None. """
+        table = cls.mem_cache.get(key)
+        if table is not None:
+            cls.log.info("DFA cache hit (memory): %s" % key)
+            return table
+        if cls.cache_dir is None:
+            return None
+        cache_dir = cls.__private_cache_dir__()
+        if cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(cache_dir, key), 'rb') as f:
+                table = cls.__table_from_json__(json.load(f))
+        except IOError:
+            return None
+        except Exception as e:
+            cls.log.warn("Ignoring unreadable DFA cache entry %s: %s" %
+                         (key, e))
+            return None
+        cls.log.info("DFA cache hit (disk): %s" % key)
+        cls.mem_cache.put(key, table)
+        return table
+
+    @classmethod
+    def __cache_store__(cls, key, table):
+        """ Cache table under key, writing the file atomically. """
+        cls.mem_cache.put(key, table)
+        if cls.cache_dir is None:
+            return
+        cache_dir = cls.__private_cache_dir__()
+        if cache_dir is None:
+            return
+        try:
+            (fd, tmp) = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(cls.__table_to_json__(table), f)
+            os.rename(tmp, os.path.join(cache_dir, key))
+        except (IOError, OSError) as e:
+            cls.log.warn("Couldn't write DFA cache entry %s: %s" % (key, e))
+
+    @classmethod
+    def clear_cache(cls):
+        """ Empty the in-memory cache (files under cache_dir are kept). """
+        cls.mem_cache.clear()
+        cls.cache_hits = 0
+        cls.cache_misses = 0
+
+    @classmethod
+    def regexes_to_dfa(cls, re_exps, symlist=None, minimize=False):
+        """ Convert a list of regular expressions to a DFA, optionally
+        minimized, or fetch it from the cache. """
         assert reduce(lambda acc, x: acc and isinstance(x, re_deriv),
                       re_exps, True)
         if not symlist:
             symlist = (__in_re_tree_gen__.get_symlist() +
                        __out_re_tree_gen__.get_symlist())
-        dfa = makeDFA_vector(re_exps, symlist)
-        cls.__dump_file__(dfa.dot_repr(), '/tmp/pyretic-regexes.txt.dot')
         leaf_preds = (__in_re_tree_gen__.get_leaf_preds() +
                       __out_re_tree_gen__.get_leaf_preds())
-        cls.__dump_file__(leaf_preds, '/tmp/symbols.txt')
+        key = cls.__cache_key__(re_exps, symlist, leaf_preds, minimize)
+        table = cls.__cache_lookup__(key)
+        if table is not None:
+            cls.cache_hits += 1
+            dfa = table_dfa(table)
+        else:
+            cls.cache_misses += 1
+            dfa = makeDFA_vector(re_exps, symlist)
+            if minimize:
+                dfa = minimize_dfa_vector(dfa)
+            cls.__cache_store__(key, dfa_to_table(dfa))
+        if cls.dump_files:
+            cls.__dump_files__(dfa, leaf_preds)
         return dfa
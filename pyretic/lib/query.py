@@ -26,27 +26,73 @@
 # permissions and limitations under the License.                               #
 ################################################################################
 
-from pyretic.core.language import identity, match, union, DerivedPolicy, DynamicFilter, Query, FwdBucket, CountBucket, DynamicPolicy
+from pyretic.core.language import identity, drop, match, union, lookup, DerivedPolicy, DynamicFilter, Query, FwdBucket, CountBucket, GroupedCountBucket, DynamicPolicy
 import time
 import copy
 import re
-from threading import Thread
+from collections import OrderedDict
+import threading
 from multiprocessing import Lock
 
+class PolledQuery(object):
+    """Mixin for queries that run periodically while they are part of a
+    running policy. The runtime hands them its poll scheduler when they join
+    its policy, and takes it back when they leave it."""
+    def set_up_polling(self, interval, fun):
+        """Call fun every `interval` seconds once attached to a runtime. If
+        interval is None, the application needs to call fun directly."""
+        self.interval = interval
+        self.poll_fun = fun
+        self.poller = None
+
+    def set_poll_scheduler(self, poller):
+        """Move the periodic query to poller, or stop it if poller is None.
+
+        :param poller: the poll scheduler of the runtime running the query
+        :type poller: PollScheduler or None
+        """
+        if poller is self.poller:
+            return
+        if self.poller is not None and self.interval:
+            self.poller.unregister(self.interval, self.poll_fun)
+        self.poller = poller
+        if self.poller is not None and self.interval:
+            self.poller.register(self.interval, self.poll_fun)
+
+
 class LimitFilter(DynamicFilter):
     """A DynamicFilter that matches the first limit packets in a specified grouping.
 
+    Groupings that reached the limit are kept in a lookup table, which drops
+    their packets in a single dict lookup, and compiles to one rule per
+    grouping above a catch-all identity rule. Optionally, groupings are
+    forgotten after a while, so that long-running filters don't grow forever:
+    once forgotten, a grouping's packets are matched (and counted towards the
+    limit) again.
+
     :param limit: the number of packets to be matched in each grouping.
     :type limit: int
     :param group_by: the fields by which to group packets.
     :type group_by: list string
+    :param max_groups: if set, the most groupings tracked, both partly
+        counted and done; the oldest are forgotten first.
+    :type max_groups: int
+    :param timeout: if set, seconds after which a grouping that reached the
+        limit is forgotten, by a timer: packets of done groupings are dropped
+        on the switches and never reach the filter.
+    :type timeout: float
     """
-    def __init__(self,limit=None,group_by=[]):
+    def __init__(self,limit=None,group_by=[],max_groups=None,timeout=None):
         self.limit = limit
         self.group_by = group_by
-        self.seen = {}
-        self.done = []
-        super(LimitFilter,self).__init__(identity)
+        self.max_groups = max_groups
+        self.timeout = timeout
+        self.seen = OrderedDict()  # grouping -> packets matched so far
+        self.done = OrderedDict()  # grouping -> time it reached the limit
+        self.done_table = lookup(group_by, identity)
+        self.lock = threading.Lock()
+        self.timer = None
+        super(LimitFilter,self).__init__(self.done_table)
 
     def get_pred_from_pkt(self, pkt):
         if self.group_by:    # MATCH ON PROVIDED GROUP_BY
@@ -55,18 +101,101 @@ class LimitFilter(DynamicFilter):
             return match([(field,pkt[field])
                               for field in pkt.available_fields()])
 
+    def get_key_from_pkt(self, pkt):
+        if self.group_by:
+            return tuple(pkt[field] for field in self.group_by)
+        else:
+            return pkt.header
+
     def update_policy(self,pkt):
-        pred = self.get_pred_from_pkt(pkt)
-        # INCREMENT THE NUMBER OF TIMES MATCHING PKT SEEN
-        try:
-            self.seen[pred] += 1
-        except KeyError:
-            self.seen[pred] = 1
-
-        if self.seen[pred] == self.limit:
-            val = {h : pkt[h] for h in self.group_by}
-            self.done.append(match(val))
-            self.policy = ~union(self.done)
+        key = self.get_key_from_pkt(pkt)
+        # without group_by, every packet belongs to the same grouping once
+        # the limit is reached
+        done_key = key if self.group_by else ()
+        with self.lock:
+            changed = self.expire()
+            if not done_key in self.done:
+                # INCREMENT THE NUMBER OF TIMES MATCHING PKT SEEN
+                count = self.seen.pop(key, 0) + 1
+                if count < self.limit:
+                    self.seen[key] = count
+                else:
+                    self.done[done_key] = time.time()
+                    self.done_table[done_key] = drop
+                    changed = True
+                    self.schedule_expiry()
+                changed = self.evict() or changed
+            table = self.done_table
+        if changed:
+            self.policy = table
+
+    def evict(self):
+        """
+        Forget the oldest groupings until at most max_groups are tracked,
+        partly counted ones first.
+
+        :returns: whether any grouping that reached the limit was forgotten
+        :rtype: bool
+        """
+        if self.max_groups is None:
+            return False
+        evicted = False
+        while len(self.seen) + len(self.done) > self.max_groups:
+            if self.seen:
+                self.seen.popitem(last=False)
+            else:
+                self.forget_done()
+                evicted = True
+        return evicted
+
+    def forget_done(self):
+        (key, _) = self.done.popitem(last=False)
+        del self.done_table[key]
+
+    def expire(self, now=None):
+        """
+        Forget the groupings that reached the limit more than timeout
+        seconds ago.
+
+        :returns: whether any grouping was forgotten
+        :rtype: bool
+        """
+        if self.timeout is None or not self.done:
+            return False
+        if now is None:
+            now = time.time()
+        expired = False
+        while self.done and next(self.done.itervalues()) <= now - self.timeout:
+            self.forget_done()
+            expired = True
+        return expired
+
+    def schedule_expiry(self):
+        """Start a timer for the expiry of the oldest done grouping, unless
+        one is running. Called with self.lock held."""
+        if self.timeout is None or not self.done or self.timer is not None:
+            return
+        delay = next(self.done.itervalues()) + self.timeout - time.time()
+        self.timer = threading.Timer(max(delay, 0), self.expiry_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def expiry_timer(self):
+        """Forget expired groupings and push the changed policy. The runtime
+        may be compiling the current table meanwhile, so expired groupings
+        are removed from a copy."""
+        with self.lock:
+            self.timer = None
+            table = self.done_table
+            self.done_table = lookup(self.group_by, identity,
+                                     table.table.items())
+            changed = self.expire()
+            if not changed:
+                self.done_table = table
+            table = self.done_table
+            self.schedule_expiry()
+        if changed:
+            self.policy = table
 
     def __repr__(self):
         return "LimitFilter\n%s" % repr(self.policy)
@@ -79,24 +208,33 @@ class packets(DerivedPolicy):
     :type limit: int
     :param group_by: the fields by which to group packets.
     :type group_by: list string
+    :param max_groups: if set, the most groupings the LimitFilter tracks.
+    :type max_groups: int
+    :param timeout: if set, seconds after which the LimitFilter forgets a
+        grouping that reached the limit.
+    :type timeout: float
     """
-    def __init__(self,limit=None,group_by=[]):
+    def __init__(self,limit=None,group_by=[],max_groups=None,timeout=None):
         self.fb = FwdBucket()
         self.register_callback = self.fb.register_callback
         if limit is None:
             super(packets,self).__init__(self.fb)
         else:
-            self.limit_filter = LimitFilter(limit,group_by)
+            self.limit_filter = LimitFilter(limit,group_by,max_groups,timeout)
             self.fb.register_callback(self.limit_filter.update_policy)
             super(packets,self).__init__(self.limit_filter >> self.fb)
         
     def __repr__(self):
         return "packets\n%s" % repr(self.policy)
 
-class counts(DynamicPolicy):
+class counts(DynamicPolicy, PolledQuery):
     """A CountBucket that returns distinct counts per grouping, defined by a set
     of header fields.
 
+    Groupings share a single GroupedCountBucket, reached through a lookup
+    table on the grouping fields, so a new grouping adds one table entry
+    (and its rules) rather than recompiling a union of per-grouping buckets.
+
     :param interval: time period between successive pulls of switch statistics
     :type interval: some float
     :param group_by: list of grouping fields
@@ -105,96 +243,63 @@ class counts(DynamicPolicy):
     def __init__(self, interval=None, group_by=[]):
         self.set_up_policy(group_by)
         self.set_up_stats()
-        self.set_up_polling(interval)
+        self.set_up_polling(interval, self.pull_stats)
 
     def set_up_policy(self, group_by):
         """Setup policy structure and basic callbacks."""
-        self.bucket_policies = []
-        self.groupby_filter = LimitFilter(1,group_by)
+        self.group_by = group_by
+        self.bucket = GroupedCountBucket(group_by)
+        self.bucket.register_callback(self.collect)
         self.fb = FwdBucket() # fb sees first packet of each new grouping
-        self.fb.register_callback(self.groupby_filter.update_policy)
-        self.fb.register_callback(self.init_countbucket)
-        super(counts,self).__init__(self.groupby_filter >> self.fb)
+        self.fb.register_callback(self.init_group)
+        self.table = lookup(group_by, self.fb)
+        super(counts,self).__init__(self.table)
 
     def set_up_stats(self):
         """Setup for pulling stats and related book-keeping."""
         self.callbacks = []
-        self.bucket_dict = {}
-        self.reported_counts = {}
-        self.queried_preds = set([])
-        self.queried_preds_lock = Lock()
-
-    def set_up_polling(self,interval):
-        """Setup polling of stats from switches every `interval` seconds. If
-        interval is None, the application needs to call pull_stats directly."""
-        if interval:
-            self.qt = Thread(target=self.query_thread, args=(interval,))
-            self.qt.daemon = True
-            self.qt.start()
-
-    def query_thread(self, interval):
-        """Thread that calls pull_stats every `interval` seconds."""
-        time.sleep(interval)
-        while True:
-            self.pull_stats()
-            time.sleep(interval)
-
-    def init_countbucket(self, pkt):
-        """When a packet from a previously unseen grouping arrives, set up new
-        count buckets for the same.
-        """
-        pred = self.groupby_filter.get_pred_from_pkt(pkt)
-        cb = CountBucket()
-        cb.register_callback(self.collect_pred(pred))
-        self.bucket_policies.append(pred >> cb)
-        self.bucket_dict[pred] = cb
-        # Send the current packet to the new countbucket
-        cb.eval(pkt)
-        cb.apply()
-        # In future, send all packets of this grouping directly to this bucket
-        self.policy = ((self.groupby_filter >> self.fb) +
-                       union(self.bucket_policies))
-
-    def collect_pred(self, pred):
-        """Return a callback function specific to each grouping predicate."""
-        def collect(pkt_byte_counts):
-            with self.queried_preds_lock:
-                if pred in self.queried_preds:
-                    self.reported_counts[pred.map] = pkt_byte_counts
-                    self.queried_preds.remove(pred)
-            self.call_callbacks()
-        return collect
-
-    def call_callbacks(self):
-        """Check if all queried buckets have returned, and if so, call the
-        callbacks.
+        self.preds = {}
+
+    def init_group(self, pkt):
+        """When a packet from a previously unseen grouping arrives, start
+        counting the grouping.
         """
-        if not self.queried_preds:
-            for f in self.callbacks:
-                f(self.reported_counts)
+        group = self.table.normalize_key(tuple(pkt[field]
+                                               for field in self.group_by))
+        if not group in self.preds:
+            self.preds[group] = match([(field,pkt[field])
+                                       for field in self.group_by])
+            self.bucket.add_group(group)
+            # In future, send all packets of this grouping directly to the
+            # bucket
+            self.table[group] = self.bucket
+            self.policy = self.table
+        # Count the current packet (and any that reached the controller
+        # before the grouping's rules were installed)
+        self.bucket.eval(pkt)
+        self.bucket.apply()
+
+    def collect(self, group_counts):
+        """Report the bucket's counts per grouping predicate."""
+        reported_counts = { self.preds[group].map : pkt_byte_counts
+                            for (group, pkt_byte_counts)
+                            in group_counts.iteritems() }
+        for f in self.callbacks:
+            f(reported_counts)
 
     def register_callback(self, fn):
         self.callbacks.append(fn)
 
     def pull_stats(self):
-        """Pulls statistics from the switches corresponding to all groupings."""
-        buckets_list = []
-        with self.queried_preds_lock:
-            self.queried_preds = set(copy.deepcopy(self.bucket_dict.keys()))
-            self.reported_counts = {}
-            for pred in self.queried_preds:
-                buckets_list.append(self.bucket_dict[pred])
-        # Calling pull_stats while holding the lock creates a potential deadlock
-        for bucket in buckets_list:
-            bucket.pull_stats()
-        # call callbacks in case no preds were queried in the first place
-        self.call_callbacks()
+        """Pulls statistics from the switches corresponding to all groupings,
+        with one query per switch."""
+        self.bucket.pull_stats()
 
     def __repr__(self):
         return "counts\n%s" % repr(self.policy)
 
 
-class AggregateFwdBucket(FwdBucket):
+class AggregateFwdBucket(FwdBucket, PolledQuery):
     """An abstract FwdBucket which calls back all registered routines every interval
     seconds (can take positive fractional values) with an aggregate value/dict.
     If group_by is empty, registered routines are called back with a single aggregate
@@ -203,22 +308,17 @@ class AggregateFwdBucket(FwdBucket):
     ### init : int -> List String
     def __init__(self, interval, group_by=[]):
         FwdBucket.__init__(self)
-        self.interval = interval
+        self.set_up_polling(interval, self.report)
         self.group_by = group_by
         if group_by:
             self.aggregate = {}
         else:
             self.aggregate = 0
-        
-        def report_count(callbacks,aggregate,interval):
-            while(True):
-                for callback in callbacks:
-                    callback(aggregate)
-                time.sleep(interval)
-
-        self.query_thread = Thread(target=report_count,args=(self.callbacks,self.aggregate,self.interval))
-        self.query_thread.daemon = True
-        self.query_thread.start()
+
+    def report(self):
+        """Call back all registered routines with the current aggregate."""
+        for callback in self.callbacks:
+            callback(self.aggregate)
 
     def aggregator(self,aggregate,pkt):
         raise NotImplementedError
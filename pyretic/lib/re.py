@@ -45,6 +45,45 @@ KEY_STAR    = -5
 KEY_INTERS  = -6
 KEY_NEGATE  = -7
 
+# Derivatives are memoized per (expression, symbol), up to this many entries
+DERIV_CACHE_SIZE = 1 << 18
+# Shapes are interned up to this many; past it, they are renumbered (see
+# reset_shapes)
+SHAPE_CACHE_SIZE = 1 << 20
+
+# Hash-consing of expression structure: every structurally distinct expression
+# gets a unique integer "shape", so that equality and hashing of expressions do
+# not walk their trees. Nodes themselves are not shared, since the leaves of
+# equal expressions may carry different metadata.
+re_shapes = {}
+re_hashes = {} # shape -> hash of the expression's string representation
+# Bumped whenever shapes are renumbered; expressions recompute shapes from an
+# older generation.
+shape_generation = 0
+
+def re_shape(key):
+    """ Return the unique shape of the expression with the structural key
+    `key`, a tuple of a sort key and either a symbol or the shapes of the
+    sub-expressions. """
+    try:
+        return re_shapes[key]
+    except KeyError:
+        return re_shapes.setdefault(key, len(re_shapes))
+
+def reset_shapes(force=False):
+    """ Drop the interned shapes, and every cache keyed by them, once there
+    are SHAPE_CACHE_SIZE of them (or always, if `force`). Existing
+    expressions are renumbered lazily, so this must only be called between
+    operations that hold on to shapes, as makeDFA does on entry. """
+    global shape_generation
+    if not force and len(re_shapes) < SHAPE_CACHE_SIZE:
+        return
+    re_shapes.clear()
+    re_hashes.clear()
+    is_nullable.cache.clear()
+    deriv.cache.clear()
+    shape_generation += 1
+
 # Data type definitions
 # These are basic elements to be used by applications to construct regular
 # expressions, with various combinators that invoke smart constructors that
@@ -77,12 +116,44 @@ class re_deriv(object):
         class should override this method."""
         raise NotImplementedError
 
+    def shape_key(self):
+        """ The structural key of the expression, from which its shape is
+        interned. Each child class should override this method."""
+        raise NotImplementedError
+
+    @property
+    def shape(self):
+        try:
+            (generation, shape) = self._shape
+            if generation == shape_generation:
+                return shape
+        except AttributeError:
+            pass
+        shape = re_shape(self.shape_key())
+        self._shape = (shape_generation, shape)
+        return shape
+
     def __hash__(self):
-        return hash(self.re_string_repr())
+        # hash the string representation, as before hash-consing, so that
+        # tables of states keep iterating in the same order. It is computed
+        # once per shape.
+        shape = self.shape
+        try:
+            return re_hashes[shape]
+        except KeyError:
+            h = re_hashes[shape] = hash(self.re_string_repr())
+            return h
 
     def __eq__(self, other):
-        """ Each child class should override this method. """
-        raise NotImplementedError
+        """ Structural equality, ignoring metadata. """
+        return self is other or (isinstance(other, re_deriv) and
+                                 self.shape == other.shape)
+
+    def __getstate__(self):
+        # shapes are only unique within a process
+        state = self.__dict__.copy()
+        state.pop('_shape', None)
+        return state
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -145,12 +216,12 @@ class re_epsilon(re_base):
     def __init__(self, metadata=None, lst=True):
         super(re_epsilon, self).__init__(metadata, lst)
 
-    def __eq__(self, other):
-        return isinstance(other, re_epsilon)
-
     def sort_key(self):
         return KEY_EPSILON
 
+    def shape_key(self):
+        return (KEY_EPSILON,)
+
     def re_string_repr(self):
         return "epsilon"
 
@@ -159,12 +230,12 @@ class re_empty(re_base):
     def __init__(self, metadata=None, lst=True):
         super(re_empty, self).__init__(metadata, lst)
 
-    def __eq__(self, other):
-        return isinstance(other, re_empty)
-
     def sort_key(self):
         return KEY_EMPTY
 
+    def shape_key(self):
+        return (KEY_EMPTY,)
+
     def re_string_repr(self):
         return "phi"
 
@@ -174,13 +245,12 @@ class re_symbol(re_base):
         super(re_symbol, self).__init__(metadata, lst)
         self.char = char
 
-    def __eq__(self, other):
-        return (isinstance(other, re_symbol) and
-                other.char == self.char)
-
     def sort_key(self):
         return ord(self.char)
 
+    def shape_key(self):
+        return (self.char,)
+
     def re_string_repr(self):
         return self.char
 
@@ -194,6 +264,9 @@ class re_combinator(re_deriv):
         self.re_list = re_list
         super(re_combinator, self).__init__()
 
+    def shape_key(self):
+        return (self.sort_key(),) + tuple(r.shape for r in self.re_list)
+
     def equals_meta_structural(self, other):
         """ Return True if the other re equals self including metadata
         (structurally), otherwise False.
@@ -224,12 +297,6 @@ class re_concat(re_combinator):
         self.re2 = re2
         super(re_concat, self).__init__([re1, re2])
 
-    def __eq__(self, other):
-        return (isinstance(other, re_concat) and
-                self.re1 == other.re1 and
-                self.re2 == other.re2 and
-                self.re_list == other.re_list)
-
     def sort_key(self):
         return KEY_CONCAT
 
@@ -246,10 +313,6 @@ class re_alter(re_combinator):
     def __init__(self, re_list):
         super(re_alter, self).__init__(re_list)
 
-    def __eq__(self, other):
-        return (isinstance(other, re_alter) and
-                self.re_list == other.re_list)
-
     def sort_key(self):
         return KEY_ALTER
 
@@ -267,11 +330,6 @@ class re_star(re_combinator):
         self.re = re
         super(re_star, self).__init__([re])
 
-    def __eq__(self, other):
-        return (isinstance(other, re_star) and
-                self.re == other.re and
-                self.re_list == other.re_list)
-
     def sort_key(self):
         return KEY_STAR
 
@@ -286,10 +344,6 @@ class re_inters(re_combinator):
     def __init__(self, re_list):
         super(re_inters, self).__init__(re_list)
 
-    def __eq__(self, other):
-        return (isinstance(other, re_inters) and
-                self.re_list == other.re_list)
-
     def sort_key(self):
         return KEY_INTERS
 
@@ -307,11 +361,6 @@ class re_negate(re_combinator):
         self.re = re
         super(re_negate, self).__init__([re])
 
-    def __eq__(self, other):
-        return (isinstance(other, re_negate) and
-                self.re == other.re and
-                self.re_list == other.re_list)
-
     def sort_key(self):
         return KEY_NEGATE
 
@@ -329,40 +378,34 @@ def nullable(r):
     :param r: the regex which is tested.
     :type r: re_deriv
     """
-    def bool_to_re(b):
-        return re_epsilon() if b else re_empty()
-    def re_to_bool(r):
-        if isinstance(r, re_epsilon):
-            return True
-        elif isinstance(r, re_empty):
-            return False
-        else:
-            raise TypeError('re_to_bool expects re_epsilon or re_empty')
-    
     assert isinstance(r, re_deriv)
-    if isinstance(r, re_epsilon):
-        return re_epsilon()
-    elif isinstance(r, re_symbol):
-        return re_empty()
-    elif isinstance(r, re_empty):
-        return re_empty()
+    return re_epsilon() if is_nullable(r) else re_empty()
+
+def is_nullable(r):
+    """ Return True if a regular expression r matches the empty string. The
+    result is memoized by the shape of r. """
+    try:
+        return is_nullable.cache[r.shape]
+    except KeyError:
+        pass
+    if isinstance(r, re_epsilon) or isinstance(r, re_star):
+        n = True
+    elif isinstance(r, re_symbol) or isinstance(r, re_empty):
+        n = False
     elif isinstance(r, re_concat):
-        f = lambda x: re_to_bool(nullable(x))
-        return bool_to_re(f(r.re1) and f(r.re2))
+        n = is_nullable(r.re1) and is_nullable(r.re2)
     elif isinstance(r, re_alter):
-        return bool_to_re(reduce(lambda acc, s: acc or re_to_bool(nullable(s)),
-                                 r.re_list,
-                                 False))
-    elif isinstance(r, re_star):
-        return re_epsilon()
+        n = any(is_nullable(s) for s in r.re_list)
     elif isinstance(r, re_inters):
-        return bool_to_re(reduce(lambda acc, s: acc and re_to_bool(nullable(s)),
-                                 r.re_list,
-                                 True))
+        n = all(is_nullable(s) for s in r.re_list)
     elif isinstance(r, re_negate):
-        return bool_to_re(not re_to_bool(nullable(r.re)))
+        n = not is_nullable(r.re)
     else:
         raise TypeError('unexpected type for nullable!')
+    is_nullable.cache[r.shape] = n
+    return n
+
+is_nullable.cache = {}
 
 # Smart constructors, which enforce some useful representation invariants in the regular
 # expressions they construct. In particular, the RE is flattened out as much as
@@ -607,31 +650,46 @@ def deriv(r, a):
     assert isinstance(r, re_deriv)
     assert isinstance(a, re_symbol)
     asym = a.char
+    # Derivatives are memoized by the shape of r, so the result may share
+    # (metadata-carrying) leaves with an earlier, equal expression. Use
+    # deriv_consumed where metadata matters.
+    key = (r.shape, asym)
+    cache = deriv.cache
+    try:
+        return cache[key]
+    except KeyError:
+        pass
     if isinstance(r, re_empty):
-        return re_empty()
+        d = re_empty()
     elif isinstance(r, re_epsilon):
-        return re_empty()
+        d = re_empty()
     elif isinstance(r, re_symbol):
         rsym = r.char
-        return re_epsilon() if rsym == asym else re_empty()
+        d = re_epsilon() if rsym == asym else re_empty()
     elif isinstance(r, re_star):
-        return smart_concat(deriv(r.re, a), smart_star(r.re))
+        d = smart_concat(deriv(r.re, a), smart_star(r.re))
     elif isinstance(r, re_negate):
-        return smart_negate(deriv(r.re, a))
+        d = smart_negate(deriv(r.re, a))
     elif isinstance(r, re_concat):
-        return smart_alter(
+        d = smart_alter(
             smart_concat(deriv(r.re1, a), r.re2),
             smart_concat(nullable(r.re1), deriv(r.re2, a)))
     elif isinstance(r, re_alter):
-        return foldl(lambda rs, s: smart_alter(rs, deriv(s, a)),
-                     r.re_list,
-                     re_empty())
+        d = foldl(lambda rs, s: smart_alter(rs, deriv(s, a)),
+                  r.re_list,
+                  re_empty())
     elif isinstance(r, re_inters):
-        return foldl(lambda rs, s: smart_inters(rs, deriv(s, a)),
-                     r.re_list,
-                     re_negate(re_empty()))
+        d = foldl(lambda rs, s: smart_inters(rs, deriv(s, a)),
+                  r.re_list,
+                  re_negate(re_empty()))
     else:
         raise TypeError('unknown type in deriv')
+    if len(cache) >= DERIV_CACHE_SIZE:
+        cache.clear()
+    cache[key] = d
+    return d
+
+deriv.cache = {}
 
 def deriv_consumed(r, a):
     """ A version of the derivative function that also returns the list of
@@ -758,16 +816,13 @@ class dfa_transition_table(object):
     def contains_state(self, state):
         """ Return True if the DFA contains the argument state. """
         assert self.state_type_check_fun(state, self.state_type)
-        return state in self.re_to_transitions.keys()
+        return state in self.re_to_transitions
 
     def lookup_state_symbol(self, q, c):
         """ Lookup a transition from state `q` on symbol `c` """
         assert self.state_type_check_fun(q, self.state_type)
         assert self.symbol_type_check_fun(c, self.symbol_type)
-        if q in self.re_to_transitions.keys():
-            if c in self.re_to_transitions[q].keys():
-                return self.re_to_transitions[q][c]
-        return None
+        return self.re_to_transitions.get(q, {}).get(c)
 
     def dot_add_transitions_to_graph(self, g, re_map):
         """ Add transitions in this table to the pydot graph object provided
@@ -1209,6 +1264,7 @@ def make_null_DFA():
 def makeDFA(r, alphabet_list):
     """ Make a DFA from a regular expression r. """
     assert isinstance(r, re_deriv)
+    reset_shapes()
     q0 = r
     tt = re_transition_table()
     states = re_state_table([q0])
@@ -1343,6 +1399,7 @@ def makeDFA_vector(re_list, alphabet_list):
     assert list_isinstance(re_list, re_deriv)
     if len(re_list) == 0:
         return make_null_DFA()
+    reset_shapes()
     component_dfas = tuple_from_list(map(lambda x: makeDFA(x, alphabet_list),
                                          re_list))
     q0 = tuple_from_list(re_list)
@@ -1351,3 +1408,180 @@ def makeDFA_vector(re_list, alphabet_list):
     explore_vector(states, tt, q0, alphabet_list)
     f = states.get_final_states()
     return re_vector_dfa(states, q0, f, tt, alphabet_list)
+
+def minimize_dfa_vector(dfa):
+    """ Minimize a vector DFA with Hopcroft's partition refinement, and return
+    a DFA with one state per class of equivalent states.
+
+    Two states are equivalent only if they accept the same strings for each
+    component expression, so states are first split by the ordinals of the
+    expressions they accept. Each class is represented by one of its original
+    states: the initial state, then the dead state, then the one with the
+    lowest index. The initial state stays at index 0.
+
+    :param dfa: a DFA built by makeDFA_vector
+    :type dfa: re_vector_dfa
+    :rtype: re_vector_dfa
+    """
+    if not isinstance(dfa, re_vector_dfa):
+        return dfa
+    states = dfa.all_states
+    tt = dfa.transition_table
+    n = states.get_num_states()
+    if n <= 1:
+        return dfa
+
+    # inverse transitions, per symbol: dst index -> src indices
+    inv = dict((c, {}) for c in dfa.symbol_list)
+    for (src, dst, c) in tt.get_transitions():
+        inv[c].setdefault(states.get_index(dst), []).append(
+            states.get_index(src))
+
+    initial = {}
+    for i in range(0, n):
+        q = states.get_state_by_index(i)
+        key = tuple(states.get_accepting_exps_ordinal(q))
+        initial.setdefault(key, set()).add(i)
+    blocks = initial.values()
+    block_of = [None] * n
+    for (b, block) in enumerate(blocks):
+        for i in block:
+            block_of[i] = b
+
+    work = set(range(0, len(blocks)))
+    while work:
+        splitter = list(blocks[work.pop()])
+        for c in dfa.symbol_list:
+            inv_c = inv[c]
+            touched = {}
+            for i in splitter:
+                for s in inv_c.get(i, ()):
+                    touched.setdefault(block_of[s], set()).add(s)
+            for (b, inside) in touched.iteritems():
+                block = blocks[b]
+                if len(inside) == len(block):
+                    continue
+                outside = block - inside
+                if len(inside) <= len(outside):
+                    (small, large) = (inside, outside)
+                else:
+                    (small, large) = (outside, inside)
+                # the larger half keeps the block's place (and its place in
+                # the work list); the smaller half is always a new splitter.
+                blocks[b] = large
+                nb = len(blocks)
+                blocks.append(small)
+                for i in small:
+                    block_of[i] = nb
+                work.add(nb)
+
+    if len(blocks) == n:
+        return dfa
+
+    dead = states.get_dead_state()
+    dead_index = states.get_index(dead) if dead is not None else None
+    def representative(block):
+        if 0 in block:
+            return 0
+        elif dead_index in block:
+            return dead_index
+        else:
+            return min(block)
+    reps = [representative(block) for block in blocks]
+
+    new_states = re_vector_state_table()
+    for r in sorted(reps):
+        new_states.add_state(states.get_state_by_index(r))
+    new_tt = re_vector_transition_table(tt.component_dfas)
+    for r in reps:
+        q = states.get_state_by_index(r)
+        for c in dfa.symbol_list:
+            dst = tt.lookup_state_symbol(q, c)
+            dst_rep = reps[block_of[states.get_index(dst)]]
+            new_tt.add_transition(q, c, states.get_state_by_index(dst_rep))
+    return re_vector_dfa(new_states, dfa.init_state,
+                         new_states.get_final_states(), new_tt,
+                         dfa.symbol_list)
+
+### DFA tables: DFAs reduced to integer states, for storing compiled DFAs
+def dfa_to_table(dfa):
+    """ Reduce a DFA to a table of plain values, which can be stored as JSON
+    and turned back into a DFA with table_dfa. States are replaced by their
+    indices, transitions keep their order, and transition metadata is
+    dropped.
+
+    :param dfa: a DFA built by makeDFA_vector
+    :type dfa: dfa_base
+    :rtype: dict
+    """
+    states = dfa.all_states
+    edges = []
+    for (src, dst, c) in dfa.transition_table.get_transitions():
+        edges.append((states.get_index(src), states.get_index(dst), c))
+    accepting = {}
+    for i in range(0, states.get_num_states()):
+        q = states.get_state_by_index(i)
+        if states.is_accepting(q):
+            accepting[i] = states.get_accepting_exps_ordinal(q)
+    dead = states.get_dead_state()
+    return {'num_states' : states.get_num_states(),
+            'init' : states.get_index(dfa.init_state),
+            'edges' : edges,
+            'accepting' : accepting,
+            'dead' : states.get_index(dead) if dead is not None else None,
+            'symbols' : list(dfa.symbol_list)}
+
+class table_state_table(dfa_state_table):
+    def __init__(self, states, accepting, dead):
+        """ Table of the (integer) states of a table_dfa. `accepting` maps
+        each accepting state to the ordinals of the expressions it accepts. """
+        self.accepting = accepting
+        self.dead = dead
+        super(table_state_table, self).__init__(
+            None,
+            int,
+            isinstance,
+            lambda q: q in self.accepting,
+            lambda q: q == self.dead)
+        for q in states:
+            self.add_state(q)
+
+    def get_final_states(self):
+        f = [q for q in self.state_list if q in self.accepting]
+        return table_state_table(f, self.accepting, self.dead)
+
+    def get_accepting_exps_ordinal(self, q):
+        return self.accepting.get(q, [])
+
+class table_transition_table(dfa_transition_table):
+    def __init__(self, edges):
+        """ Transition table of a table_dfa, which lists its transitions in
+        the order of the table. """
+        def symcheck(c, typ):
+            return isinstance(c, typ) and len(c) == 1
+        super(table_transition_table, self).__init__(int, isinstance,
+                                                     str, symcheck)
+        self.edges = edges
+        for (src, dst, c) in edges:
+            self.add_transition(src, c, dst)
+
+    def get_transitions(self):
+        return list(self.edges)
+
+    def get_metadata(self, q, c):
+        """ Tables keep no metadata. """
+        return ()
+
+class table_dfa(dfa_base):
+    def __init__(self, table):
+        """ DFA rebuilt from the output of dfa_to_table. """
+        states = table_state_table(range(0, table['num_states']),
+                                   table['accepting'], table['dead'])
+        tt = table_transition_table(table['edges'])
+        dead = table['dead']
+        super(table_dfa, self).__init__(states, table['init'],
+                                        states.get_final_states(), tt,
+                                        table['symbols'], table_state_table,
+                                        int, isinstance,
+                                        table_transition_table,
+                                        lambda q: q == dead)
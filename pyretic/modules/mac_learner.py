@@ -53,7 +53,9 @@ class mac_learner(DynamicPolicy):
     def set_initial_state(self):
         self.query = packets(1,['srcmac','switch'])
         self.query.register_callback(self.learn_new_MAC)
-        self.forward = self.flood  # REUSE A SINGLE FLOOD INSTANCE
+        # LEARNED (dstmac,switch) -> fwd, FLOODING UNKNOWN DESTINATIONS
+        self.forward = lookup(['dstmac','switch'],
+                              self.flood)  # REUSE A SINGLE FLOOD INSTANCE
         self.update_policy()
 
     def set_network(self,network):
@@ -65,10 +67,7 @@ class mac_learner(DynamicPolicy):
 
     def learn_new_MAC(self,pkt):
         """Update forward policy based on newly seen (mac,port)"""
-        self.forward = if_(match(dstmac=pkt['srcmac'],
-                                switch=pkt['switch']),
-                          fwd(pkt['inport']),
-                          self.forward) 
+        self.forward[(pkt['srcmac'],pkt['switch'])] = fwd(pkt['inport'])
         self.update_policy()
        
 
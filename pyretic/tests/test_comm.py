@@ -0,0 +1,100 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+from pyretic.backend.comm import *
+
+import asynchat
+import asyncore
+import socket
+
+### Backend message (de)serialization tests ###
+
+def test_install_batch_round_trip():
+    pred = {'switch': 1, 'dstip': '10.0.0.1', 'srcmac': '\x00\x01\x02\x03\x04\x05'}
+    install = [pred, 60000, [{'outport': 2}], 3, False]
+    msg = ['install_batch', 1, [[pred, 59999]], [install], []]
+    assert deserialize([serialize(msg)]) == msg
+
+def test_deserialize_joins_pieces():
+    msg = ['install', {'switch': 1, 'raw': '\x0a\x0b'}, 1, [], 1, True]
+    s = serialize(msg)
+    assert s.endswith(TERM_CHAR)
+    pieces = [s[i:i+4] for i in range(0, len(s), 4)]
+    assert deserialize(pieces) == msg
+    assert pieces == []
+
+def test_deserialize_bad_message():
+    pieces = ['["install", {"switch"']
+    assert deserialize(pieces) is None
+    assert pieces == []
+
+def test_binary_round_trip():
+    packet = {'switch': 1, 'inport': 2, 'raw': '\x00\n\xff' * 10,
+              'srcmac': '\x00\x01\x02\x03\x04\x05', 'vlan_id': None}
+    frame = serialize_binary(['packet', packet])
+    (length,) = FRAME_HEADER.unpack(frame[:FRAME_HEADER.size])
+    assert length == len(frame) - FRAME_HEADER.size
+    msg = deserialize_binary([frame[FRAME_HEADER.size:]])
+    # values are converted as for JSON, but raw strings stay as they are
+    assert msg == deserialize([serialize(['packet', packet])])
+    assert msg[1]['raw'] == packet['raw']
+
+class Channel(asynchat.async_chat, FramedChannel):
+    def __init__(self, sock, socket_map):
+        asynchat.async_chat.__init__(self, sock, socket_map)
+        self.init_framing()
+        self.msgs = []
+
+    def collect_incoming_data(self, data):
+        self.received_data.append(data)
+
+    def found_terminator(self):
+        if self.read_frame_header():
+            return
+        msg = self.read_message()
+        self.msgs.append(msg)
+        if msg[0] == 'framing':
+            self.set_in_framing(msg[1])
+
+def test_framed_channel_switches_framing():
+    socket_map = {}
+    (a, b) = socket.socketpair()
+    sender = Channel(a, socket_map)
+    receiver = Channel(b, socket_map)
+    sent = [['packet', {'raw': '\n' * 5000, 'switch': i}] for i in range(3)]
+    sender.push(sender.frame(sent[0]))
+    sender.push(sender.frame(['framing', FRAMING_BINARY]))
+    sender.out_framing = FRAMING_BINARY
+    for msg in sent[1:]:
+        sender.push(sender.frame(msg))
+    for i in range(100):
+        if len(receiver.msgs) == 4:
+            break
+        asyncore.loop(timeout=0.1, map=socket_map, count=1)
+    assert receiver.msgs == [sent[0], ['framing', FRAMING_BINARY]] + sent[1:]
+    sender.close()
+    receiver.close()
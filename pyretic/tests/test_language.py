@@ -30,9 +30,13 @@
 ################################################################################
 
 from pyretic.core.language import *
+from pyretic.core.classifier import (get_rule_derivation_tree,
+                                     provenance_tracked, track_provenance)
 from pyretic.core.packet import *
+from pyretic.core import util
 from pyretic.lib.std import *
 
+from ipaddr import NetmaskValueError
 import pytest
 
 ### Equality tests ###
@@ -490,3 +494,406 @@ def test_optimize_bug_1():
     print 'classifier.optimize():'
     print classifier.optimize()
     assert classifier == classifier.optimize()
+
+def test_remove_shadow_cover_prefixes():
+    c = Classifier([Rule(match(dstip='10.0.0.0/8'), [fwd(1)]),
+                    Rule(match(dstip='10.1.0.0/16', switch=1), [fwd(2)]),
+                    Rule(match(dstip='11.0.0.0/8'), [fwd(3)]),
+                    Rule(match(switch=1), [fwd(4)]),
+                    Rule(match(switch=1, inport=2), [fwd(5)]),
+                    Rule(identity, [drop])])
+    c = c.remove_shadowed_cover_single()
+    assert list(c.rules) == [Rule(match(dstip='10.0.0.0/8'), [fwd(1)]),
+                             Rule(match(dstip='11.0.0.0/8'), [fwd(3)]),
+                             Rule(match(switch=1), [fwd(4)]),
+                             Rule(identity, [drop])]
+
+# Rule indexes
+
+def test_rule_index_candidates():
+    from pyretic.core.classifier import RuleIndex
+    rules = [Rule(match(dstip='10.0.0.1'), [fwd(1)]),
+             Rule(match(dstip='10.0.0.0/24', switch=2), [fwd(2)]),
+             Rule(match(dstip='10.0.1.0/24'), [fwd(3)]),
+             Rule(match(switch=1), [fwd(4)]),
+             Rule(identity, [drop])]
+    index = RuleIndex(rules)
+    assert index.candidates(match(dstip='10.0.0.0/16')) == [
+        rules[0], rules[1], rules[2], rules[3], rules[4]]
+    assert index.candidates(match(dstip='10.0.0.1')) == [
+        rules[0], rules[1], rules[3], rules[4]]
+    assert index.candidates(match(switch=2)) == [
+        rules[0], rules[1], rules[2], rules[4]]
+    assert index.candidates(identity) == rules
+
+def test_indexed_parallel_composition():
+    def cross_all(c1, c2):
+        rules = []
+        for r1 in c1.rules:
+            for r2 in c2.rules:
+                m = r1.match.intersect(r2.match)
+                if m != drop:
+                    rules.append(Rule(m, r1.actions | r2.actions))
+        return Classifier(rules).optimize()
+    p1 = (match(dstip='10.0.0.0/24') >> fwd(1)) + (match(switch=1) >> fwd(2))
+    p2 = ((match(dstip='10.0.0.3', inport=1) >> fwd(3)) +
+          (match(dstip='10.0.1.0/24') >> fwd(4)))
+    c1 = p1.compile()
+    c2 = p2.compile()
+    assert list((c1 + c2).rules) == list(cross_all(c1, c2).rules)
+    assert list((c2 + c1).rules) == list(cross_all(c2, c1).rules)
+
+# Compilation cache
+
+def test_compile_cache_shares_equal_subpolicies():
+    clear_compile_cache()
+    d1 = DynamicPolicy()
+    d2 = DynamicPolicy()
+    d1.policy = match(switch=1) >> fwd(2)
+    d2.policy = match(switch=1) >> fwd(2)
+    p1 = d1 + match(inport=3) >> fwd(1)
+    p2 = d2 + match(inport=3) >> fwd(1)
+    assert p1.structural_key() == p2.structural_key()
+    hits = compile_cache_stats()['hits']
+    c1 = p1.compile()
+    assert p2.compile() is c1
+    assert compile_cache_stats()['hits'] > hits
+
+def test_compile_cache_distinguishes_buckets():
+    b1 = FwdBucket()
+    b2 = FwdBucket()
+    p1 = match(switch=1) >> b1
+    p2 = match(switch=1) >> b2
+    assert p1.structural_key() != p2.structural_key()
+    assert p1.compile() is not p2.compile()
+
+def test_lru_cache_eviction():
+    from pyretic.core.util import LRUCache
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.stats() == {'hits' : 2, 'misses' : 1, 'size' : 2,
+                             'capacity' : 2}
+
+# Lazy classifier generation
+
+def test_match_classifier_is_lazy():
+    m = match(switch=1, inport=2)
+    assert m._classifier is None
+    c = m.compile()
+    assert m._classifier is c
+    assert c.rules[0].match.map == m.map
+
+def test_match_and_modify_eval():
+    pkt = Packet({'switch' : 1, 'inport' : 2, 'srcip' : '10.0.0.1'})
+    assert match(switch=1, srcip='10.0.0.0/24').eval(pkt) == {pkt}
+    assert match(switch=1, inport=3).eval(pkt) == set()
+    assert match(switch=1, outport=3).eval(pkt) == set()
+    assert modify(outport=4).eval(pkt) == {pkt.modify(outport=4)}
+    assert modify(outport=4)._classifier is None
+
+# Classifier evaluation
+
+def test_classifier_find_rule():
+    macs = [EthAddr('00:00:00:00:00:%02x' % i) for i in range(1, 33)]
+    pol = (parallel([match(switch=s, dstmac=m) >> fwd(i % 4 + 1)
+                     for i, m in enumerate(macs) for s in [1, 2]]) +
+           (match(dstip='10.0.0.0/24') >> fwd(5)))
+    c = pol.compile()
+    for s in [1, 2, 3]:
+        for m in macs[:4] + [EthAddr('00:00:00:00:01:00')]:
+            for ip in ['10.0.0.1', '10.0.1.1']:
+                pkt = Packet({'switch' : s, 'inport' : 1, 'dstmac' : m,
+                              'dstip' : IPAddr(ip)})
+                linear = [r for r in c.rules if r.match.eval(pkt)][0]
+                assert c.find_rule(pkt) is linear
+                assert c.eval(pkt) == pol.eval(pkt)
+
+def test_queries_in_classifier_eval():
+    from pyretic.core.language_tools import queries_in_classifier_eval
+    b = CountBucket()
+    pol = (match(inport=1) >> (fwd(2) + b)) + (match(inport=2) >> FwdBucket())
+    c = pol.compile()
+    pkt = Packet({'switch' : 1, 'inport' : 1})
+    assert queries_in_classifier_eval(c, pkt) == ({b}, {pkt.modify(outport=2)})
+    assert b.bucket == {pkt}
+    assert queries_in_classifier_eval(c, pkt.modify(inport=2)) is None
+    assert queries_in_classifier_eval(c, pkt.modify(inport=3)) == (set(),
+                                                                  set())
+
+# Lookup tables
+
+def test_lookup_eval_and_compile():
+    macs = [EthAddr('00:00:00:00:00:%02x' % i) for i in range(1, 9)]
+    default = match(switch=1) >> fwd(9)
+    table = lookup(['dstmac', 'switch'], default)
+    chain = default
+    for i, m in enumerate(macs):
+        entry = fwd(i % 3 + 1) if i % 2 else match(inport=1) >> fwd(4)
+        table[(str(m), i % 2 + 1)] = entry
+        chain = if_(match(dstmac=m, switch=i % 2 + 1), entry, chain)
+    assert len(table) == len(macs)
+    assert table[(macs[0], 1)] == match(inport=1) >> fwd(4)
+    c = table.compile()
+    # each entry's rules restricted to its key, then the default's rules
+    assert len(c) == 4 * 1 + 4 * 2 + 2
+    for m in macs + [EthAddr('00:00:00:00:01:00')]:
+        for s in [1, 2]:
+            for inport in [1, 2]:
+                pkt = Packet({'switch' : s, 'inport' : inport, 'dstmac' : m})
+                assert table.eval(pkt) == chain.eval(pkt)
+                assert c.eval(pkt) == chain.eval(pkt)
+
+def test_lookup_update_recompiles():
+    mac = EthAddr('00:00:00:00:00:01')
+    pkt = Packet({'switch' : 1, 'inport' : 1, 'dstmac' : mac})
+    table = lookup(['dstmac', 'switch'], drop, {(mac, 1) : fwd(2)})
+    key = table.structural_key()
+    assert table.compile().eval(pkt) == {pkt.modify(outport=2)}
+    table[(mac, 1)] = fwd(3)
+    assert table.structural_key() is not key
+    assert table.compile().eval(pkt) == {pkt.modify(outport=3)}
+    del table[(mac, 1)]
+    assert not (mac, 1) in table
+    assert table.compile().eval(pkt) == set()
+    with pytest.raises(TypeError):
+        table[mac] = fwd(1)
+
+def test_lookup_recompiles_changed_entry_only():
+    from pyretic.core.language_tools import on_recompile_path_list
+    macs = [EthAddr('00:00:00:00:00:%02x' % i) for i in range(1, 3)]
+    dyn = DynamicPolicy(fwd(1))
+    table = lookup(['dstmac'], drop, [(macs[0], dyn), (macs[1], fwd(2))])
+    table.compile()
+    unchanged = table._entry_rules[(macs[1],)][1]
+    dyn.policy = fwd(3)
+    # as the runtime does on a policy change
+    for p in on_recompile_path_list(id(dyn), table):
+        p.invalidate_classifier()
+    pkt = Packet({'switch' : 1, 'inport' : 1, 'dstmac' : macs[0]})
+    assert table.compile().eval(pkt) == {pkt.modify(outport=3)}
+    assert table._entry_rules[(macs[1],)][1] is unchanged
+
+def test_lookup_equality_ignores_entry_order():
+    entries = [(1, fwd(1)), (2, fwd(2))]
+    assert (lookup(['inport'], drop, entries) ==
+            lookup(['inport'], drop, reversed(entries)))
+    assert lookup(['inport'], drop, entries) != lookup(['inport'], drop,
+                                                       entries[:1])
+
+# Limit filters
+
+def test_limit_filter_groups():
+    from pyretic.lib.query import LimitFilter
+    macs = [EthAddr('00:00:00:00:00:%02x' % i) for i in range(1, 4)]
+    pkts = [Packet({'switch' : 1, 'inport' : 1, 'srcmac' : m}) for m in macs]
+    lf = LimitFilter(2, ['srcmac', 'switch'])
+    # as the runtime does when a dynamic policy changes
+    lf.attach(lambda p: p.invalidate_classifier())
+    for pkt in pkts[:2] + pkts[:1]:
+        assert lf.eval(pkt) == {pkt}
+        lf.update_policy(pkt)
+    assert lf.eval(pkts[0]) == set()
+    assert lf.eval(pkts[1]) == {pkts[1]}
+    assert len(lf.compile()) == 2
+    lf.update_policy(pkts[1])
+    assert lf.eval(pkts[1]) == set()
+    assert len(lf.compile()) == 3
+    assert lf.eval(pkts[2]) == {pkts[2]}
+
+def test_limit_filter_forgets_groups():
+    from pyretic.lib.query import LimitFilter
+    macs = [EthAddr('00:00:00:00:00:%02x' % i) for i in range(1, 5)]
+    pkts = [Packet({'switch' : 1, 'inport' : 1, 'srcmac' : m}) for m in macs]
+    lf = LimitFilter(1, ['srcmac'], max_groups=2, timeout=10)
+    lf.attach(lambda p: p.invalidate_classifier())
+    for pkt in pkts[:3]:
+        lf.update_policy(pkt)
+    # the oldest grouping was evicted
+    assert [lf.eval(pkt) == set() for pkt in pkts] == [False, True, True,
+                                                        False]
+    assert not lf.expire(lf.done.values()[-1] + 5)
+    assert lf.expire(lf.done.values()[-1] + 10)
+    assert len(lf.done) == 0 and len(lf.compile()) == 1
+    assert lf.eval(pkts[2]) == {pkts[2]}
+
+def test_limit_filter_expires_without_packets():
+    import threading
+    from pyretic.lib.query import LimitFilter
+    pkt = Packet({'switch' : 1, 'inport' : 1,
+                  'srcmac' : EthAddr('00:00:00:00:00:01')})
+    lf = LimitFilter(1, ['srcmac'], timeout=0.05)
+    changed = threading.Event()
+    def on_change(policy):
+        policy.invalidate_classifier()
+        changed.set()
+    lf.attach(on_change)
+    lf.update_policy(pkt)
+    assert changed.is_set() and lf.eval(pkt) == set()
+    changed.clear()
+    # no further packets: the timer forgets the grouping
+    assert changed.wait(5)
+    assert len(lf.done) == 0 and lf.timer is None
+    assert len(lf.compile()) == 1 and lf.eval(pkt) == {pkt}
+
+# Grouped counts
+
+def test_counts_share_one_bucket():
+    from pyretic.lib.query import counts
+    macs = [EthAddr('00:00:00:00:00:%02x' % i) for i in range(1, 4)]
+    pkts = [Packet({'switch' : 1, 'inport' : 1, 'srcmac' : m,
+                    'raw' : '', 'payload_len' : 10}) for m in macs]
+    q = counts(None, ['srcmac'])
+    q.attach(lambda p: p.invalidate_classifier())
+    reports = []
+    q.register_callback(reports.append)
+    for pkt in pkts[:2]:
+        assert q.eval(pkt) == set()
+        q.fb.apply()
+    # known groupings go to the shared bucket, new ones to the controller
+    assert len(q.compile()) == 3
+    q.eval(pkts[0])
+    assert q.fb.bucket == set() and q.bucket.bucket == {pkts[0]}
+    q.bucket.apply()
+
+    # installing the groupings' rules, as the runtime does
+    b = q.bucket
+    b.start_update()
+    for (i, m) in enumerate(macs[:2]):
+        b.add_match({'switch' : 1, 'srcmac' : m}, 100 + i, 1)
+    b.add_pull_stats(lambda: b.add_outstanding_switch_query(1) or True)
+    b.finish_update()
+    q.pull_stats()
+    assert reports == []
+    b.handle_flow_stats_reply(1, [
+        {'match' : {'srcmac' : m}, 'priority' : 100 + i, 'cookie' : 1,
+         'packet_count' : 5 * i, 'byte_count' : 50 * i}
+        for (i, m) in enumerate(macs)])
+    assert reports == [{match(srcmac=macs[0]).map : [2, 20],
+                        match(srcmac=macs[1]).map : [6, 60]}]
+
+# First-match compilation
+
+def test_if_compiles_by_first_match():
+    pred = (match(dstip='10.0.0.0/24') & ~match(inport=2)) | match(switch=3)
+    t = (match(srcip='10.0.0.1') >> fwd(1)) + fwd(2)
+    f = match(dstip='10.0.0.7') >> fwd(3)
+    native = if_(pred, t, f).compile()
+    expanded = ((pred >> t) + (~pred >> f)).compile()
+    for (sw, inport, srcip, dstip) in [(1, 1, '10.0.0.1', '10.0.0.7'),
+                                       (1, 2, '10.0.0.1', '10.0.0.7'),
+                                       (1, 2, '10.0.0.2', '10.0.1.7'),
+                                       (3, 2, '10.0.0.1', '10.0.1.7'),
+                                       (3, 1, '10.0.0.2', '10.0.0.7')]:
+        pkt = Packet({'switch' : sw, 'inport' : inport, 'srcip' : srcip,
+                      'dstip' : dstip})
+        assert native.eval(pkt) == expanded.eval(pkt)
+    assert len(native.rules) <= len(expanded.rules)
+
+def test_first_match_policy():
+    fm = first_match([(match(inport=1), fwd(2)),
+                      (match(srcmac='00:00:00:00:00:01'), drop)],
+                     fwd(3))
+    c = fm.compile()
+    for (inport, srcmac, outport) in [(1, '00:00:00:00:00:01', 2),
+                                      (2, '00:00:00:00:00:01', None),
+                                      (2, '00:00:00:00:00:02', 3)]:
+        pkt = Packet({'switch' : 1, 'inport' : inport, 'srcmac' : srcmac})
+        expected = set() if outport is None else {pkt.modify(outport=outport)}
+        assert fm.eval(pkt) == expected
+        assert c.eval(pkt) == expected
+
+def test_first_match_rejects_non_filters():
+    c1 = (match(inport=1) >> fwd(2)).compile()
+    assert not c1.is_filter_classifier()
+    assert (~match(inport=1) | match(switch=2)).compile().is_filter_classifier()
+    with pytest.raises(TypeError):
+        c1.first_match(identity.compile(), drop.compile())
+
+def test_if_compile_errors_propagate():
+    class Broken(Policy):
+        def compile(self):
+            raise TypeError("broken branch")
+    with pytest.raises(TypeError) as e:
+        if_(match(inport=1), Broken(), drop).compile()
+    assert 'broken branch' in str(e.value)
+
+def test_translated_maps_follow_virtual_fields():
+    from pyretic.core.runtime import virtual_field
+    m = match(test_vf='a')
+    mod = modify(test_vf='b')
+    assert dict(m.translated_map()) == {}
+    assert dict(mod.translated_map()) == {}
+    saved = dict(virtual_field.fields)
+    try:
+        virtual_field('test_vf', ['a', 'b'])
+        assert 'vlan_id' in m.translated_map()
+        assert 'vlan_id' in mod.translated_map()
+        assert m.translated_map() != match(test_vf='b').translated_map()
+    finally:
+        virtual_field.fields = saved
+        virtual_fields_changed()
+    assert dict(m.translated_map()) == {}
+
+# Rule provenance
+
+def test_rule_provenance_is_opt_in():
+    def compiled_rule():
+        clear_compile_cache()
+        policy = ((match(inport=1) >> fwd(2)) +
+                  (match(srcip='10.0.0.1') >> fwd(3)))
+        return policy.compile().rules[0]
+    assert not provenance_tracked()
+    r = compiled_rule()
+    assert r.parents is None
+    assert 'not tracked' in get_rule_derivation_tree(r)
+    assert not hasattr(r, '__dict__')
+    track_provenance()
+    try:
+        r = compiled_rule()
+        assert r.op == "parallel" and len(r.parents) == 2
+        assert '[operator sequential]' in get_rule_derivation_tree(r)
+    finally:
+        track_provenance(False)
+        clear_compile_cache()
+
+# Addresses
+
+def test_ip_prefix_containment():
+    p16 = util.string_to_network('10.0.0.0/16')
+    p24 = util.string_to_network('10.0.1.7/24')
+    assert p24.network == IP('10.0.1.0') and str(p24.ip) == '10.0.1.7'
+    assert p24 in p16 and not p16 in p24
+    assert IP('10.0.1.200') in p24 and not IP('10.1.0.1') in p16
+    assert p24 == IPPrefix('10.0.1.0/255.255.255.0')
+    assert util.string_to_network('10.0.0.0/16') is p16
+    assert util.network_to_string(p24) == '10.0.1.0/24'
+    assert util.network_to_string(util.string_to_network('10.0.1.7')) == \
+        '10.0.1.7'
+    for bad in ['10.0.0.256', '10.1', '1234', '10.0.0.01']:
+        with pytest.raises(TypeError):
+            util.string_to_network(bad)
+        with pytest.raises(TypeError):
+            util.string_to_IP(bad)
+    for bad in ['10.0.0.0/33', '10.0.0.0/255.0.255.0', '10.0.0.0/x']:
+        with pytest.raises(NetmaskValueError):
+            util.string_to_network(bad)
+    assert (match(dstip='10.0.0.0/16').intersect(match(dstip='10.0.1.7/24'))
+            == match(dstip='10.0.1.0/24'))
+    assert match(dstip='10.0.0.0/16').intersect(match(dstip='10.1.0.0/16')) \
+        == drop
+
+def test_address_encodings():
+    ip = IP('10.0.1.2')
+    assert IP(ip.to_bytes()) == ip and IP(int(ip)) == ip
+    assert ip.to01() == ip.to_bits().to01()
+    assert ip != MAC(int(ip)) and hash(ip) == hash(IP('10.0.1.2'))
+    mac = MAC('00:1b:21:0a:ff:01')
+    assert repr(mac) == '00:1b:21:0a:ff:01'
+    assert MAC(mac.to_bytes()) == mac == MAC('0-1b-21-a-ff-1')
+    assert len(mac.to_bits()) == 48
@@ -157,3 +157,56 @@ def test_processor_unpacking():
     assert not vlan.vlan in pkt
     assert res == udp_payload
 
+
+def test_fast_unpack_matches_ryu():
+    from pyretic.core.packet import fast_unpack
+    pro = Processor().compile()
+
+    tcp_pkt = packet.Packet()
+    tcp_pkt.add_protocol(ethernet.ethernet(ethertype=0x0800))
+    tcp_pkt.add_protocol(ipv4.ipv4(proto=6, src='10.0.0.1', dst='10.0.0.2'))
+    tcp_pkt.add_protocol(tcp.tcp(src_port=1234, dst_port=80))
+    tcp_pkt.serialize()
+    icmp_pkt = packet.Packet()
+    icmp_pkt.add_protocol(ethernet.ethernet(ethertype=0x0800))
+    icmp_pkt.add_protocol(ipv4.ipv4(proto=1))
+    icmp_pkt.add_protocol(icmp.icmp(type_=8, code=0, data=icmp.echo(1, 2)))
+    icmp_pkt.serialize()
+
+    for raw in [udp_payload, arp_payload, vlan_payload,
+                str(tcp_pkt.data), str(icmp_pkt.data)]:
+        headers = fast_unpack(raw)
+        assert headers is not None
+        assert headers == pro.unpack(packet.Packet(raw))
+
+    # truncated and unusual packets are left to ryu
+    assert fast_unpack(udp_payload[:30]) is None
+    assert fast_unpack(udp_payload[:12] + '\x86\xdd' + udp_payload[14:]) is None
+
+def test_fast_pack():
+    from pyretic.core.packet import fast_pack, fast_unpack
+    pro = Processor().compile()
+    headers = pro.unpack(udp_payload)
+    headers.update(raw=udp_payload, switch=1, inport=1, outport=2)
+
+    # forwarding only: the raw bytes pass through
+    assert fast_pack(headers) is udp_payload
+
+    # rewrites are patched in place, and match what ryu decodes
+    headers.update(dstmac='00:00:00:00:00:03', dstip='192.168.0.12',
+                   srcport=1000)
+    raw = fast_pack(headers)
+    assert len(raw) == len(udp_payload)
+    decoded = pro.unpack(packet.Packet(raw))
+    assert decoded['dstmac'] == '00:00:00:00:00:03'
+    assert decoded['dstip'] == '192.168.0.12'
+    assert decoded['srcport'] == 1000
+    assert decoded['srcmac'] == '00:00:00:00:00:02'
+
+    # adding or stripping VLAN tags is left to ryu
+    headers.update(vlan_id=1365, vlan_pcp=2)
+    assert fast_pack(headers) is None
+    vlan_headers = fast_unpack(vlan_payload)
+    del vlan_headers['vlan_id'], vlan_headers['vlan_pcp']
+    vlan_headers['raw'] = vlan_payload
+    assert fast_pack(vlan_headers) is None
@@ -33,8 +33,11 @@ from pyretic.lib.path import *
 from pyretic.lib.path import __in_re_tree_gen__, __out_re_tree_gen__
 
 import copy
+import os
 import pytest
+import shutil
 import sys
+import tempfile
 
 ip1 = IPAddr('10.0.0.1')
 ip2 = IPAddr('10.0.0.2')
@@ -45,6 +48,16 @@ out_cg = __out_re_tree_gen__
 cu = classifier_utils
 ne_inters = cu.has_nonempty_intersection
 
+@pytest.fixture(autouse=True, scope="module")
+def dfa_cache_dir(request):
+    """ Keep compiled DFAs in a scratch directory rather than the user's. """
+    old_dir = dfa_utils.cache_dir
+    dfa_utils.cache_dir = tempfile.mkdtemp()
+    def restore():
+        shutil.rmtree(dfa_utils.cache_dir)
+        dfa_utils.cache_dir = old_dir
+    request.addfinalizer(restore)
+
 ### Classifier utilities sanity checks ###
 
 def test_classifier_ne_inters():
@@ -75,6 +88,26 @@ def test_overlap_mode():
     assert ovlap(m4, m1) == (False, False, True, False)
     assert ovlap(m6, m5) == (False, False, False, True)
 
+def test_pred_space_overlap():
+    space = pred_space()
+    fdd = space.from_pred
+    m1 = match(srcip=ip1)
+    m2 = match(switch=1)
+    m3 = match(srcip=ip2)
+    m4 = match(srcip=ip1) & match(switch=2)
+    m5 = match(srcip=ip2) | match(srcip=ip1)
+    m6 = match(srcip=ip2) | match(switch=1)
+    m7 = match(srcip='10.0.0.0/16')
+    m8 = match(srcip='10.0.0.0/16') & ~match(srcip=ip1)
+    preds = [m1, m2, m3, m4, m5, m6, m7, m8, ~m2, identity, drop]
+    for p in preds:
+        for q in preds:
+            assert (space.get_overlap_mode(fdd(p), fdd(q)) ==
+                    cu.get_overlap_mode(p, q))
+    assert fdd(m5) == fdd(match(srcip=ip1) | match(srcip=ip2))
+    assert fdd(m1 & m3) == space.FALSE
+    assert fdd(m7 | ~m7) == space.TRUE
+
 ### Character generator basic sanity checks ###
 
 def test_CG_token_gen():
@@ -533,7 +566,7 @@ def test_in_out_compile_2():
     a2 = out_atom(match(dstip=ip2))
     fb = FwdBucket()
     p = path_policy(a1 ^ a2, fb)
-    (in_tag, in_cap, out_tag, out_cap) = pathcomp.compile(p)
+    (in_tag, in_cap, out_tag, out_cap) = pathcomp.compile(p, minimize=False)
 
     pred_a = match(srcip=ip1)
     pred_b = identity & ~match(srcip=ip1)
@@ -545,7 +578,7 @@ def test_in_out_compile_2():
         mtag.append(match(path_tag=i))
         atag.append(modify(path_tag=i))
 
-    ref_in_tag = ((~(pred_b | pred_a) >> ~mtag[2] >> atag[2]) +
+    ref_in_tag = ((~(pred_a | pred_b) >> ~mtag[2] >> atag[2]) +
                   (mtag[2]) +
                   ((mtag[5] & pred_a) >> atag[2]) +
                   ((mtag[5] & pred_b) >> atag[2]) +
@@ -557,7 +590,7 @@ def test_in_out_compile_2():
                   ((mtag[0] & pred_b) >> atag[2]) +
                   ((mtag[4] & pred_a) >> atag[2]) +
                   ((mtag[4] & pred_b) >> atag[2]))
-    ref_out_tag = ((~(pred_c | pred_d) >> ~mtag[2] >> atag[2]) +
+    ref_out_tag = ((~(pred_d | pred_c) >> ~mtag[2] >> atag[2]) +
                    (mtag[2]) +
                    ((mtag[5] & pred_c) >> atag[2]) +
                    ((mtag[5] & pred_d) >> atag[2]) +
@@ -587,6 +620,80 @@ def test_in_out_compile_2():
     # assert out_tag._classifier == ref_out_tag._classifier
     assert out_cap._classifier == ref_out_cap._classifier
 
+def test_in_out_compile_merged_edges():
+    in_cg.clear()
+    out_cg.clear()
+    a1 = in_atom(match(srcip=ip1))
+    a2 = out_atom(match(dstip=ip2))
+    fb = FwdBucket()
+    p = path_policy(a1 ^ a2, fb)
+    (in_tag, in_cap, out_tag, out_cap) = pathcomp.compile(p)
+
+    pred_a = match(srcip=ip1)
+    pred_b = identity & ~match(srcip=ip1)
+    pred_c = match(dstip=ip2)
+    pred_d = identity & ~match(dstip=ip2)
+    mtag = [match(path_tag=None)]
+    atag = [modify(path_tag=None)]
+    for i in range(1, 6):
+        mtag.append(match(path_tag=i))
+        atag.append(modify(path_tag=i))
+
+    # the DFA is already minimal; edges between the same pair of states are
+    # merged into one rule.
+    ref_in_tag = ((~(pred_a | pred_b) >> ~mtag[2] >> atag[2]) +
+                  (mtag[2]) +
+                  ((mtag[5] & (pred_a | pred_b)) >> atag[2]) +
+                  ((mtag[3] & (pred_a | pred_b)) >> atag[4]) +
+                  ((mtag[1] & (pred_a | pred_b)) >> atag[2]) +
+                  ((mtag[0] & pred_a) >> atag[1]) +
+                  ((mtag[0] & pred_b) >> atag[2]) +
+                  ((mtag[4] & (pred_a | pred_b)) >> atag[2]))
+    ref_out_tag = ((~(pred_d | pred_c) >> ~mtag[2] >> atag[2]) +
+                   (mtag[2]) +
+                   ((mtag[5] & (pred_c | pred_d)) >> atag[2]) +
+                   ((mtag[3] & (pred_c | pred_d)) >> atag[2]) +
+                   ((mtag[1] & (pred_c | pred_d)) >> atag[3]) +
+                   ((mtag[0] & (pred_c | pred_d)) >> atag[2]) +
+                   ((mtag[4] & pred_c) >> atag[5]) +
+                   ((mtag[4] & pred_d) >> atag[2]))
+    ref_out_cap = ((drop) +
+                   ((mtag[4] & pred_c) >> fb))
+
+    assert in_tag == ref_in_tag
+    assert out_tag == ref_out_tag
+    assert in_cap == drop
+    assert out_cap == ref_out_cap
+
+def test_dfa_cache():
+    old_dir = dfa_utils.cache_dir
+    # created private to the user
+    dfa_utils.cache_dir = os.path.join(tempfile.mkdtemp(), 'cache')
+    try:
+        dfa_utils.clear_cache()
+        a1 = in_atom(match(srcip=ip1))
+        a2 = out_atom(match(dstip=ip2))
+        p = path_policy(a1 ^ a2, FwdBucket())
+        frags = pathcomp.compile(p)
+        assert (dfa_utils.cache_hits, dfa_utils.cache_misses) == (0, 1)
+        assert pathcomp.compile(p) == frags
+        assert (dfa_utils.cache_hits, dfa_utils.cache_misses) == (1, 1)
+        # as after a restart: only the file is left
+        dfa_utils.clear_cache()
+        assert pathcomp.compile(p) == frags
+        assert (dfa_utils.cache_hits, dfa_utils.cache_misses) == (1, 0)
+        assert pathcomp.compile(p, minimize=False) != frags
+        assert (dfa_utils.cache_hits, dfa_utils.cache_misses) == (1, 1)
+        assert os.stat(dfa_utils.cache_dir).st_mode & 0777 == 0700
+        # a directory others can write to isn't trusted
+        os.chmod(dfa_utils.cache_dir, 0777)
+        dfa_utils.clear_cache()
+        assert pathcomp.compile(p) == frags
+        assert (dfa_utils.cache_hits, dfa_utils.cache_misses) == (0, 1)
+    finally:
+        shutil.rmtree(os.path.dirname(dfa_utils.cache_dir))
+        dfa_utils.cache_dir = old_dir
+
 def test_empty_paths():
     in_cg.clear()
     out_cg.clear()
@@ -813,6 +920,7 @@ def test_hook_compilation_2():
 if __name__ == "__main__":
 
     test_overlap_mode()
+    test_pred_space_overlap()
     test_classifier_ne_inters()
 
     test_CG_token_gen()
@@ -842,6 +950,8 @@ if __name__ == "__main__":
     test_path_compile_2()
     test_in_out_compile_1()
     test_in_out_compile_2()
+    test_in_out_compile_merged_edges()
+    test_dfa_cache()
     test_empty_paths()
 
     test_ast_fold()
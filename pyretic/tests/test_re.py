@@ -544,6 +544,71 @@ def test_dot_vector():
         f.close()
         # output = subprocess.check_output(['dot', '-Tx11', fname])
 
+def test_hash_consing():
+    """ Test that structurally equal expressions share a shape, independent of
+    metadata, and that derivatives are memoized. """
+    import pickle
+    a  = re_symbol('a')
+    a1 = re_symbol('a', metadata='ingress')
+    b  = re_symbol('b')
+    c  = re_symbol('c')
+    r1 = (a ^ +b) | (b ^ c)
+    r2 = (a1 ^ +b) | (b ^ c)
+    assert r1.shape == r2.shape and r1 == r2 and hash(r1) == hash(r2)
+    assert not r1.equals_meta_structural(r2)
+    assert r1 != (a ^ +c) | (b ^ c)
+    assert r1 != None
+    assert re_symbol('epsilon') != re_epsilon()
+    assert re_concat(a, b) != re_alter([a, b])
+
+    r3 = pickle.loads(pickle.dumps(r2))
+    assert r3 == r2 and r3.equals_meta_structural(r2)
+
+    deriv.cache.clear()
+    d = deriv(r1, a)
+    assert deriv(r2, a) is d
+    assert d == +b
+    assert deriv_consumed(r2, a)[1] == ['ingress']
+    assert deriv_consumed(r1, a)[1] == []
+
+    # renumbering shapes keeps existing expressions consistent
+    reset_shapes(force=True)
+    assert not deriv.cache and not is_nullable.cache
+    assert r1 == r2 and hash(r1) == hash(r2) and r1 != +b
+    assert deriv(r2, a) == +b
+
+def test_dfa_minimization():
+    """ Test that minimizing a vector DFA merges equivalent states, keeps the
+    initial state at index 0, and keeps which expressions accept each
+    string. """
+    import itertools
+    a = re_symbol('a')
+    b = re_symbol('b')
+    c = re_symbol('c')
+    symlist = 'abc'
+    def accepting(dfa, s):
+        (q, rest) = dfa.run(s)
+        if dfa.dead_state_check_fun(q):
+            return []
+        return dfa.all_states.get_accepting_exps_ordinal(q)
+
+    for exps in [[+a ^ +a], [(+a ^ b) | b], [+a ^ +a, (+a ^ b) | b],
+                 [(a ^ b) | (a ^ c), (+a) | (b ^ c)]]:
+        dfa = makeDFA_vector(exps, symlist)
+        mdfa = minimize_dfa_vector(dfa)
+        assert mdfa.all_states.get_index(mdfa.init_state) == 0
+        for n in range(0, 5):
+            for s in itertools.product(symlist, repeat=n):
+                s = ''.join(s)
+                assert accepting(dfa, s) == accepting(mdfa, s)
+
+    dfa = makeDFA_vector([+a ^ +a], symlist)
+    mdfa = minimize_dfa_vector(dfa)
+    assert dfa.all_states.get_num_states() == 3
+    assert mdfa.all_states.get_num_states() == 2
+    assert mdfa.transition_table.get_num_transitions() == 6
+    assert minimize_dfa_vector(mdfa) is mdfa
+
 # Just in case: keep these here to run unit tests in vanilla python
 if __name__ == "__main__":
     test_normal_forms()
@@ -558,6 +623,8 @@ if __name__ == "__main__":
     test_dfa_metadata()
     test_dfa_vector()
     test_dot_vector()
+    test_hash_consing()
+    test_dfa_minimization()
 
     print "If this message is printed without errors before it, we're good."
     print "Also ensure all unit tests are listed above this line in the source."
@@ -0,0 +1,533 @@
+################################################################################
+# The Pyretic Project                                                          #
+# frenetic-lang.org/pyretic                                                    #
+################################################################################
+# Licensed to the Pyretic Project by one or more contributors. See the         #
+# NOTICES file distributed with this work for additional information           #
+# regarding copyright and ownership. The Pyretic Project licenses this         #
+# file to you under the following license.                                     #
+#                                                                              #
+# Redistribution and use in source and binary forms, with or without           #
+# modification, are permitted provided the following conditions are met:       #
+# - Redistributions of source code must retain the above copyright             #
+#   notice, this list of conditions and the following disclaimer.              #
+# - Redistributions in binary form must reproduce the above copyright          #
+#   notice, this list of conditions and the following disclaimer in            #
+#   the documentation or other materials provided with the distribution.       #
+# - The names of the copyright holds and contributors may not be used to       #
+#   endorse or promote products derived from this work without specific        #
+#   prior written permission.                                                  #
+#                                                                              #
+# Unless required by applicable law or agreed to in writing, software          #
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT    #
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the     #
+# LICENSE file distributed with this work for specific language governing      #
+# permissions and limitations under the License.                               #
+################################################################################
+
+from pyretic.core.language import *
+from pyretic.core.runtime import index_rules, incremental_diff, rule_key
+from pyretic.core.runtime import installed_priorities, assign_priorities
+from pyretic.core.runtime import classifier_rule_key
+from pyretic.core.runtime import merge_diff_lists, RuleInstaller, Runtime
+from pyretic.core.runtime import PollScheduler, stats_index_key
+from pyretic.core.runtime import pipeline_rule, pipeline_fanout
+from pyretic.core.runtime import PATH_IN_TABLE, FORWARDING_TABLE
+from pyretic.core.runtime import PATH_OUT_TABLE
+from pyretic.core.classifier import Rule
+from pyretic.core.packet import Packet
+from pyretic.core import util
+
+import pytest
+import threading
+
+### Incremental rule diff tests ###
+
+def rule(switch, dstip, priority, outport, version):
+    return ({'switch': switch, 'dstip': dstip}, priority,
+            [{'outport': outport}], version)
+
+def test_rule_key_ignores_actions_and_version():
+    r1 = rule(1, '10.0.0.1', 60000, 1, 1)
+    r2 = rule(1, '10.0.0.1', 60000, 2, 2)
+    assert rule_key(r1) == rule_key(r2)
+    assert rule_key(r1) != rule_key(rule(2, '10.0.0.1', 60000, 1, 1))
+    assert rule_key(r1) != rule_key(rule(1, '10.0.0.1', 59999, 1, 1))
+
+def test_incremental_diff_empty_install():
+    installed = index_rules([])
+    new_rules = [rule(1, '10.0.0.1', 60000, 1, 1),
+                 rule(1, '10.0.0.2', 59999, 2, 1)]
+    (to_add, to_delete, to_modify, to_stay) = incremental_diff(installed,
+                                                               new_rules)
+    assert to_add == new_rules
+    assert to_delete == [] and to_modify == [] and to_stay == []
+    assert sorted(installed.values()) == sorted(new_rules)
+
+def test_incremental_diff_add_delete_modify_stay():
+    stay = rule(1, '10.0.0.1', 60000, 1, 1)
+    gone = rule(1, '10.0.0.2', 59999, 2, 1)
+    moved = rule(2, '10.0.0.3', 60000, 1, 1)
+    installed = index_rules([stay, gone, moved])
+    added = rule(2, '10.0.0.4', 59999, 3, 2)
+    new_rules = [rule(1, '10.0.0.1', 60000, 1, 2),
+                 rule(2, '10.0.0.3', 60000, 4, 2),
+                 added]
+    (to_add, to_delete, to_modify, to_stay) = incremental_diff(installed,
+                                                               new_rules)
+    assert to_add == [added]
+    assert to_delete == [gone]
+    # modified rules keep the version of the rule they replace
+    assert to_modify == [({'switch': 2, 'dstip': '10.0.0.3'}, 60000,
+                          [{'outport': 4}], 1)]
+    assert to_stay == [stay]
+    assert len(installed) == 3
+    assert installed[rule_key(moved)] == to_modify[0]
+    assert installed[rule_key(added)] == added
+    assert not rule_key(gone) in installed
+
+def test_incremental_diff_ignores_count_buckets():
+    cb = CountBucket()
+    old = ({'switch': 1}, 60000, [{'outport': 1}, cb], 1)
+    installed = index_rules([old])
+    (to_add, to_delete, to_modify, to_stay) = incremental_diff(
+        installed, [({'switch': 1}, 60000, [{'outport': 1}], 2)])
+    assert to_stay == [old]
+    assert to_add == [] and to_delete == [] and to_modify == []
+
+### Stable priority tests ###
+
+def fd(**kwargs):
+    return util.frozendict(kwargs)
+
+def test_installed_priorities():
+    installed = index_rules([rule(1, '10.0.0.1', 100, 1, 1),
+                             rule(1, '10.0.0.1', 300, 1, 1),
+                             rule(2, '10.0.0.2', 200, 1, 1)])
+    priorities = installed_priorities(installed)
+    assert priorities[1][fd(switch=1, dstip='10.0.0.1')] == [300, 100]
+    assert priorities[2][fd(switch=2, dstip='10.0.0.2')] == [200]
+
+def test_assign_priorities_fresh():
+    ms = [fd(inport=i) for i in range(4)]
+    assert assign_priorities(ms, {}, 1, 100) == [81, 61, 41, 21]
+
+def test_assign_priorities_keeps_installed():
+    (a, b, c, d) = [fd(inport=i) for i in range(4)]
+    old = {a : [90], b : [60], c : [30]}
+    # inserted at the top, packed just above the first kept rule
+    assert assign_priorities([d, a, b, c], old, 1, 100) == [91, 90, 60, 30]
+    # inserted in the middle, and at the bottom
+    assert assign_priorities([a, d, b, c], old, 1, 100) == [90, 75, 60, 30]
+    assert assign_priorities([a, b, c, d], old, 1, 100) == [90, 60, 30, 29]
+    # reordered rules keep the longest ordered subsequence
+    assert assign_priorities([c, a, b], old, 1, 100) == [91, 90, 60]
+
+def test_assign_priorities_respreads_full_gap():
+    (a, b, c) = [fd(inport=i) for i in range(3)]
+    old = {a : [50], b : [49]}
+    assert assign_priorities([a, c, b], old, 1, 100) == [76, 51, 26]
+
+def test_classifier_rule_key():
+    r1 = match(switch=1, inport=2).compile().rules[0]
+    r2 = match(inport=2, switch=1).compile().rules[0]
+    assert classifier_rule_key(Rule(r1.match, [modify(outport=1)])) == \
+        classifier_rule_key(Rule(r2.match, [modify(outport=1)]))
+    assert classifier_rule_key(Rule(r1.match, [modify(outport=1)])) != \
+        classifier_rule_key(Rule(r1.match, [modify(outport=2)]))
+
+### Installer tests ###
+
+def keys(rules):
+    return set(map(rule_key, rules))
+
+def test_merge_diff_lists():
+    a1 = rule(1, '10.0.0.1', 100, 1, 1)
+    b1 = rule(1, '10.0.0.2', 100, 1, 1)
+    c2 = rule(1, '10.0.0.3', 100, 1, 2)
+    b2 = rule(1, '10.0.0.2', 100, 2, 1)
+    a3 = rule(1, '10.0.0.1', 100, 1, 3)
+    # v2 adds c and modifies b; v3 deletes c, deletes a and adds it back
+    (to_add, to_delete, to_modify, to_stay) = merge_diff_lists(
+        [([c2], [], [b2], [a1]),
+         ([a3], [c2, a1], [], [b2])])
+    assert to_add == [a3]
+    assert to_delete == [a1]
+    assert to_modify == [b2]
+    assert to_stay == []
+
+def test_merge_diff_lists_keeps_notifying_rules():
+    added = ({'switch': 1, 'dstip': '10.0.0.1'}, 100, [], 2, True)
+    assert merge_diff_lists([([added], [], [], []),
+                             ([], [added], [], [])]) is None
+
+def test_installer_coalesces_in_version_order():
+    installed = []
+    started = threading.Event()
+    release = threading.Event()
+    def install(diff_lists, version, clear):
+        started.set()
+        release.wait()
+        installed.append((keys(diff_lists[0]), version, clear))
+    installer = RuleInstaller(install)
+    r = [rule(1, '10.0.0.%d' % i, 100, 1, i) for i in range(4)]
+    installer.submit(1, ([r[1]], [], [], []), True)
+    started.wait()
+    # queued behind the first install, and submitted out of order
+    installer.submit(3, ([r[3]], [], [], []))
+    installer.submit(2, ([r[2]], [], [], []))
+    release.set()
+    assert installer.wait_idle(5)
+    assert installed[0] == (keys([r[1]]), 1, True)
+    assert installed[1] == (keys(r[2:]), 3, False)
+    stats = installer.stats()
+    assert stats['submitted'] == 3
+    assert stats['installs'] == 2
+    assert stats['coalesced'] == 1
+    assert stats['queue_depth'] == 0
+
+def test_installer_keeps_clears_as_barriers():
+    installed = []
+    started = threading.Event()
+    release = threading.Event()
+    def install(diff_lists, version, clear):
+        started.set()
+        release.wait()
+        installed.append((keys(diff_lists[0]), version, clear))
+    installer = RuleInstaller(install)
+    r = [rule(1, '10.0.0.%d' % i, 100, 1, i) for i in range(5)]
+    installer.submit(1, ([r[1]], [], [], []))
+    started.wait()
+    installer.submit(2, ([r[2]], [], [], []))
+    installer.submit(3, ([r[3]], [], [], []), True)
+    installer.submit(4, ([r[4]], [], [], []))
+    release.set()
+    assert installer.wait_idle(5)
+    # r[2] goes in before the clear, r[3] and r[4] after it
+    assert installed == [(keys([r[1]]), 1, False),
+                         (keys([r[2]]), 2, False),
+                         (keys(r[3:]), 4, True)]
+
+def test_installer_blocks_when_queue_cant_be_merged():
+    started = threading.Event()
+    release = threading.Event()
+    def install(diff_lists, version, clear):
+        started.set()
+        release.wait()
+    installer = RuleInstaller(install, max_pending=2)
+    notifying = ({'switch': 1, 'dstip': '10.0.0.1'}, 100, [], 2, True)
+    installer.submit(1, ([], [], [], []))
+    started.wait()
+    installer.submit(2, ([notifying], [], [], []))
+    installer.submit(3, ([], [notifying], [], []))
+    submitter = threading.Thread(
+        target=lambda: installer.submit(4, ([], [], [], [])))
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive()
+    release.set()
+    submitter.join(5)
+    assert not submitter.is_alive()
+    assert installer.wait_idle(5)
+    assert installer.stats()['max_queue_depth'] == 2
+
+### Multi-table pipeline tests ###
+
+def test_pipeline_rule():
+    r = pipeline_rule(Rule({'switch' : 1}, [{'vlan_id' : 3}]), PATH_IN_TABLE)
+    assert r.match == {'switch' : 1, 'table' : PATH_IN_TABLE}
+    assert r.actions == [{'vlan_id' : 3, 'goto_table' : FORWARDING_TABLE}]
+    r = pipeline_rule(Rule({'switch' : 1}, [{'vlan_id' : 3}, {'vlan_id' : 4}]),
+                      PATH_IN_TABLE)
+    assert r.actions == [{'outport' : OFPP_CONTROLLER}]
+    fwd_rule = Rule({'switch' : 1}, [{'outport' : 2}])
+    r = pipeline_rule(fwd_rule, FORWARDING_TABLE)
+    assert r.actions == [{'outport' : 2, 'goto_table' : PATH_OUT_TABLE}]
+    assert pipeline_rule(fwd_rule, FORWARDING_TABLE, False).actions == [
+        {'outport' : 2}]
+    r = pipeline_rule(Rule({'switch' : 1, 'outport' : 2}, [{}]),
+                      PATH_OUT_TABLE)
+    assert r.match == {'switch' : 1, 'outport' : 2, 'table' : PATH_OUT_TABLE}
+    assert r.actions == [{}]
+
+def test_pipeline_fanout():
+    out = ((match(outport=1) >> modify(srcport=7)) +
+           (~match(outport=1))).compile()
+    rule = (match(dstip='10.0.0.1') >> (fwd(1) + fwd(2))).compile().rules[0]
+    [r] = pipeline_fanout(rule, out).rules
+    assert r.match == match(dstip='10.0.0.1')
+    actions = list(r.actions)
+    assert len(actions) == 2
+    assert modify(outport=1, srcport=7) in actions
+    assert modify(outport=2) in actions
+
+def test_install_pipeline():
+    import logging
+    from threading import Lock
+    class FakeNetwork(object):
+        def switch_list(self):
+            return [1]
+    class FakeInstaller(object):
+        def submit(self, version, diff_lists, clear=False):
+            self.diff_lists = diff_lists
+    runtime = Runtime.__new__(Runtime)
+    runtime.log = logging.getLogger('test')
+    runtime.mode = 'proactive1'
+    runtime.network = FakeNetwork()
+    runtime.installer = FakeInstaller()
+    runtime.classifier_version_lock = Lock()
+    runtime.old_rules_lock = Lock()
+    runtime.update_buckets_lock = Lock()
+    runtime.stats_index_lock = Lock()
+    runtime.stats_index = {}
+    runtime.classifier_version_no = 0
+    runtime.old_rules = index_rules([])
+    runtime.concrete_rules_cache = {}
+    runtime.concrete_rules_switches = None
+    tagging = (match(inport=1) >> modify(srcport=5)) + ~match(inport=1)
+    fwding = match(inport=1) >> fwd(2)
+    out = (match(outport=2) >> modify(dstport=7)) + ~match(outport=2)
+    runtime.install_classifier([(PATH_IN_TABLE, tagging.compile()),
+                                (FORWARDING_TABLE, fwding.compile()),
+                                (PATH_OUT_TABLE, out.compile())])
+    rules = runtime.installer.diff_lists[0]
+    assert [(r[0], r[2]) for r in rules] == [
+        ({'switch' : 1, 'table' : 0, 'inport' : 1},
+         [{'srcport' : 5, 'goto_table' : 1}]),
+        ({'switch' : 1, 'table' : 0}, [{'goto_table' : 1}]),
+        ({'switch' : 1, 'table' : 1, 'inport' : 1},
+         [{'outport' : 2, 'goto_table' : 2}]),
+        ({'switch' : 1, 'table' : 1}, []),
+        ({'switch' : 1, 'table' : 2, 'outport' : 2}, [{'dstport' : 7}]),
+        ({'switch' : 1, 'table' : 2}, [{}])]
+    # priorities are assigned within each table
+    priorities = [r[1] for r in rules]
+    assert priorities[0] > priorities[1]
+    assert priorities[2] > priorities[3]
+    assert priorities[4] > priorities[5]
+
+### Packet-in conversion tests ###
+
+def test_concrete2pyretic_interns_addresses():
+    raw = ('\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x02\x08\x00'
+           '\x45\x00\x00\x1c\x00\x00\x00\x00\x40\x11\x00\x00'
+           '\x0a\x00\x00\x01\x0a\x00\x00\x02'
+           '\x00\x43\x00\x44\x00\x08\x00\x00')
+    runtime = Runtime.__new__(Runtime)
+    p1 = runtime.concrete2pyretic({'raw': raw, 'switch': 1, 'inport': 2})
+    p2 = runtime.concrete2pyretic({'raw': raw, 'switch': 1, 'inport': 3})
+    assert p1['srcip'] == IPAddr('10.0.0.1')
+    assert p1['dstmac'] == EthAddr('00:00:00:00:00:01')
+    assert p1['srcport'] == 67
+    assert p1['raw'] == raw
+    assert p1['switch'] == 1 and p2['inport'] == 3
+    assert p1['srcip'] is p2['srcip']
+    assert p1['srcmac'] is p2['srcmac']
+    assert None not in p1.header.values()
+    assert p1.modify(inport=3) == p2
+
+def test_cached_bounded():
+    calls = []
+    @util.cached_bounded(2)
+    def f(x):
+        calls.append(x)
+        return [x]
+    assert f(1) is f(1)
+    f(2)
+    f(3)
+    assert len(f.cache) == 1
+    f(1)
+    assert calls == [1, 2, 3, 1]
+
+### Flow stats demultiplexing tests ###
+
+def test_flow_stats_reply_demux():
+    import logging
+    from threading import Lock
+    runtime = Runtime.__new__(Runtime)
+    runtime.log = logging.getLogger('test')
+    runtime.global_outstanding_queries_lock = Lock()
+    runtime.stats_index_lock = Lock()
+    runtime.stats_index = {}
+    runtime.poller = PollScheduler()
+    b1 = CountBucket()
+    b2 = CountBucket()
+    rules = [({'switch' : 1, 'dstip' : '10.0.0.%d' % i}, 100 + i, 1)
+             for i in range(4)]
+    for (b, (m, priority, version)) in zip([b1, b1, b2, b2], rules):
+        b.add_match(m, priority, version)
+        runtime.add_stats_index(m, priority, version, b)
+    received = {}
+    for b in [b1, b2]:
+        b.handle_flow_stats_reply = (
+            lambda b: lambda s, stats: received.setdefault(b, stats))(b)
+    runtime.global_outstanding_queries = {1 : [b1, b2]}
+    stats = [{'match' : repr({'dstip' : m['dstip']}), 'actions' : '[]',
+              'priority' : priority, 'cookie' : version,
+              'packet_count' : 1, 'byte_count' : 10}
+             for (m, priority, version) in rules[1:] + [({'dstip' :
+                                                          '10.0.1.1'}, 1, 1)]]
+    runtime.handle_flow_stats_reply(1, stats)
+    assert [f['priority'] for f in received[b1]] == [101]
+    assert [f['priority'] for f in received[b2]] == [103, 102]
+    assert runtime.global_outstanding_queries == {}
+
+def test_stats_index_drops_stale_rules():
+    from threading import Lock
+    runtime = Runtime.__new__(Runtime)
+    runtime.stats_index_lock = Lock()
+    runtime.stats_index = {}
+    b = CountBucket()
+    rules = [({'switch' : s, 'dstip' : '10.0.0.%d' % i}, 100 + i, 1)
+             for s in [1, 2] for i in range(2)]
+    for (m, priority, version) in rules:
+        runtime.add_stats_index(m, priority, version, b)
+    # version 2 keeps the first rule of each switch and adds one
+    installed = [(m, priority, [b], version)
+                 for (m, priority, version) in rules[0::2]]
+    installed.append(({'switch' : 1, 'dstip' : '10.0.1.1'}, 50, [b], 2))
+    for (m, priority, _, version) in installed[2:]:
+        runtime.add_stats_index(m, priority, version, b)
+    runtime.prune_stats_index(installed, 2)
+    assert (set(runtime.stats_index.keys()) ==
+            set(stats_index_key(m, priority, version)
+                for (m, priority, _, version) in installed))
+    runtime.remove_switch_stats_index(1)
+    assert runtime.stats_index.keys() == [stats_index_key(*rules[2])]
+    runtime.clear_stats_index()
+    assert runtime.stats_index == {}
+
+### Poll scheduler tests ###
+
+def test_poll_scheduler_shares_ticks():
+    class FakeRuntime(object):
+        def __init__(self):
+            self.requests = []
+        def request_flow_stats(self, switch):
+            self.requests.append(switch)
+    runtime = FakeRuntime()
+    poller = PollScheduler(jitter=0.5)
+    poller.attach(runtime)
+    assert poller.tick_after(2.0, 5.0) >= 6.0
+    assert poller.tick_after(2.0, 5.0) <= 7.0
+    calls = []
+    def query(name, switches):
+        def pull():
+            calls.append(name)
+            for s in switches:
+                poller.request_stats(s)
+        return pull
+    poller.fire([query('a', [1, 2]), query('b', [2]), query('c', [2, 1])])
+    assert calls == ['a', 'b', 'c']
+    assert sorted(runtime.requests) == [1, 2]
+    # outside a tick, requests are sent right away
+    poller.request_stats(3)
+    assert runtime.requests[-1] == 3
+    poller.stats_received(1)
+    poller.stats_received(1)
+    poller.stats_received(4)
+    latency = poller.poll_latency()
+    assert sorted(latency.keys()) == [1]
+    assert latency[1]['polls'] == 1
+    assert latency[1]['max_latency'] >= latency[1]['mean_latency'] >= 0
+
+def test_poll_scheduler_runs_jobs():
+    poller = PollScheduler()
+    ticks = []
+    done = threading.Event()
+    def job():
+        ticks.append(threading.current_thread())
+        if len(ticks) == 3:
+            done.set()
+    poller.register(0.01, job)
+    assert done.wait(5)
+    poller.unregister(0.01, job)
+    assert poller.jobs == {} and poller.next_tick == {}
+    assert set(ticks) == set([poller.thread])
+
+def test_polled_queries_follow_the_policy():
+    from pyretic.lib.query import counts, count_packets
+    def runtime_with(policy):
+        runtime = Runtime.__new__(Runtime)
+        runtime.policy = policy
+        runtime.polled_sub_pols = []
+        runtime.poller = PollScheduler()
+        runtime.update_polled_sub_pols()
+        return runtime
+    q1 = counts(5, ['srcip'])
+    q2 = count_packets(5)
+    r1 = runtime_with(q1 + q2)
+    assert r1.poller.jobs == {5 : [q1.pull_stats, q2.report]}
+    # a second runtime gets its own scheduler and takes q2 over
+    r2 = runtime_with(q2)
+    assert q2.poller is r2.poller
+    assert r1.poller.jobs == {5 : [q1.pull_stats]}
+    assert r2.poller.jobs == {5 : [q2.report]}
+    r1.policy = drop
+    r1.update_polled_sub_pols()
+    assert q1.poller is None and r1.poller.jobs == {}
+    assert r1.poller.thread is not r2.poller.thread
+
+### Compiled evaluation tests ###
+
+def test_classifier_eval_matches_interpreter_on_buckets():
+    import logging
+    from pyretic.core.language_tools import queries_in_eval
+    class FakeRuntime(object):
+        def __init__(self, policy):
+            self.policy = policy
+            self.compiled_eval_failed = False
+            self.buckets_see_modified = None
+            self.log = logging.getLogger('test')
+    def interpret(policy, pkt):
+        # as Runtime.handle_packet_in does
+        (queries, _) = queries_in_eval((set(), {pkt}), policy)
+        return (queries, policy.eval(pkt))
+    def both_paths(make_policy, pkt):
+        """ Whether the classifier was used, and the results and bucket
+        contents of the compiled and interpreted paths."""
+        (policy, b) = make_policy()
+        runtime = FakeRuntime(policy)
+        result = Runtime.classifier_eval.im_func(runtime, pkt)
+        used_classifier = result is not None
+        if result is None:
+            result = interpret(policy, pkt)
+        compiled = (result, b.bucket)
+        (policy, b) = make_policy()
+        return (used_classifier, compiled, (interpret(policy, pkt), b.bucket))
+    def modified_then_counted():
+        b = CountBucket()
+        return ((modify(srcport=80) >> b) + fwd(1), b)
+    def counted():
+        b = CountBucket()
+        return (b + fwd(1), b)
+    pkt = Packet({'switch' : 1, 'inport' : 1, 'srcport' : 9})
+    (used_classifier, (result, seen), (ref_result, ref_seen)) = both_paths(
+        modified_then_counted, pkt)
+    assert not used_classifier
+    assert seen == ref_seen == {pkt.modify(srcport=80)}
+    assert result[1] == ref_result[1]
+    (used_classifier, (result, seen), (ref_result, ref_seen)) = both_paths(
+        counted, pkt)
+    assert used_classifier
+    assert seen == ref_seen == {pkt}
+    assert result[1] == ref_result[1]
+
+def test_classifier_eval_checks_buckets_once_per_policy(monkeypatch):
+    import logging
+    import pyretic.core.runtime as runtime_module
+    walks = []
+    def counting_check(policy):
+        walks.append(policy)
+        return False
+    monkeypatch.setattr(runtime_module, 'buckets_see_modified_packets',
+                        counting_check)
+    runtime = Runtime.__new__(Runtime)
+    runtime.policy = CountBucket() + fwd(1)
+    runtime.compiled_eval_failed = False
+    runtime.buckets_see_modified = None
+    runtime.log = logging.getLogger('test')
+    pkt = Packet({'switch' : 1, 'inport' : 1})
+    for _ in range(3):
+        assert runtime.classifier_eval(pkt) is not None
+    assert len(walks) == 1